@@ -0,0 +1,5 @@
+#
+# bot_log2mat converts LCM logs to matrices; see log_to_mat for the converter
+# and log_dataset for LogDataset, lazy access to the channels of a log.
+
+from log_dataset import LogDataset
@@ -0,0 +1,383 @@
+#!/usr/bin/python
+#
+# Time alignment of the channels of a converted log, for bot-log2mat-align.
+#
+# Channels recorded at different rates are resampled onto one reference
+# clock, either the times of a reference channel or a fixed rate, giving one
+# table with a row per reference time:
+#
+#   time  CHAN1.col ... CHAN1.log_time  CHAN2.col ... CHAN2.log_time ...
+#
+# Each channel is resampled with one of
+#
+#   nearest   the row closest in time, optionally only within a tolerance
+#   previous  the last row at or before the reference time
+#   linear    linear interpolation between the rows around the reference
+#             time, and spherical linear interpolation of the quaternion
+#             fields (orientation, quat, ...)
+#
+# The reference times are looked up in all the rows of a channel at once
+# with numpy.searchsorted.  Reference times outside a channel's rows give
+# NaN, except with nearest.  The times are either the log time of the rows
+# (seconds from the start of the log) or their utime field (microseconds).
+#
+# The channels come from a log, converted with iter_channels, or from an
+# HDF5 file written by bot-log2mat.  Channels with variable length messages
+# have no fixed columns to align; --fields can select the fixed ones.
+
+import os
+import re
+import sys
+import getopt
+import numpy
+
+# check which version for mio location
+if sys.version_info < (2, 6):
+    import scipy.io.mio
+else:
+    import scipy.io.matlab.mio
+
+METHODS = ("nearest", "previous", "linear")
+CLOCKS = ("log_time", "utime")
+# clock units per second
+_CLOCK_SCALE = { "log_time" : 1.0, "utime" : 1e6 }
+# fields whose 4 columns are a quaternion, by their last name component
+QUATERNION_NAMES = ("orientation", "quat", "quaternion")
+
+_ELEMENT = re.compile(r"^(.*)\[(\d+)\]$")
+
+_VARIABLE_LENGTH = "channel %s has variable length messages, which can not be aligned; " \
+        "select its fixed length fields with --fields"
+
+class ChannelTable(object):
+    """Rows of one channel, the matrix of convert() with its column names,
+    the last one being log_time."""
+
+    def __init__(self, channel, matrix, columns):
+        matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape((-1, len(columns)))
+        if matrix.shape[1] != len(columns):
+            raise ValueError(_VARIABLE_LENGTH % channel)
+        self.channel = channel
+        self.matrix = matrix
+        self.columns = list(columns)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def column(self, name):
+        try:
+            return self.matrix[:, self.columns.index(name)]
+        except ValueError:
+            raise ValueError("channel %s has no %s column" % (self.channel, name))
+
+    def times(self, clock="log_time"):
+        if clock not in CLOCKS:
+            raise ValueError("unknown clock %s, expected one of %s" % (clock, ", ".join(CLOCKS)))
+        if clock == "log_time":
+            return self.matrix[:, -1]
+        return self.column(clock)
+
+    def quaternions(self, names=QUATERNION_NAMES):
+        """Return the index of the first of every 4 columns name[0] .. name[3]
+        of the fields whose last name component is in names."""
+        starts = []
+        for i, column in enumerate(self.columns[:-3]):
+            m = _ELEMENT.match(column)
+            if m is None or m.group(2) != "0":
+                continue
+            name = m.group(1)
+            if name.split(".")[-1] not in names:
+                continue
+            if self.columns[i:i + 4] == [ "%s[%d]" % (name, k) for k in range(4) ] and \
+                    "%s[4]" % name not in self.columns:
+                starts.append(i)
+        return starts
+
+def load_log(fname, channelsToProcess=".*", channelsToIgnore=None, lcm_packages=None,
+        fields=None, verbose=False):
+    """Convert the channels of a log and return their ChannelTables.  The
+    channels with variable length messages are left out with a warning."""
+    from log_to_mat import iter_channels
+    tables = []
+    for channel, matrix, columns in iter_channels(fname, channelsToProcess,
+            channelsToIgnore, lcm_packages, verbose=verbose, fields=fields, columns=True):
+        if matrix.ndim == 2 and matrix.shape[1] != len(columns):
+            sys.stderr.write("%s, skipping it\n" % (_VARIABLE_LENGTH % channel))
+            continue
+        tables.append(ChannelTable(channel, matrix, columns))
+    return tables
+
+def load_hdf5(fname, channelsToProcess=".*", channelsToIgnore=None):
+    """Return the ChannelTables of the channels of an HDF5 file written by
+    bot-log2mat, leaving out those with variable length messages."""
+    from hdf5_output import h5py
+    if h5py is None:
+        raise ImportError("reading hdf5 files needs the h5py module")
+    process = re.compile(channelsToProcess)
+    ignore = channelsToIgnore and re.compile(channelsToIgnore)
+    tables = []
+    f = h5py.File(fname, "r")
+    try:
+        for name in sorted(f):
+            group = f[name]
+            channel = group.attrs.get("channel", name)
+            if not process.match(channel) or (ignore and ignore.match(channel)):
+                continue
+            if "data" not in group or "columns" not in group["data"].attrs:
+                # ragged or bot-log2struct output
+                continue
+            data = group["data"]
+            if group.attrs.get("min_width", data.shape[1]) != data.shape[1]:
+                sys.stderr.write("%s, skipping it\n" % (_VARIABLE_LENGTH % channel))
+                continue
+            tables.append(ChannelTable(channel, data[...], list(data.attrs["columns"])))
+    finally:
+        f.close()
+    return tables
+
+def _sorted(table, clock):
+    t = table.times(clock)
+    if len(t) > 1 and (numpy.diff(t) < 0).any():
+        order = numpy.argsort(t, kind="mergesort")
+        return t[order], table.matrix[order]
+    return t, table.matrix
+
+def _take(values, index, valid):
+    out = values[numpy.clip(index, 0, len(values) - 1)]
+    out[~valid] = numpy.nan
+    return out
+
+def align_nearest(t, values, tref, tolerance=None):
+    """Rows of values, at the sorted times t, closest to the times tref."""
+    if len(t) == 0:
+        return numpy.nan * numpy.ones((len(tref), values.shape[1]))
+    i = numpy.clip(numpy.searchsorted(t, tref), 1, max(len(t) - 1, 1))
+    if len(t) == 1:
+        i = numpy.zeros(len(tref), dtype=numpy.intp)
+    else:
+        # the earlier row on ties
+        i -= tref - t[i - 1] <= t[i] - tref
+    valid = numpy.ones(len(tref), dtype=bool)
+    if tolerance is not None:
+        valid = numpy.abs(t[i] - tref) <= tolerance
+    return _take(values, i, valid)
+
+def align_previous(t, values, tref):
+    """Last rows of values, at the sorted times t, at or before the times
+    tref."""
+    i = numpy.searchsorted(t, tref, "right") - 1
+    return _take(values, i, i >= 0)
+
+def slerp(q0, q1, f):
+    """Spherical linear interpolation from the unit quaternions q0 to q1,
+    rows of w, x, y, z, by the fractions f."""
+    d = (q0 * q1).sum(axis=1)
+    # the shorter way round
+    q1 = numpy.where((d < 0)[:, None], -q1, q1)
+    d = numpy.abs(d)
+    theta = numpy.arccos(numpy.minimum(d, 1.0))
+    s = numpy.sin(theta)
+    close = s < 1e-6
+    s[close] = 1.0
+    w0 = numpy.where(close, 1.0 - f, numpy.sin((1.0 - f) * theta) / s)
+    w1 = numpy.where(close, f, numpy.sin(f * theta) / s)
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    norm = numpy.sqrt((q * q).sum(axis=1))
+    norm[norm == 0] = 1.0
+    return q / norm[:, None]
+
+def align_linear(t, values, tref, quaternions=()):
+    """Rows of values, at the sorted times t, linearly interpolated at the
+    times tref, slerping the 4 columns from each index in quaternions."""
+    if len(t) < 2:
+        return align_nearest(t, values, tref, tolerance=0.0)
+    i = numpy.clip(numpy.searchsorted(t, tref, "right"), 1, len(t) - 1)
+    t0 = t[i - 1]
+    dt = t[i] - t0
+    # repeated times: take the first of the rows
+    f = numpy.where(dt > 0, (tref - t0) / numpy.where(dt > 0, dt, 1.0), 0.0)
+    v0 = values[i - 1]
+    v1 = values[i]
+    out = v0 + f[:, None] * (v1 - v0)
+    for k in quaternions:
+        out[:, k:k + 4] = slerp(v0[:, k:k + 4], v1[:, k:k + 4], f)
+    out[(tref < t[0]) | (tref > t[-1])] = numpy.nan
+    return out
+
+def reference_times(tables, reference, clock="log_time"):
+    """Times to align on: those of the channel named reference, or at
+    reference Hz over the times that all the tables cover."""
+    if isinstance(reference, basestring):
+        for table in tables:
+            if table.channel == reference:
+                return numpy.sort(table.times(clock), kind="mergesort")
+        raise ValueError("reference channel %s not found" % reference)
+    if reference <= 0:
+        raise ValueError("the reference rate must be positive")
+    tables = [ table for table in tables if len(table) ]
+    if not tables:
+        return numpy.zeros(0)
+    start = max([ table.times(clock).min() for table in tables ])
+    end = min([ table.times(clock).max() for table in tables ])
+    step = _CLOCK_SCALE[clock] / float(reference)
+    if end < start:
+        return numpy.zeros(0)
+    return start + numpy.arange(int(numpy.floor((end - start) / step)) + 1) * step
+
+def align(tables, reference, methods=None, method="nearest", clock="log_time",
+        tolerance=None, quaternions=QUATERNION_NAMES):
+    """Align ChannelTables on a reference clock, see above.
+
+    reference is the name of a channel or a rate in Hz, methods a dict mapping
+    channel names to their method, the others using method.  tolerance, in
+    seconds, limits nearest to the rows that close to the reference times.
+    quaternions are the names of the fields that linear slerps.  Returns
+    (columns, matrix): the column names, the first one being time, and a row
+    per reference time.
+    """
+    if methods is None:
+        methods = {}
+    for m in [ method ] + methods.values():
+        if m not in METHODS:
+            raise ValueError("unknown alignment method %s, expected one of %s" %
+                    (m, ", ".join(METHODS)))
+    tref = reference_times(tables, reference, clock)
+    if tolerance is not None:
+        tolerance *= _CLOCK_SCALE[clock]
+
+    columns = [ "time" ]
+    parts = [ tref[:, None] ]
+    for table in tables:
+        t, values = _sorted(table, clock)
+        m = methods.get(table.channel, method)
+        if m == "nearest":
+            aligned = align_nearest(t, values, tref, tolerance)
+        elif m == "previous":
+            aligned = align_previous(t, values, tref)
+        else:
+            aligned = align_linear(t, values, tref, table.quaternions(quaternions))
+        columns += [ "%s.%s" % (table.channel, c) for c in table.columns ]
+        parts.append(aligned)
+    return columns, numpy.hstack(parts)
+
+def save_aligned(outFname, columns, matrix):
+    """Write an aligned table to a .mat file, as the matrix aligned and the
+    cell array aligned_columns, or as CSV with a header line if outFname
+    ends with .csv."""
+    if os.path.splitext(outFname)[1] == ".csv":
+        numpy.savetxt(outFname, matrix, fmt="%.17g", delimiter=",",
+                header=",".join(columns), comments="")
+        return
+    data = { "aligned" : matrix,
+             "aligned_columns" : numpy.array(columns, dtype=numpy.object) }
+    if sys.version_info < (2, 6):
+        scipy.io.mio.savemat(outFname, data)
+    else:
+        scipy.io.matlab.mio.savemat(outFname, data, oned_as='row')
+
+longOpts = [ "help", "reference=", "channelsToProcess=", "ignore=", "outfile=", "lcmtype_pkgs=",
+        "method=", "clock=", "tolerance=", "fields=" ]
+
+def usage():
+    pname, sname = os.path.split(sys.argv[0])
+    sys.stderr.write("usage: % s %s < filename > \n" % (sname, str(longOpts)))
+    print """
+    Align the channels of a log, or of an hdf5 file written by bot-log2mat,
+    on one clock, and write them as one table.
+
+    -h --help                 print this message
+    -r --reference=chan|hz    align on the times of channel [chan], or at [hz] over the times
+                              that all the channels cover (required)
+    -c --channelsToProcess=chan        Align channelsToProcess that match Python regex [chan] defaults to [".*"]
+    -i --ignore=chan          Ignore channelsToProcess that match Python regex [chan]
+    -o --outfile=ofname       output data to [ofname] instead of default [filename_aligned.mat],
+                              as csv if it ends with .csv
+    -l --lcmtype_pkgs=pkgs    load LCM types from comma seperated list of packages [pkgs] defaults to all packages on the python path
+                              an entry of [pkgs] may be a directory of .lcm files, whose types are
+                              decoded without their lcm-gen python modules
+    -m --method=[chan=]meth   resample the channels that match [chan], or all channels, with
+                              [meth], nearest, previous or linear defaults to [nearest]
+                              (can be repeated)
+       --clock=clock          align on [clock], log_time or utime defaults to [log_time]
+       --tolerance=sec        with nearest, leave out the rows further than [sec] seconds from
+                              the reference times
+       --fields=chan:f[,f...] only convert the fields [f] of the channels that match [chan]
+                              (can be repeated)
+    """
+    sys.exit()
+
+def main():
+    from flatten import parse_fields_setting
+    from event_filter import parse_channel_setting, channel_setting
+    from conversion import default_output_name
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hr:c:i:o:l:m:", longOpts)
+    except getopt.GetoptError, err:
+        print str(err)
+        usage()
+    if len(args) != 1:
+        usage()
+    fname = args[0]
+    outFname = default_output_name(fname, "_aligned") + ".mat"
+    reference = None
+    channelsToProcess = ".*"
+    channelsToIgnore = None
+    lcm_packages = None
+    methodSettings = []
+    clock = "log_time"
+    tolerance = None
+    fields = []
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+            elif o in ("-r", "--reference"):
+                try:
+                    reference = float(a)
+                except ValueError:
+                    reference = a
+            elif o in ("-c", "--channelsToProcess"):
+                channelsToProcess = a
+            elif o in ("-i", "--ignore"):
+                channelsToIgnore = a
+            elif o in ("-o", "--outfile"):
+                outFname = a
+            elif o in ("-l", "--lcmtype_pkgs"):
+                lcm_packages = a.split(",")
+            elif o in ("-m", "--method"):
+                methodSettings.append(parse_channel_setting(a, str))
+            elif o == "--clock":
+                clock = a
+            elif o == "--tolerance":
+                tolerance = float(a)
+            elif o == "--fields":
+                fields.append(parse_fields_setting(a))
+    except ValueError, err:
+        sys.stderr.write("error: %s\n" % err)
+        sys.exit(1)
+    if reference is None:
+        usage()
+
+    try:
+        if os.path.splitext(fname)[1] in (".h5", ".hdf5"):
+            tables = load_hdf5(fname, channelsToProcess, channelsToIgnore)
+        else:
+            tables = load_log(fname, channelsToProcess, channelsToIgnore, lcm_packages,
+                    fields or None)
+        methods = {}
+        for table in tables:
+            m = channel_setting(methodSettings, table.channel)
+            if m is not None:
+                methods[table.channel] = m
+        columns, matrix = align(tables, reference, methods, clock=clock, tolerance=tolerance)
+    except ValueError, err:
+        sys.stderr.write("error: %s\n" % err)
+        sys.exit(1)
+    save_aligned(outFname, columns, matrix)
+    sys.stderr.write("aligned %d channels on %d reference times, wrote %s\n" %
+            (len(tables), len(matrix), outFname))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#
+# Conversion of all the logs in a directory, for bot-log2mat --batch.
+#
+# Every LCM log under the directory is converted to its own output file,
+# including the numbered parts (.00, .01, ...) that lcm-logger writes when it
+# splits a log.  Logs are recognized by the sync word of their first event,
+# whatever their name.  The logs are shared out between a pool of worker
+# processes, largest first, and every worker uses the type dictionary that
+# the parent found once.  Logs whose output is newer than the log itself are
+# skipped.
+
+import os
+import sys
+import time
+import struct
+import multiprocessing
+
+from event_log import SYNC_WORD
+from scan_for_lcmtypes import get_lcmtype_dictionary
+from conversion import default_output_name
+from conversion_stats import ConversionStats
+
+_SYNC_BYTES = struct.pack(">I", SYNC_WORD)
+
+def is_lcm_log(fname):
+    """Check whether a file starts with an LCM event."""
+    try:
+        f = open(fname, "rb")
+    except IOError:
+        return False
+    try:
+        return f.read(len(_SYNC_BYTES)) == _SYNC_BYTES
+    finally:
+        f.close()
+
+def find_logs(directory):
+    """Return the LCM logs under directory, in sorted order."""
+    logs = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for name in sorted(filenames):
+            fname = os.path.join(dirpath, name)
+            if os.path.isfile(fname) and is_lcm_log(fname):
+                logs.append(fname)
+    return logs
+
+def output_name(fname, directory, outDir=None, outFormat="mat"):
+    """Output file of a log found under directory: the default output file
+    of the log, or the same name at the same relative path under outDir."""
+    name = default_output_name(fname)
+    if outDir is not None:
+        relDir = os.path.relpath(os.path.dirname(os.path.abspath(fname)),
+                os.path.abspath(directory))
+        name = os.path.normpath(os.path.join(outDir, relDir, os.path.basename(name)))
+    if outFormat == "hdf5":
+        return name + ".h5"
+    return name + ".mat"
+
+def is_up_to_date(fname, outFname):
+    return os.path.exists(outFname) and \
+            os.path.getmtime(outFname) >= os.path.getmtime(fname)
+
+class BatchResult(object):
+    """Outcome of the conversion of one log."""
+    __slots__ = ["fname", "outFname", "count", "payloadBytes", "seconds", "error"]
+
+    def __init__(self, fname, outFname, count=0, payloadBytes=0, seconds=0.0, error=None):
+        self.fname = fname
+        self.outFname = outFname
+        self.count = count
+        self.payloadBytes = payloadBytes
+        self.seconds = seconds
+        self.error = error
+
+# set in each worker process by _init_worker
+_worker = {}
+
+def _init_worker(convert, type_db, options):
+    _worker["convert"] = convert
+    _worker["type_db"] = type_db
+    _worker["options"] = options
+
+def _convert_log(job):
+    fname, outFname = job
+    stats = ConversionStats()
+    t0 = time.time()
+    try:
+        outDir = os.path.dirname(outFname)
+        if not os.path.isdir(outDir):
+            try:
+                os.makedirs(outDir)
+            except OSError:
+                # made by another worker in the meantime
+                pass
+        _worker["convert"](fname, outFname, type_db=_worker["type_db"], stats=stats,
+                **_worker["options"])
+    except Exception, err:
+        return BatchResult(fname, outFname, seconds=time.time() - t0,
+                error="%s: %s" % (err.__class__.__name__, err))
+    channels = stats.channels.values()
+    return BatchResult(fname, outFname, sum([ c.count for c in channels ]),
+            sum([ c.payloadBytes for c in channels ]), time.time() - t0)
+
+def convert_batch(directory, convert, outDir=None, jobs=None, lcm_packages=None,
+        outFormat="mat", progress=False, **options):
+    """Convert every log under directory with a pool of jobs processes, by
+    default one per CPU.
+
+    convert(fname, out, type_db=..., stats=..., **options) converts one log,
+    e.g. log_to_mat.convert.  Returns (results, skipped): a BatchResult for
+    every log that was converted, in the order they finished, and the logs
+    whose output was up to date.
+    """
+    todo = []
+    skipped = []
+    for fname in find_logs(directory):
+        outFname = output_name(fname, directory, outDir, outFormat)
+        if is_up_to_date(fname, outFname):
+            skipped.append(fname)
+        else:
+            todo.append((fname, outFname))
+    # the largest logs first, so that no worker is left with one at the end
+    todo.sort(key=lambda job: -os.path.getsize(job[0]))
+
+    results = []
+    if not todo:
+        return results, skipped
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(todo)))
+    if progress:
+        sys.stderr.write("converting %d logs with %d processes, %d up to date\n" %
+                (len(todo), jobs, len(skipped)))
+    type_db = get_lcmtype_dictionary(lcm_packages)
+    options = dict(options)
+    options["outFormat"] = outFormat
+    pool = multiprocessing.Pool(jobs, _init_worker, (convert, type_db, options))
+    try:
+        for result in pool.imap_unordered(_convert_log, todo):
+            results.append(result)
+            if progress:
+                if result.error is None:
+                    sys.stderr.write("[%d/%d] converted %s\n" % (len(results), len(todo), result.fname))
+                else:
+                    sys.stderr.write("[%d/%d] error converting %s: %s\n" %
+                            (len(results), len(todo), result.fname, result.error))
+    finally:
+        pool.close()
+        pool.join()
+    return results, skipped
+
+def report_batch(results, skipped, wallTime, directory=None, out=sys.stderr):
+    """Print the messages, payload and throughput of every converted log."""
+    header = "%-40s %9s %10s %9s %10s %8s" % ("log", "messages", "payload MB",
+            "seconds", "messages/s", "MB/s")
+    out.write(header + "\n")
+    out.write("-" * len(header) + "\n")
+    total = BatchResult("total", None)
+    failed = 0
+    for result in sorted(results, key=lambda r: r.fname):
+        name = result.fname
+        if directory is not None:
+            name = os.path.relpath(name, directory)
+        if result.error is not None:
+            failed += 1
+            out.write("%-40s failed: %s\n" % (name, result.error))
+            continue
+        out.write(_format_result(name, result))
+        total.count += result.count
+        total.payloadBytes += result.payloadBytes
+        total.seconds += result.seconds
+    out.write("-" * len(header) + "\n")
+    out.write(_format_result("total", total))
+    out.write("%d logs converted, %d failed, %d up to date in %.2f s wall time" %
+            (len(results) - failed, failed, len(skipped), wallTime))
+    if wallTime > 0:
+        out.write(", %.0f messages/s, %.1f MB/s of payload" %
+                (total.count / wallTime, total.payloadBytes / wallTime / 1e6))
+    out.write("\n")
+
+def _format_result(name, result):
+    rate = 0.0
+    mbRate = 0.0
+    if result.seconds > 0:
+        rate = result.count / result.seconds
+        mbRate = result.payloadBytes / result.seconds / 1e6
+    return "%-40s %9d %10.2f %9.2f %10.0f %8.1f\n" % (name, result.count,
+            result.payloadBytes / 1e6, result.seconds, rate, mbRate)
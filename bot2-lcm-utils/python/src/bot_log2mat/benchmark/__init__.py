@@ -0,0 +1,5 @@
+#
+# Benchmarks of the log converters.
+#
+#   synthetic_log   writes reproducible synthetic LCM logs
+#   run_benchmark   times bot-log2mat and bot-log2struct on such a log
@@ -0,0 +1,272 @@
+#!/usr/bin/python
+#
+# Benchmark of bot-log2mat and bot-log2struct.
+#
+# Converts a log, by default a synthetic one (see synthetic_log), with each
+# converter a number of times and reports as JSON, for every converter, the
+# wall time, the throughput, the peak RSS and the time spent in each stage:
+#
+#   read     reading the events and their payloads from the log
+#   decode   decoding the payloads
+#   flatten  flattening the decoded messages into rows or fields
+#   save     writing the output file
+#
+# The converters run in child processes, the way they are run from the
+# command line, so that the peak RSS of every run is measured on its own.
+# The decode, flatten and save times are the ones the converters report with
+# --stats-json; the read time is measured separately by reading the log
+# without decoding it.
+
+import os
+import sys
+import time
+import json
+import getopt
+import shutil
+import platform
+import tempfile
+import subprocess
+import numpy
+
+import bot_log2mat
+from bot_log2mat.event_log import MmapEventLog
+from bot_log2mat.benchmark.synthetic_log import write_log, DEFAULT_CHANNELS
+
+CONVERTERS = [
+    ("log2mat", "bot_log2mat.log_to_mat"),
+    ("log2struct", "bot_log2mat.log_to_struct"),
+]
+
+def time_read(fname):
+    """Read every event of a log and its payload.  Returns (seconds,
+    events, payload bytes)."""
+    t0 = time.time()
+    count = 0
+    nbytes = 0
+    log = MmapEventLog(fname)
+    try:
+        for e in log:
+            count += 1
+            nbytes += len(e.data[:])
+    finally:
+        log.close()
+    return time.time() - t0, count, nbytes
+
+def _child_env():
+    env = dict(os.environ)
+    srcdir = os.path.dirname(os.path.dirname(os.path.abspath(bot_log2mat.__file__)))
+    path = env.get("PYTHONPATH", "")
+    env["PYTHONPATH"] = path and srcdir + os.pathsep + path or srcdir
+    return env
+
+def run_converter(module, logFname, workdir, args=()):
+    """Convert a log with the converter module in a child process.
+
+    Returns a dict with the wall time, the peak RSS in KiB and the statistics
+    the converter wrote with --stats-json.
+    """
+    outFname = os.path.join(workdir, "out.mat")
+    statsFname = os.path.join(workdir, "stats.json")
+    errFname = os.path.join(workdir, "stderr.txt")
+    cmd = [ sys.executable, "-m", module, logFname, "-o", outFname,
+            "--stats-json=" + statsFname ] + list(args)
+    if os.path.exists(statsFname):
+        os.remove(statsFname)
+    err = open(errFname, "w")
+    devnull = open(os.devnull, "w")
+    try:
+        t0 = time.time()
+        p = subprocess.Popen(cmd, stdout=devnull, stderr=err, env=_child_env())
+        pid, status, rusage = os.wait4(p.pid, 0)
+        wall = time.time() - t0
+        p.returncode = status
+    finally:
+        err.close()
+        devnull.close()
+    # the converters exit with status 0 after printing their usage
+    if status != 0 or not os.path.exists(statsFname):
+        tail = open(errFname).read()[-2000:]
+        raise RuntimeError("%s failed:\n%s" % (" ".join(cmd), tail))
+
+    # ru_maxrss is in bytes on OS X and in KiB elsewhere
+    peakRss = rusage.ru_maxrss
+    if sys.platform == "darwin":
+        peakRss //= 1024
+    f = open(statsFname)
+    try:
+        stats = json.load(f)
+    finally:
+        f.close()
+    return { "wall_time" : wall, "peak_rss_kb" : peakRss, "stats" : stats }
+
+def summarize(runs, readTime):
+    """Combine the runs of one converter.  Rates and stage times are taken
+    from the fastest run."""
+    walls = [ r["wall_time"] for r in runs ]
+    best = runs[numpy.argmin(walls)]
+    channels = best["stats"]["channels"]
+    count = sum([ c["count"] for c in channels ])
+    payloadBytes = sum([ c["payload_bytes"] for c in channels ])
+    wall = best["wall_time"]
+    return {
+        "runs" : len(runs),
+        "wall_time" : { "min" : min(walls), "median" : float(numpy.median(walls)),
+                        "max" : max(walls) },
+        "messages" : count,
+        "payload_bytes" : payloadBytes,
+        "output_bytes" : sum([ c["output_bytes"] for c in channels ]),
+        "messages_per_s" : count / wall,
+        "payload_mb_per_s" : payloadBytes / wall / 1e6,
+        "peak_rss_kb" : max([ r["peak_rss_kb"] for r in runs ]),
+        "stages" : {
+            "read" : readTime,
+            "decode" : sum([ c["decode_time"] for c in channels ]),
+            "flatten" : sum([ c["flatten_time"] for c in channels ]),
+            "save" : best["stats"].get("save_time", 0.0),
+        },
+        "channels" : channels,
+    }
+
+def environment():
+    return {
+        "date" : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python" : platform.python_version(),
+        "numpy" : numpy.__version__,
+        "platform" : platform.platform(),
+        "machine" : platform.machine(),
+        "processor" : platform.processor(),
+    }
+
+def run_benchmark(logFname, converters=None, repeat=3, args=(), workdir=None):
+    """Benchmark the converters (names from CONVERTERS, all of them by
+    default) on a log, passing them the extra command line args.  Returns
+    the report as a dict."""
+    if converters is None:
+        converters = [ name for name, module in CONVERTERS ]
+    if repeat < 1:
+        raise ValueError("the converters must run at least once")
+    modules = dict(CONVERTERS)
+    for name in converters:
+        if name not in modules:
+            raise ValueError("unknown converter %r, expected one of %s" %
+                    (name, ", ".join(modules)))
+    if workdir is None:
+        workdir = os.path.dirname(os.path.abspath(logFname))
+
+    # read once so that all runs start with the log in the page cache
+    time_read(logFname)
+    readTimes = []
+    for i in range(repeat):
+        seconds, count, nbytes = time_read(logFname)
+        readTimes.append(seconds)
+
+    report = {
+        "environment" : environment(),
+        "log" : { "file" : logFname, "size" : os.path.getsize(logFname),
+                  "events" : count, "payload_bytes" : nbytes },
+        "converter_args" : list(args),
+        "converters" : {},
+    }
+    for name in converters:
+        runs = []
+        for i in range(repeat):
+            runs.append(run_converter(modules[name], logFname, workdir, args))
+        report["converters"][name] = summarize(runs, min(readTimes))
+    return report
+
+def usage():
+    pname, sfx = os.path.splitext(os.path.basename(sys.argv[0]))
+    print "usage: %s [options] [-- converter options]" % pname
+    print """
+Time bot-log2mat and bot-log2struct on a synthetic log and print the results
+as JSON.  Options after -- are passed to the converters, e.g. -- -j 4.
+
+Options:
+    -l, --log=FILE         benchmark an existing log instead of a synthetic one
+    -c, --channel=SPEC     add a channel to the synthetic log, see
+                           bot_log2mat.benchmark.synthetic_log
+                           (default: %s)
+    -d, --duration=SEC     seconds of synthetic log (default 60)
+    -s, --seed=N           seed of the synthetic log (default 0)
+    -r, --repeat=N         runs of each converter (default 3)
+        --converter=NAME   only benchmark NAME (log2mat or log2struct),
+                           can be repeated
+    -o, --output=FILE      write the report to FILE instead of stdout
+    -k, --keep             keep the synthetic log and the converter outputs
+    -h, --help             print this message
+""" % " ".join(DEFAULT_CHANNELS)
+    sys.exit()
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hl:c:d:s:r:o:k",
+                ["help", "log=", "channel=", "duration=", "seed=", "repeat=",
+                 "converter=", "output=", "keep"])
+    except getopt.GetoptError, err:
+        print str(err)
+        usage()
+    logFname = None
+    channels = []
+    duration = 60.0
+    seed = 0
+    repeat = 3
+    converters = []
+    outFname = None
+    keep = False
+    for o, a in opts:
+        if o in ("-l", "--log"):
+            logFname = a
+        elif o in ("-c", "--channel"):
+            channels.append(a)
+        elif o in ("-d", "--duration"):
+            duration = float(a)
+        elif o in ("-s", "--seed"):
+            seed = int(a)
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o == "--converter":
+            converters.append(a)
+        elif o in ("-o", "--output"):
+            outFname = a
+        elif o in ("-k", "--keep"):
+            keep = True
+        else:
+            usage()
+
+    workdir = tempfile.mkdtemp(prefix="bot-log2mat-benchmark-")
+    try:
+        if logFname is None:
+            logFname = os.path.join(workdir, "synthetic.log")
+            write_log(logFname, channels or DEFAULT_CHANNELS, duration, seed)
+        try:
+            report = run_benchmark(logFname, converters or None, repeat, args, workdir)
+        except (ValueError, RuntimeError), err:
+            sys.stderr.write("error: %s\n" % err)
+            sys.exit(1)
+        if logFname.startswith(workdir):
+            report["log"]["channels"] = channels or DEFAULT_CHANNELS
+            report["log"]["duration"] = duration
+            report["log"]["seed"] = seed
+    finally:
+        if keep:
+            sys.stderr.write("kept the benchmark files in %s\n" % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for name in sorted(report["converters"]):
+        r = report["converters"][name]
+        sys.stderr.write("%-12s %8.3f s  %9.0f messages/s  %7.1f MB/s  %8.1f MB peak RSS\n" %
+                (name, r["wall_time"]["min"], r["messages_per_s"],
+                 r["payload_mb_per_s"], r["peak_rss_kb"] / 1024.0))
+
+    if outFname is None:
+        out = sys.stdout
+    else:
+        out = open(outFname, "w")
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.write("\n")
+    if out is not sys.stdout:
+        out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+#
+# Reproducible synthetic LCM logs for benchmarking the log converters.
+#
+# A log is described by a list of channels, each given as
+#
+#   CHANNEL:KIND:RATE[:OPTION=VALUE...]
+#
+# where KIND is one of the message kinds in MESSAGE_KINDS, RATE is in Hz and
+# the options set the size of the messages.  A size given as A-B is drawn
+# uniformly for every message, e.g.
+#
+#   POSE:pose:100  LIDAR:lidar:40:nranges=360-1081  CAM:image:10:width=640:height=480
+#
+# The same channels, duration and seed always produce the same log.
+
+import os
+import sys
+import getopt
+import numpy
+
+from bot_log2mat.event_log import EVENT_HEADER, SYNC_WORD
+
+DEFAULT_CHANNELS = [
+    "POSE:pose:100",
+    "LIDAR:lidar:40:nranges=360-1081",
+    "CAMERA:image:10:width=320:height=240",
+    "PMD_ORDERS:orders:1:ncmds=20",
+    "PMD_INFO:info:1:ncmds=20",
+]
+
+# timestamp of the first event of every synthetic log, in microseconds
+START_UTIME = 1300000000000000
+
+def _size(rng, value):
+    """Draw a size from an option value, either N or a range (A, B)."""
+    if isinstance(value, tuple):
+        return int(rng.randint(value[0], value[1] + 1))
+    return value
+
+def make_pose(rng, utime, options):
+    from bot_core.pose_t import pose_t
+    msg = pose_t()
+    msg.utime = utime
+    msg.pos = rng.standard_normal(3).tolist()
+    msg.vel = rng.standard_normal(3).tolist()
+    q = rng.standard_normal(4)
+    msg.orientation = (q / numpy.sqrt(numpy.dot(q, q))).tolist()
+    msg.rotation_rate = rng.standard_normal(3).tolist()
+    msg.accel = rng.standard_normal(3).tolist()
+    return msg
+
+def make_lidar(rng, utime, options):
+    from bot_core.planar_lidar_t import planar_lidar_t
+    msg = planar_lidar_t()
+    msg.utime = utime
+    msg.nranges = _size(rng, options.get("nranges", 1081))
+    msg.ranges = (rng.random_sample(msg.nranges) * 30).astype(numpy.float32).tolist()
+    msg.nintensities = _size(rng, options.get("nintensities", 0))
+    msg.intensities = rng.random_sample(msg.nintensities).astype(numpy.float32).tolist()
+    msg.rad0 = -2.35619449
+    msg.radstep = 0.00436332313
+    return msg
+
+def make_image(rng, utime, options):
+    from bot_core.image_t import image_t
+    msg = image_t()
+    msg.utime = utime
+    msg.width = _size(rng, options.get("width", 640))
+    msg.height = _size(rng, options.get("height", 480))
+    msg.row_stride = msg.width
+    msg.pixelformat = image_t.PIXEL_FORMAT_GRAY
+    msg.size = msg.row_stride * msg.height
+    msg.data = rng.randint(0, 256, msg.size).astype(numpy.uint8).tostring()
+    msg.nmetadata = 0
+    msg.metadata = []
+    return msg
+
+def _make_command(rng, k):
+    from bot_procman.command2_t import command2_t
+    cmd = command2_t()
+    cmd.exec_str = "bot-example-process --id %d" % k
+    cmd.command_name = "process-%d" % k
+    cmd.group = "group-%d" % (k % 4)
+    cmd.auto_respawn = bool(k % 2)
+    cmd.stop_signal = 2
+    cmd.stop_time_allowed = 7.0
+    cmd.num_options = 0
+    cmd.option_names = []
+    cmd.option_values = []
+    return cmd
+
+def make_orders(rng, utime, options):
+    from bot_procman.orders2_t import orders2_t
+    from bot_procman.sheriff_cmd2_t import sheriff_cmd2_t
+    msg = orders2_t()
+    msg.utime = utime
+    msg.host = "deputy"
+    msg.sheriff_name = "sheriff"
+    msg.ncmds = _size(rng, options.get("ncmds", 10))
+    msg.cmds = []
+    for k in range(msg.ncmds):
+        cmd = sheriff_cmd2_t()
+        cmd.cmd = _make_command(rng, k)
+        cmd.desired_runid = int(rng.randint(0, 10))
+        cmd.force_quit = 0
+        cmd.sheriff_id = k + 1
+        msg.cmds.append(cmd)
+    msg.num_options = 0
+    msg.option_names = []
+    msg.option_values = []
+    return msg
+
+def make_info(rng, utime, options):
+    from bot_procman.info2_t import info2_t
+    from bot_procman.deputy_cmd2_t import deputy_cmd2_t
+    msg = info2_t()
+    msg.utime = utime
+    msg.host = "deputy"
+    msg.cpu_load = float(rng.random_sample())
+    msg.phys_mem_total_bytes = 8 << 30
+    msg.phys_mem_free_bytes = int(rng.randint(0, 8 << 20)) << 10
+    msg.swap_total_bytes = 2 << 30
+    msg.swap_free_bytes = 2 << 30
+    msg.ncmds = _size(rng, options.get("ncmds", 10))
+    msg.cmds = []
+    for k in range(msg.ncmds):
+        cmd = deputy_cmd2_t()
+        cmd.cmd = _make_command(rng, k)
+        cmd.pid = 1000 + k
+        cmd.actual_runid = int(rng.randint(0, 10))
+        cmd.exit_code = 0
+        cmd.cpu_usage = float(rng.random_sample())
+        cmd.mem_vsize_bytes = int(rng.randint(1, 1 << 20)) << 10
+        cmd.mem_rss_bytes = int(rng.randint(1, 1 << 18)) << 10
+        cmd.sheriff_id = k + 1
+        msg.cmds.append(cmd)
+    msg.num_options = 0
+    msg.option_names = []
+    msg.option_values = []
+    return msg
+
+MESSAGE_KINDS = {
+    "pose" : make_pose,
+    "lidar" : make_lidar,
+    "image" : make_image,
+    "orders" : make_orders,
+    "info" : make_info,
+}
+
+def parse_channel_spec(spec):
+    """Parse CHANNEL:KIND:RATE[:OPTION=VALUE...] into (channel, kind, rate,
+    options)."""
+    parts = spec.split(":")
+    if len(parts) < 3:
+        raise ValueError("bad channel %r, expected CHANNEL:KIND:RATE[:OPTION=VALUE...]" % spec)
+    channel, kind, rate = parts[:3]
+    if kind not in MESSAGE_KINDS:
+        raise ValueError("unknown message kind %r in %r, expected one of %s" %
+                (kind, spec, ", ".join(sorted(MESSAGE_KINDS))))
+    rate = float(rate)
+    if rate <= 0:
+        raise ValueError("bad rate in %r" % spec)
+    options = {}
+    for option in parts[3:]:
+        if "=" not in option:
+            raise ValueError("bad option %r in %r, expected OPTION=VALUE" % (option, spec))
+        name, value = option.split("=", 1)
+        if "-" in value:
+            lo, hi = value.split("-", 1)
+            options[name] = (int(lo), int(hi))
+        else:
+            options[name] = int(value)
+    return channel, kind, rate, options
+
+def write_log(fname, channels=DEFAULT_CHANNELS, duration=60.0, seed=0):
+    """Write duration seconds of synthetic messages on the given channels
+    (specs as above) to fname.  Returns the number of events written."""
+    specs = [ parse_channel_spec(c) for c in channels ]
+    schedule = []
+    for i, (channel, kind, rate, options) in enumerate(specs):
+        for k in xrange(int(duration * rate)):
+            schedule.append((START_UTIME + int(round(k * 1e6 / rate)), i))
+    schedule.sort()
+
+    rng = numpy.random.RandomState(seed)
+    f = open(fname, "wb")
+    try:
+        for eventnum, (utime, i) in enumerate(schedule):
+            channel, kind, rate, options = specs[i]
+            data = MESSAGE_KINDS[kind](rng, utime, options).encode()
+            f.write(EVENT_HEADER.pack(SYNC_WORD, eventnum, utime, len(channel), len(data)))
+            f.write(channel)
+            f.write(data)
+    finally:
+        f.close()
+    return len(schedule)
+
+def usage():
+    pname, sfx = os.path.splitext(os.path.basename(sys.argv[0]))
+    print "usage: %s [options] <logfile>" % pname
+    print """
+Write a reproducible synthetic LCM log for benchmarking.
+
+Options:
+    -c, --channel=SPEC     add a channel CHANNEL:KIND:RATE[:OPTION=VALUE...]
+                           where KIND is one of %s
+                           (default: %s)
+    -d, --duration=SEC     seconds of messages to write (default 60)
+    -s, --seed=N           seed of the random message contents (default 0)
+    -h, --help             print this message
+""" % (", ".join(sorted(MESSAGE_KINDS)), " ".join(DEFAULT_CHANNELS))
+    sys.exit()
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hc:d:s:",
+                ["help", "channel=", "duration=", "seed="])
+    except getopt.GetoptError, err:
+        print str(err)
+        usage()
+    channels = []
+    duration = 60.0
+    seed = 0
+    for o, a in opts:
+        if o in ("-c", "--channel"):
+            channels.append(a)
+        elif o in ("-d", "--duration"):
+            duration = float(a)
+        elif o in ("-s", "--seed"):
+            seed = int(a)
+        else:
+            usage()
+    if len(args) != 1:
+        usage()
+    try:
+        count = write_log(args[0], channels or DEFAULT_CHANNELS, duration, seed)
+    except ValueError, err:
+        sys.stderr.write("error: %s\n" % err)
+        sys.exit(1)
+    sys.stderr.write("wrote %d events to %s\n" % (count, args[0]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#
+# Growable per-channel storage for the log converters.  Messages are written
+# straight into a preallocated NumPy matrix instead of being accumulated as a
+# list of python lists, so peak memory stays close to the size of the output.
+
+import numpy
+
+class ChannelBuffer(object):
+    """Row-major matrix of flattened messages for a single channel.
+
+    Rows are appended one message at a time.  The row capacity grows by
+    doubling, so appends are amortized O(1).  When a message is wider than any
+    seen before the matrix grows new columns; the unused tail of shorter rows
+    is left as zeros, which is the same result as padding every message to the
+    longest one.
+    """
+
+    def __init__(self, ncols=0, capacity=1024, dtype=numpy.float64):
+        self._data = numpy.zeros((max(capacity, 1), ncols), dtype=dtype)
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+
+    def __len__(self):
+        return self.nrows
+
+    def _reserve(self, nrows, ncols):
+        cap_rows, cap_cols = self._data.shape
+        if nrows <= cap_rows and ncols <= cap_cols:
+            return
+        while cap_rows < nrows:
+            cap_rows *= 2
+        new_data = numpy.zeros((cap_rows, max(ncols, cap_cols)),
+                dtype=self._data.dtype)
+        new_data[:self.nrows, :self._data.shape[1]] = self._data[:self.nrows]
+        self._data = new_data
+
+    def _note_width(self, width):
+        if self.min_width is None or width < self.min_width:
+            self.min_width = width
+        if width > self.max_width:
+            self.max_width = width
+
+    def append(self, row):
+        """Append one flattened message (any sequence of numbers)."""
+        width = len(row)
+        self._reserve(self.nrows + 1, width)
+        self._data[self.nrows, :width] = row
+        self.nrows += 1
+        self._note_width(width)
+
+    def extend(self, rows, widths=None):
+        """Append a 2-d block of messages.
+
+        If the block is itself zero padded, widths gives the unpadded width of
+        each row; otherwise all rows are taken to be as wide as the block.
+        """
+        rows = numpy.atleast_2d(rows)
+        count, width = rows.shape
+        if count == 0:
+            return
+        self._reserve(self.nrows + count, width)
+        self._data[self.nrows:self.nrows + count, :width] = rows
+        self.nrows += count
+        if widths is None:
+            self._note_width(width)
+        else:
+            self._note_width(int(min(widths)))
+            self._note_width(int(max(widths)))
+
+    @property
+    def nbytes(self):
+        """Size of the output matrix."""
+        return self.nrows * self.max_width * self._data.itemsize
+
+    @property
+    def allocated(self):
+        """Bytes allocated for the matrix, including its spare capacity."""
+        return self._data.nbytes
+
+    def array(self):
+        """Return a view of the filled part of the buffer."""
+        return self._data[:self.nrows, :self.max_width]
+
+class RaggedBuffer(object):
+    """Messages of varying width stored back to back, CSR style.
+
+    values holds the rows one after the other and offsets[i]:offsets[i+1]
+    is the extent of row i, so no space is spent on padding.  It has the
+    same interface as ChannelBuffer; array() still returns the zero padded
+    matrix, while arrays() returns the (values, offsets) pair.
+    """
+
+    def __init__(self, capacity=1 << 16, dtype=numpy.float64):
+        self._values = numpy.zeros(max(capacity, 1), dtype=dtype)
+        self._offsets = numpy.zeros(1024, dtype=numpy.int64)
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+
+    def __len__(self):
+        return self.nrows
+
+    def _reserve(self, nrows, nvalues):
+        if nrows + 1 > len(self._offsets):
+            size = len(self._offsets)
+            while size < nrows + 1:
+                size *= 2
+            offsets = numpy.zeros(size, dtype=numpy.int64)
+            offsets[:self.nrows + 1] = self._offsets[:self.nrows + 1]
+            self._offsets = offsets
+        if nvalues > len(self._values):
+            size = len(self._values)
+            while size < nvalues:
+                size *= 2
+            values = numpy.zeros(size, dtype=self._values.dtype)
+            values[:self._offsets[self.nrows]] = self._values[:self._offsets[self.nrows]]
+            self._values = values
+
+    def _note_width(self, width):
+        if self.min_width is None or width < self.min_width:
+            self.min_width = width
+        if width > self.max_width:
+            self.max_width = width
+
+    def append(self, row):
+        width = len(row)
+        start = self._offsets[self.nrows]
+        self._reserve(self.nrows + 1, start + width)
+        self._values[start:start + width] = row
+        self.nrows += 1
+        self._offsets[self.nrows] = start + width
+        self._note_width(width)
+
+    def extend(self, rows, widths=None):
+        """Append a 2-d block of messages, of which only the first widths[i]
+        columns of row i are kept."""
+        rows = numpy.atleast_2d(rows)
+        count, width = rows.shape
+        if count == 0:
+            return
+        if widths is None:
+            widths = numpy.empty(count, dtype=numpy.int64)
+            widths.fill(width)
+            values = rows.ravel()
+        else:
+            widths = numpy.asarray(widths, dtype=numpy.int64)
+            values = rows[numpy.arange(width) < widths[:, None]]
+        start = self._offsets[self.nrows]
+        self._reserve(self.nrows + count, start + len(values))
+        self._values[start:start + len(values)] = values
+        self._offsets[self.nrows + 1:self.nrows + count + 1] = start + numpy.cumsum(widths)
+        self.nrows += count
+        self._note_width(int(widths.min()))
+        self._note_width(int(widths.max()))
+
+    def clear(self):
+        """Remove all rows, keeping the allocated arrays."""
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+
+    @property
+    def nbytes(self):
+        """Size of the values and offsets arrays."""
+        return self._offsets[self.nrows] * self._values.itemsize + \
+                (self.nrows + 1) * self._offsets.itemsize
+
+    def arrays(self):
+        """Return views of the (values, offsets) arrays."""
+        return (self._values[:self._offsets[self.nrows]],
+                self._offsets[:self.nrows + 1])
+
+    def array(self):
+        """Return the rows as a zero padded matrix, a view if all rows have
+        the same width."""
+        values, offsets = self.arrays()
+        if self.min_width == self.max_width:
+            return values.reshape(self.nrows, self.max_width)
+        result = numpy.zeros((self.nrows, self.max_width), dtype=values.dtype)
+        widths = numpy.diff(offsets)
+        result[numpy.arange(self.max_width) < widths[:, None]] = values
+        return result
+
+class FieldBuffer(object):
+    """Messages of a channel as the values of each field of layout, a
+    RowLayout, in the fields' own types, for the writers of --native-types.
+
+    append() takes the row of a message as the flatteners make it, python
+    numbers with the log time last, and extend_records() the fields of a
+    block of messages from the typed_block() of their compiled decoder and
+    their log times.  Neither goes through float64, so int64 fields keep
+    all their digits.  blocks() returns the messages as a list of (fields,
+    log times) blocks, fields being a list of (name, values, widths) as
+    RowLayout.split() gives them.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+        self._rows = []
+        self._blocks = []
+
+    def __len__(self):
+        return self.nrows
+
+    def _note_width(self, width):
+        if self.min_width is None or width < self.min_width:
+            self.min_width = width
+        if width > self.max_width:
+            self.max_width = width
+
+    def append(self, row):
+        self._rows.append(row)
+        self.nrows += 1
+        self._note_width(len(row))
+
+    def extend_records(self, fields, times):
+        if [ name for name, values, widths in fields ] != \
+                [ name for name, dtype in self.layout.fields ]:
+            raise ValueError("the records are not the fields of %s" % self.layout.schema.name)
+        self._split_rows()
+        times = numpy.asarray(times, dtype=numpy.float64)
+        count = len(times)
+        if count == 0:
+            return
+        widths = numpy.ones(count, dtype=numpy.int64)
+        for name, values, fieldWidths in fields:
+            if fieldWidths is None:
+                widths += values.shape[1]
+            else:
+                widths += fieldWidths
+        self._blocks.append((fields, times))
+        self.nrows += count
+        self._note_width(int(widths.min()))
+        self._note_width(int(widths.max()))
+
+    def _split_rows(self):
+        if self._rows:
+            fields = self.layout.split([ row[:-1] for row in self._rows ])
+            times = numpy.array([ row[-1] for row in self._rows ], dtype=numpy.float64)
+            self._blocks.append((fields, times))
+            self._rows = []
+
+    def blocks(self):
+        self._split_rows()
+        return self._blocks
+
+    def clear(self):
+        """Remove all messages."""
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+        self._rows = []
+        self._blocks = []
@@ -0,0 +1,105 @@
+#
+# Pieces shared by the log_to_mat and log_to_struct conversions: output file
+# names and the selection of the events to convert from a log's index.
+
+import os
+import sys
+import numpy
+
+from log_index import LogIndex, load_index
+
+def default_output_name(fname, suffix=""):
+    """Output file name, without extension, for a log: the log's name with
+    dots and dashes replaced, in the log's directory."""
+    outDir, outFname = os.path.split(os.path.abspath(fname))
+    outFname = outFname.replace(".", "_")
+    outFname = outFname.replace("-", "_")
+    return outDir + "/" + outFname + suffix
+
+def channel_file_name(prefix, channel):
+    """Name, without extension, of the file of a channel for outputs that
+    write one file per channel."""
+    return "%s_%s" % (prefix, channel.replace("/", "_"))
+
+# the formats of the per channel files of bot-log2mat, by extension
+_CHANNEL_FILE_FORMATS = { ".csv" : "csv", ".npy" : "npy" }
+
+def output_format(outFname, outFormat=None, formats=("mat", "hdf5")):
+    """Return outFormat, or the format implied by the extension of outFname:
+    hdf5 for .h5 and .hdf5, csv for .csv and npy for .npy if they are among
+    formats, else mat."""
+    if outFormat is None:
+        ext = outFname is not None and os.path.splitext(outFname)[1] or ""
+        outFormat = "mat"
+        if ext in (".h5", ".hdf5"):
+            outFormat = "hdf5"
+        elif _CHANNEL_FILE_FORMATS.get(ext, None) in formats:
+            outFormat = _CHANNEL_FILE_FORMATS[ext]
+    if outFormat not in formats:
+        raise ValueError("unknown output format %s" % outFormat)
+    return outFormat
+
+def _partition(index, type_db, selector, verbose):
+    selected, ignored, unknown = index.partition(type_db, selector.is_ignored)
+    if verbose:
+        for channel in ignored:
+            sys.stderr.write("ignoring channel %s\n" % channel)
+        for channel in unknown:
+            sys.stderr.write("ignoring channel %s -not a known LCM type\n" % channel)
+    return selected, ignored + unknown
+
+def select_events(log, type_db, selector, eventFilter=None, verbose=False):
+    """Return (events, offsets, ignored channels) to convert from a log.
+
+    With a sidecar index only the events of the selected channels, within the
+    time window of eventFilter, are read; offsets are their offsets.
+    Without an index events iterates over the whole log and offsets is None.
+    """
+    index = load_index(log.fname)
+    if index is None:
+        return log, None, []
+    selected, ignored = _partition(index, type_db, selector, verbose)
+    start = end = None
+    if eventFilter is not None:
+        start, end = eventFilter.start, eventFilter.end
+    offsets = index.select(selected, start, end)
+    return log.events_at(offsets), offsets, ignored
+
+def channel_offsets(log, type_db, selector, eventFilter=None, verbose=False):
+    """Return a dict mapping each selected channel of a log to the offsets of
+    the events to convert, for converting one channel at a time.
+
+    The sidecar index is used if there is one, else the log is indexed in
+    memory.
+    """
+    index = load_index(log.fname)
+    if index is None:
+        index = LogIndex(log.fname)
+        index.update()
+    selected, ignored = _partition(index, type_db, selector, verbose)
+    start = end = None
+    filtering = eventFilter is not None and eventFilter.is_active()
+    if filtering:
+        start, end = eventFilter.start, eventFilter.end
+    result = {}
+    for channel in selected:
+        offsets = index.select([ channel ], start, end)
+        if filtering:
+            # the filter keeps its state per channel
+            offsets = eventFilter.select(log, selector.is_ignored, offsets)
+        result[channel] = offsets
+    return result
+
+def first_decoded_timestamp(log, offsets, type_db):
+    """Timestamp of the first event at the given offsets (in log order) that
+    decodes, which is the start time of a conversion of these events."""
+    for e in log.events_at(numpy.sort(offsets)):
+        lcmtype = type_db.get(e.data[:8], None)
+        if lcmtype is None:
+            continue
+        try:
+            lcmtype.decode(e.data)
+        except:
+            continue
+        return e.timestamp
+    return 0
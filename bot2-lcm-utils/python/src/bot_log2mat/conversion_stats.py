@@ -0,0 +1,138 @@
+#
+# Per-channel instrumentation of log conversion (--stats).
+#
+# For each channel the converters record the number of messages, the payload
+# bytes, the time spent decoding payloads, the time spent flattening decoded
+# messages into rows (bot-log2mat) or fields (bot-log2struct), and the bytes
+# of output produced, and the time spent writing the output file.  The compiled
+# decoders of variable size types read the rows straight from the payloads, so
+# their time counts as flattening.
+
+import sys
+import time
+
+try:
+    import json
+except ImportError:
+    json = None
+
+def output_nbytes(value):
+    """Total size of the numpy arrays in value, which may be an array or a
+    dict or list of them."""
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = value.values()
+    if isinstance(value, (list, tuple)):
+        return sum([ output_nbytes(v) for v in value ])
+    return 0
+
+class ChannelStats(object):
+    __slots__ = ["channel", "typename", "count", "payloadBytes", "decodeTime",
+            "flattenTime", "outputBytes"]
+
+    def __init__(self, channel, typename=None):
+        self.channel = channel
+        self.typename = typename
+        self.count = 0
+        self.payloadBytes = 0
+        self.decodeTime = 0.0
+        self.flattenTime = 0.0
+        self.outputBytes = 0
+
+    def total_time(self):
+        return self.decodeTime + self.flattenTime
+
+    def merge(self, other):
+        if self.typename is None:
+            self.typename = other.typename
+        self.count += other.count
+        self.payloadBytes += other.payloadBytes
+        self.decodeTime += other.decodeTime
+        self.flattenTime += other.flattenTime
+        self.outputBytes += other.outputBytes
+
+    def to_dict(self):
+        return {
+            "channel" : self.channel,
+            "typename" : self.typename,
+            "count" : self.count,
+            "payload_bytes" : self.payloadBytes,
+            "decode_time" : self.decodeTime,
+            "flatten_time" : self.flattenTime,
+            "output_bytes" : self.outputBytes,
+        }
+
+class ConversionStats(object):
+    """Statistics of all the channels of one conversion."""
+
+    def __init__(self):
+        self.channels = {}
+        self.startTime = time.time()
+        self.endTime = None
+        # time spent writing the output file at the end of the conversion
+        self.saveTime = 0.0
+
+    def channel(self, channel, typename=None):
+        stats = self.channels.get(channel, None)
+        if stats is None:
+            stats = self.channels[channel] = ChannelStats(channel, typename)
+        return stats
+
+    def merge(self, other):
+        for name, stats in other.channels.items():
+            self.channel(name).merge(stats)
+
+    def finish(self):
+        self.endTime = time.time()
+
+    def wall_time(self):
+        if self.endTime is None:
+            return time.time() - self.startTime
+        return self.endTime - self.startTime
+
+    def sorted_channels(self):
+        """Channels sorted by the time spent on them, most expensive first."""
+        return sorted(self.channels.values(), key=lambda s: (-s.total_time(), s.channel))
+
+    def report(self, out=sys.stderr):
+        header = "%-24s %-24s %9s %10s %9s %9s %8s %10s" % ("channel", "type",
+                "messages", "payload MB", "decode s", "flatten s", "us/msg", "output MB")
+        out.write(header + "\n")
+        out.write("-" * len(header) + "\n")
+        total = ChannelStats("total")
+        for stats in self.sorted_channels():
+            out.write(self._format(stats))
+            total.merge(stats)
+        total.typename = ""
+        out.write("-" * len(header) + "\n")
+        out.write(self._format(total))
+        wall = self.wall_time()
+        if wall > 0:
+            out.write("%.2f s wall time, %.2f s saving, %.0f messages/s, %.1f MB/s of payload\n" %
+                    (wall, self.saveTime, total.count / wall, total.payloadBytes / wall / 1e6))
+
+    def _format(self, stats):
+        usPerMsg = 0.0
+        if stats.count:
+            usPerMsg = stats.total_time() / stats.count * 1e6
+        return "%-24s %-24s %9d %10.2f %9.3f %9.3f %8.1f %10.2f\n" % (stats.channel,
+                stats.typename or "", stats.count, stats.payloadBytes / 1e6,
+                stats.decodeTime, stats.flattenTime, usPerMsg, stats.outputBytes / 1e6)
+
+    def to_dict(self):
+        return {
+            "wall_time" : self.wall_time(),
+            "save_time" : self.saveTime,
+            "channels" : [ s.to_dict() for s in self.sorted_channels() ],
+        }
+
+    def write_json(self, fname):
+        if json is None:
+            raise ImportError("writing the statistics as JSON needs the json module")
+        f = open(fname, "w")
+        try:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+            f.write("\n")
+        finally:
+            f.close()
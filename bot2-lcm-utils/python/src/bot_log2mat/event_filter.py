@@ -0,0 +1,146 @@
+#
+# Channel selection, time window and decimation filters for bot-log2mat.
+#
+# The decision to keep a message is made from the event header alone (its
+# channel and timestamp), so discarded messages are never decoded, and with
+# an index their payloads are never even read.
+
+import re
+
+class ChannelSelector(object):
+    """The channels to convert: those that the channels regex matches, except
+    those whose whole name the ignore regex matches.  Ignores take precedence
+    over includes."""
+
+    def __init__(self, channels=".*", ignore=None):
+        self.channels = re.compile(channels)
+        self.ignore = None
+        if ignore is not None:
+            self.ignore = re.compile(ignore)
+
+    def is_ignored(self, channel):
+        if self.ignore is not None:
+            m = self.ignore.match(channel)
+            if m and len(m.group()) == len(channel):
+                return True
+        return not self.channels.match(channel)
+
+def parse_channel_setting(value, convert):
+    """Parse a [REGEX=]VALUE option into (compiled regex or None, value)."""
+    if "=" in value:
+        pattern, value = value.rsplit("=", 1)
+        return re.compile(pattern), convert(value)
+    return None, convert(value)
+
+def channel_setting(settings, channel, default=None):
+    """Return the value of the first setting whose regex matches the whole
+    channel name, or of the last setting without a regex."""
+    result = default
+    for regex, value in settings:
+        if regex is None:
+            result = value
+        else:
+            m = regex.match(channel)
+            if m and len(m.group()) == len(channel):
+                return value
+    return result
+
+def channel_settings(value):
+    """Return a list of settings for EventFilter from a list of settings as
+    returned by parse_channel_setting(), a single value for all channels, or
+    None."""
+    if value is None:
+        return []
+    if isinstance(value, (int, long, float)):
+        return [ (None, value) ]
+    return list(value)
+
+class EventFilter(object):
+    """Select messages by time window, every Nth message of a channel and
+    maximum rate per channel.
+
+    start and end are in seconds relative to logStart, the timestamp of the
+    first event in the log.  every and maxRate are lists of settings as
+    returned by parse_channel_setting().  keep() must be called once for
+    every message of the converted channels, in log order.
+    """
+
+    def __init__(self, logStart, start=None, end=None, every=None, maxRate=None):
+        self.start = None
+        self.end = None
+        if start is not None:
+            self.start = logStart + int(round(start * 1e6))
+        if end is not None:
+            self.end = logStart + int(round(end * 1e6))
+        self.every = every or []
+        self.maxRate = maxRate or []
+        # per channel: (every N, minimum period in usec)
+        self._settings = {}
+        self._count = {}
+        self._due = {}
+
+    def is_active(self):
+        return self.start is not None or self.end is not None or \
+                bool(self.every) or bool(self.maxRate)
+
+    def _channel_settings(self, channel):
+        settings = self._settings.get(channel, None)
+        if settings is None:
+            every = channel_setting(self.every, channel, 1)
+            rate = channel_setting(self.maxRate, channel, None)
+            period = None
+            if rate:
+                period = 1e6 / rate
+            settings = self._settings[channel] = (every, period)
+        return settings
+
+    def keep(self, channel, timestamp):
+        if self.start is not None and timestamp < self.start:
+            return False
+        if self.end is not None and timestamp >= self.end:
+            return False
+        every, period = self._channel_settings(channel)
+        if every > 1:
+            count = self._count.get(channel, 0)
+            self._count[channel] = count + 1
+            if count % every:
+                return False
+        if period is not None:
+            due = self._due.get(channel, None)
+            if due is not None and timestamp < due:
+                return False
+            # keep to the rate on average when the messages are jittered
+            if due is not None and timestamp - due < period:
+                self._due[channel] = due + period
+            else:
+                self._due[channel] = timestamp + period
+        return True
+
+    def state(self):
+        """Return the per channel state of the filter, which restore() takes
+        to carry on filtering where a previous conversion of the log
+        stopped."""
+        return { "count" : dict(self._count), "due" : dict(self._due) }
+
+    def restore(self, state):
+        self._count = dict([ (str(k), v) for k, v in state["count"].items() ])
+        self._due = dict([ (str(k), v) for k, v in state["due"].items() ])
+
+    def select(self, log, isIgnored, offsets=None):
+        """Return the offsets of the events in log, or of the events at the
+        given offsets, that are on converted channels and pass the filter."""
+        kept = []
+        if offsets is None:
+            headers = log.headers()
+        else:
+            headers = log.headers_at(offsets)
+        ignored = {}
+        for offset, timestamp, channel, datalen in headers:
+            if channel in ignored:
+                continue
+            if isIgnored(channel):
+                ignored[channel] = True
+                continue
+            if self.keep(channel, timestamp):
+                kept.append(offset)
+        return kept
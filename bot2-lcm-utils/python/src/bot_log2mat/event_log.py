@@ -0,0 +1,231 @@
+#
+# Low level access to the LCM log file format.
+#
+# Every event in a log starts with a 28 byte header:
+#
+#   uint32 sync word (0xEDA1DA01)
+#   int64  event number
+#   int64  timestamp (microseconds)
+#   int32  channel name length
+#   int32  payload length
+#
+# followed by the channel name and the payload.
+
+import os
+import mmap
+import struct
+
+SYNC_WORD = 0xEDA1DA01
+EVENT_HEADER = struct.Struct(">IqqII")
+
+# Upper bound on the channel name length accepted when looking for an event
+# boundary in the middle of a log
+MAX_CHANNEL_LENGTH = 256
+
+_SYNC_BYTES = struct.pack(">I", SYNC_WORD)
+_SCAN_BLOCK = 1 << 16
+
+try:
+    _payload_view = buffer
+except NameError:
+    # python 3: mmap objects export the buffer interface used by memoryview
+    def _payload_view(mm, offset, size):
+        return memoryview(mm)[offset:offset + size]
+
+class LogEvent(object):
+    """One event read from a log, with the byte offset of its header.
+
+    Events from an MmapEventLog carry a zero-copy view of the payload rather
+    than a string: slicing it, or passing it to decode(), struct.unpack_from
+    or numpy.frombuffer, reads the mapped file directly.
+    """
+    __slots__ = ["eventnum", "timestamp", "channel", "data", "offset"]
+
+    def __init__(self, eventnum, timestamp, channel, data, offset):
+        self.eventnum = eventnum
+        self.timestamp = timestamp
+        self.channel = channel
+        self.data = data
+        self.offset = offset
+
+class MmapEventLog(object):
+    """Read-only LCM log backed by mmap.
+
+    Iterating yields LogEvents, like lcm.EventLog, but only the event headers
+    are parsed.  Payload pages are read from disk only when the payload view
+    is actually used, so events on ignored channels cost no I/O beyond their
+    header.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self._file = open(fname, "rb")
+        self._size = os.fstat(self._file.fileno()).st_size
+        if self._size:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mm = ""
+        self._offset = 0
+
+    def __iter__(self):
+        return self.events()
+
+    def events(self, start=0, end=None):
+        """Yield the events whose header starts in the byte range [start, end).
+
+        start must be the offset of an event header.  Iteration stops at the
+        first truncated or corrupt event, e.g. the one lcm-logger is still
+        writing.
+        """
+        offset = start
+        self._offset = offset
+        while end is None or offset < end:
+            e = self.read_event(offset)
+            if e is None:
+                break
+            offset = self._offset
+            yield e
+
+    def headers(self, start=0, end=None):
+        """Yield (offset, timestamp, channel, payload size) for each event,
+        without creating payload views."""
+        mm = self._mm
+        size = self._size
+        header_size = EVENT_HEADER.size
+        unpack_from = EVENT_HEADER.unpack_from
+        offset = start
+        self._offset = offset
+        while end is None or offset < end:
+            if offset + header_size > size:
+                break
+            sync, eventnum, timestamp, chanlen, datalen = unpack_from(mm, offset)
+            if sync != SYNC_WORD:
+                break
+            next_offset = offset + header_size + chanlen + datalen
+            if next_offset > size:
+                break
+            self._offset = next_offset
+            yield offset, timestamp, mm[offset + header_size:offset + header_size + chanlen], datalen
+            offset = next_offset
+
+    def headers_at(self, offsets):
+        """Yield (offset, timestamp, channel, payload size) for the events at
+        the given offsets."""
+        mm = self._mm
+        header_size = EVENT_HEADER.size
+        for offset in offsets:
+            sync, eventnum, timestamp, chanlen, datalen = \
+                    EVENT_HEADER.unpack_from(mm, offset)
+            yield offset, timestamp, mm[offset + header_size:offset + header_size + chanlen], datalen
+
+    def first_timestamp(self):
+        """Timestamp of the first event, or None for an empty log."""
+        e = self.read_event(0)
+        self._offset = 0
+        if e is None:
+            return None
+        return e.timestamp
+
+    def fingerprint_at(self, offset):
+        """Return the packed fingerprint of the event at offset."""
+        sync, eventnum, timestamp, chanlen, datalen = \
+                EVENT_HEADER.unpack_from(self._mm, offset)
+        data_offset = offset + EVENT_HEADER.size + chanlen
+        return self._mm[data_offset:data_offset + min(datalen, 8)]
+
+    def events_at(self, offsets):
+        """Yield the events whose headers start at the given offsets, e.g.
+        the ones selected from a LogIndex."""
+        for offset in offsets:
+            e = self.read_event(offset)
+            if e is None:
+                break
+            yield e
+
+    def read_event(self, offset):
+        """Parse the event at offset, or return None if there isn't a
+        complete event there."""
+        header_size = EVENT_HEADER.size
+        if offset + header_size > self._size:
+            return None
+        sync, eventnum, timestamp, chanlen, datalen = \
+                EVENT_HEADER.unpack_from(self._mm, offset)
+        if sync != SYNC_WORD:
+            return None
+        data_offset = offset + header_size + chanlen
+        next_offset = data_offset + datalen
+        if next_offset > self._size:
+            return None
+        self._offset = next_offset
+        return LogEvent(eventnum, timestamp,
+                self._mm[offset + header_size:data_offset],
+                _payload_view(self._mm, data_offset, datalen), offset)
+
+    def read_header_bytes(self):
+        """Return the raw header of the first event, which identifies the log
+        well enough to tell whether it was replaced."""
+        return self._mm[:EVENT_HEADER.size]
+
+    def tell(self):
+        """Offset just past the last event returned."""
+        return self._offset
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        if self._size:
+            self._mm.close()
+        self._file.close()
+
+def _is_event_start(f, offset, size):
+    f.seek(offset)
+    header = f.read(EVENT_HEADER.size)
+    if len(header) < EVENT_HEADER.size:
+        return False
+    sync, eventnum, timestamp, chanlen, datalen = EVENT_HEADER.unpack(header)
+    if sync != SYNC_WORD or chanlen == 0 or chanlen > MAX_CHANNEL_LENGTH:
+        return False
+    next_offset = offset + EVENT_HEADER.size + chanlen + datalen
+    if next_offset > size:
+        return False
+    if next_offset == size:
+        return True
+    # the sync word may appear inside a payload, so also require that the
+    # event is followed by another one
+    f.seek(next_offset)
+    return f.read(4) == _SYNC_BYTES
+
+def find_next_event(f, offset, size):
+    """Return the offset of the first event header at or after offset, or
+    None if there isn't one."""
+    while offset < size:
+        f.seek(offset)
+        block = f.read(_SCAN_BLOCK + 3)
+        pos = block.find(_SYNC_BYTES)
+        while pos >= 0:
+            if _is_event_start(f, offset + pos, size):
+                return offset + pos
+            pos = block.find(_SYNC_BYTES, pos + 1)
+        offset += _SCAN_BLOCK
+    return None
+
+def find_event_boundaries(fname, nparts):
+    """Split a log into at most nparts byte ranges that start on event
+    boundaries.  Returns the sorted list of range limits, starting with 0 and
+    ending with the file size."""
+    size = os.path.getsize(fname)
+    bounds = [ 0 ]
+    f = open(fname, "rb")
+    try:
+        for k in range(1, nparts):
+            guess = max(size * k // nparts, bounds[-1] + 1)
+            offset = find_next_event(f, guess, size)
+            if offset is None:
+                break
+            if offset > bounds[-1]:
+                bounds.append(offset)
+    finally:
+        f.close()
+    bounds.append(size)
+    return bounds
@@ -0,0 +1,258 @@
+#
+# Registry of extractors: vectorized decoders of the messages of particular
+# LCM types into the rows of bot-log2mat.
+#
+# The converters decode the messages of a channel a block at a time with a
+# block decoder, and one at a time only if there is none.  The block decoder
+# of a type is the extractor registered for it, or one of the built-in ones
+# that matches it, or for fixed size types the decoder lcmtype_compiler
+# compiles from the lcm-gen class.  Block decoders have the methods
+#
+#   check(data)              raise ValueError if the encoded message (with
+#                            its fingerprint) can't be decoded, e.g. is
+#                            truncated
+#   decode_block(payloads)   decode a list of encoded messages, into
+#                            anything flatten_block() takes
+#   flatten_block(records)   the float64 matrix of their rows, zero padded
+#   row_widths(records)      the width of each row if they vary, else None
+#
+# The rows must be the ones the generic flattener makes of the messages, as
+# the column names are.  Built in are extractors for bot_core.pose_t and
+# bot_core.rigid_transform_t, and for bot_core.planar_lidar_t, whose rows
+# vary with the number of ranges and intensities.  Extractors registered
+# before a conversion with -j are used by its worker processes too.
+#
+#   from bot_log2mat.extractors import FixedExtractor, register_extractor
+#   register_extractor(my_pkg.imu_t, FixedExtractor([ ("utime", ">i8"),
+#           ("gyro", ">f8", 3), ("accel", ">f8", 3) ]))
+
+import numpy
+
+# extractors by packed fingerprint, None for the types without one
+_extractors = {}
+_builtins = []
+
+def register_extractor(lcmtype, extractor):
+    """Decode the messages of lcmtype, an lcm-gen class, with extractor."""
+    _extractors[lcmtype._get_packed_fingerprint()] = extractor
+
+def find_extractor(lcmtype):
+    """Return the extractor of lcmtype, registered or built in, or None."""
+    fingerprint = lcmtype._get_packed_fingerprint()
+    if fingerprint not in _extractors:
+        _extractors[fingerprint] = None
+        for extractor in _builtins:
+            if extractor.matches(lcmtype):
+                _extractors[fingerprint] = extractor
+                break
+    return _extractors[fingerprint]
+
+def block_decoder(lcmtype, compiled, fields=None, typed=False):
+    """Return the block decoder of lcmtype, given its compiled decoder (of
+    the projection fields, see flatten.py), or None if its messages are
+    decoded one at a time.  Extractors decode whole messages, so they are
+    not used for projections, and only make float64 rows, so they are not
+    used with typed, for the typed_block() of the compiled decoder."""
+    if fields is None and not typed:
+        extractor = find_extractor(lcmtype)
+        if extractor is not None:
+            return extractor
+    if compiled is not None and compiled.dtype is not None:
+        return compiled
+    return None
+
+def with_log_times(rows, widths, times):
+    """Add the log times to a block of rows from a block decoder, after the
+    values of each row, and return (block, widths) for extending a
+    ChannelBuffer."""
+    times = numpy.asarray(times, dtype=numpy.float64)
+    if widths is None:
+        return numpy.hstack((rows, times[:, None])), None
+    block = numpy.zeros((len(rows), rows.shape[1] + 1))
+    block[:, :rows.shape[1]] = rows
+    block[numpy.arange(len(rows)), widths] = times
+    return block, widths + 1
+
+def _type_name(lcmtype):
+    return "%s.%s" % (lcmtype.__module__.split(".")[0], lcmtype.__name__)
+
+class Extractor(object):
+    """Base class of extractors, see above.  typename and slots, if given,
+    are the package qualified name (e.g. "bot_core.pose_t") and the field
+    names of the types matches() accepts, whose default message encodes to
+    emptySize bytes."""
+
+    typename = None
+    slots = None
+    emptySize = None
+
+    def matches(self, lcmtype):
+        if self.typename is None or _type_name(lcmtype) != self.typename:
+            return False
+        if list(getattr(lcmtype, "__slots__", [])) != list(self.slots):
+            return False
+        try:
+            return len(lcmtype().encode()) == self.emptySize
+        except Exception:
+            return False
+
+    def check(self, data):
+        pass
+
+    def decode_block(self, payloads):
+        raise NotImplementedError
+
+    def flatten_block(self, records):
+        raise NotImplementedError
+
+    def row_widths(self, records):
+        return None
+
+class FixedExtractor(Extractor):
+    """Extractor of a fixed size type, given its fields in wire order as
+    (name, big-endian numpy type) or (name, type, count) for arrays, e.g.
+    ("utime", ">i8") and ("pos", ">f8", 3).  Nested types are written as
+    their own fields, with dotted names."""
+
+    def __init__(self, fields, typename=None):
+        self.fields = [ tuple(f) + (1,) * (3 - len(f)) for f in fields ]
+        self.typename = typename
+        self.slots = []
+        for name, dtype, count in self.fields:
+            slot = name.split(".")[0]
+            if slot not in self.slots:
+                self.slots.append(slot)
+        body = numpy.dtype([ (name, dtype, count) if count != 1 else (name, dtype)
+                for name, dtype, count in self.fields ])
+        self.dtype = numpy.dtype([ ("fingerprint", "V8"), ("body", body) ])
+        self.itemsize = self.emptySize = self.dtype.itemsize
+        self.ncols = sum([ count for name, dtype, count in self.fields ])
+
+    def check(self, data):
+        if len(data) < self.itemsize:
+            raise ValueError("truncated message")
+
+    def decode_block(self, payloads):
+        size = self.itemsize
+        joined = "".join([ p[:size] for p in payloads ])
+        if len(joined) != size * len(payloads):
+            raise ValueError("truncated message")
+        return numpy.frombuffer(joined, dtype=self.dtype)["body"]
+
+    def flatten_block(self, records):
+        rows = numpy.empty((len(records), self.ncols))
+        col = 0
+        for name, dtype, count in self.fields:
+            rows[:, col:col + count] = records[name].reshape(len(records), count)
+            col += count
+        return rows
+
+def _gather(joined, starts, size):
+    """The size bytes at each of starts of a uint8 array, one row each, for
+    reading small header fields."""
+    return joined[starts[:, None] + numpy.arange(size)]
+
+def _records(buf, dtype, starts):
+    """The records of dtype at starts of buf, read with one frombuffer() for
+    each run of adjacent records rather than an index of every byte."""
+    bounds = numpy.nonzero(numpy.diff(starts) != dtype.itemsize)[0] + 1
+    runs = numpy.split(starts, bounds)
+    parts = [ numpy.frombuffer(buf, dtype=dtype, count=len(run), offset=int(run[0]))
+            for run in runs ]
+    if len(parts) == 1:
+        return parts[0]
+    return numpy.concatenate(parts)
+
+class PlanarLidarExtractor(Extractor):
+    """Extractor of bot_core.planar_lidar_t.
+
+    The messages of a block are grouped by their numbers of ranges and
+    intensities, and each group is decoded with one record dtype.  Rows are
+    utime, nranges, the ranges, nintensities, the intensities, rad0 and
+    radstep, so they are 5 + nranges + nintensities wide.
+    """
+
+    typename = "bot_core.planar_lidar_t"
+    slots = [ "utime", "nranges", "ranges", "nintensities", "intensities", "rad0", "radstep" ]
+    emptySize = 32
+
+    def _layout(self, nranges, nintensities):
+        return numpy.dtype([ ("fingerprint", "V8"), ("utime", ">i8"), ("nranges", ">i4"),
+                ("ranges", ">f4", (nranges,)), ("nintensities", ">i4"),
+                ("intensities", ">f4", (nintensities,)), ("rad0", ">f4"), ("radstep", ">f4") ])
+
+    def check(self, data):
+        if len(data) < self.emptySize:
+            raise ValueError("truncated message")
+        nranges = numpy.frombuffer(data[16:20], dtype=">i4")[0]
+        if nranges < 0 or len(data) < self.emptySize + 4 * nranges:
+            raise ValueError("truncated message")
+        start = 20 + 4 * nranges
+        nintensities = numpy.frombuffer(data[start:start + 4], dtype=">i4")[0]
+        if nintensities < 0 or len(data) < self.emptySize + 4 * (nranges + nintensities):
+            raise ValueError("truncated message")
+
+    def decode_block(self, payloads):
+        """Return a list of (rows of the block, records) of each layout.
+        Raises ValueError if a message is shorter than its numbers of ranges
+        and intensities make it."""
+        sizes = numpy.array([ len(p) for p in payloads ], dtype=numpy.int64)
+        if (sizes < self.emptySize).any():
+            raise ValueError("truncated message")
+        buf = "".join([ p[:] for p in payloads ])
+        joined = numpy.frombuffer(buf, dtype=numpy.uint8)
+        starts = numpy.zeros(len(payloads), dtype=numpy.int64)
+        numpy.cumsum(sizes[:-1], out=starts[1:])
+        nranges = _gather(joined, starts + 16, 4).copy().view(">i4").ravel().astype(numpy.int64)
+        if (nranges < 0).any() or (sizes < self.emptySize + 4 * nranges).any():
+            raise ValueError("truncated message")
+        nintensities = _gather(joined, starts + 20 + 4 * nranges, 4).copy().view(">i4").ravel()
+        nintensities = nintensities.astype(numpy.int64)
+        if (nintensities < 0).any() or \
+                (sizes < self.emptySize + 4 * (nranges + nintensities)).any():
+            raise ValueError("truncated message")
+        layouts = nranges * (1 << 32) + nintensities
+        groups = []
+        for layout in numpy.unique(layouts):
+            which = numpy.nonzero(layouts == layout)[0]
+            dtype = self._layout(int(layout >> 32), int(layout & 0xffffffff))
+            groups.append((which, _records(buf, dtype, starts[which])))
+        return groups
+
+    def _width(self, records):
+        return 5 + records.dtype["ranges"].shape[0] + records.dtype["intensities"].shape[0]
+
+    def flatten_block(self, records):
+        count = sum([ len(which) for which, group in records ])
+        rows = numpy.zeros((count, max([ self._width(group) for which, group in records ])))
+        for which, group in records:
+            nranges = group.dtype["ranges"].shape[0]
+            nintensities = group.dtype["intensities"].shape[0]
+            block = numpy.empty((len(group), self._width(group)))
+            block[:, 0] = group["utime"]
+            block[:, 1] = group["nranges"]
+            block[:, 2:2 + nranges] = group["ranges"].reshape(len(group), nranges)
+            block[:, 2 + nranges] = group["nintensities"]
+            block[:, 3 + nranges:3 + nranges + nintensities] = \
+                    group["intensities"].reshape(len(group), nintensities)
+            block[:, -2] = group["rad0"]
+            block[:, -1] = group["radstep"]
+            rows[which, :block.shape[1]] = block
+        return rows
+
+    def row_widths(self, records):
+        if len(records) == 1:
+            return None
+        widths = numpy.zeros(sum([ len(which) for which, group in records ]), dtype=numpy.int64)
+        for which, group in records:
+            widths[which] = self._width(group)
+        return widths
+
+_builtins.extend([
+    FixedExtractor([ ("utime", ">i8"), ("pos", ">f8", 3), ("vel", ">f8", 3),
+        ("orientation", ">f8", 4), ("rotation_rate", ">f8", 3), ("accel", ">f8", 3) ],
+        "bot_core.pose_t"),
+    FixedExtractor([ ("utime", ">i8"), ("trans", ">f8", 3), ("quat", ">f8", 4) ],
+        "bot_core.rigid_transform_t"),
+    PlanarLidarExtractor(),
+])
@@ -0,0 +1,219 @@
+#
+# Flattening of decoded LCM messages into the rows written by bot-log2mat:
+# numeric fields in declaration order, nested types expanded, strings ignored.
+#
+# The fields of a message can be restricted to a projection: a tuple of field
+# names, where "pose.pos" names the pos field of the nested pose field.  The
+# projected row holds the same columns as the full row, in the same order,
+# minus the ones of the fields left out.
+
+import re
+import types
+import numpy
+
+def parse_fields_setting(value):
+    """Parse a CHANNEL:field[,field...] option into (compiled regex, tuple of
+    field names)."""
+    if ":" not in value:
+        raise ValueError("bad fields %r, expected CHANNEL:field[,field...]" % value)
+    pattern, names = value.rsplit(":", 1)
+    fields = tuple(sorted(set([ n.strip() for n in names.split(",") if n.strip() ])))
+    if not fields:
+        raise ValueError("no fields in %r" % value)
+    return re.compile(pattern), fields
+
+def field_tree(fields):
+    """Turn a tuple of field names into a dict mapping each selected field to
+    the dict of its selected sub-fields, or to None if it is selected whole."""
+    tree = {}
+    for name in fields:
+        node = tree
+        parts = name.split(".")
+        for part in parts[:-1]:
+            if part in node and node[part] is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return tree
+
+def check_fields(msg, fields):
+    """Raise ValueError if a field of the projection is not a field of msg."""
+    def check(msg, tree, prefix):
+        for name, sub in tree.items():
+            if name not in getattr(msg, '__slots__'):
+                raise ValueError("%s has no field %s%s" % (msg.__class__.__name__, prefix, name))
+            if sub is not None:
+                m = getattr(msg, name)
+                if type(m) in [ types.ListType, types.TupleType ]:
+                    if not m:
+                        continue
+                    m = m[0]
+                if not hasattr(m, '__slots__'):
+                    raise ValueError("%s%s of %s is not an LCM type" % (prefix, name,
+                        msg.__class__.__name__))
+                check(m, sub, prefix + name + ".")
+    check(msg, field_tree(fields), "")
+
+def _selected(tree, fieldname):
+    """(selected, sub-tree) of a field for a projection tree (None for all)."""
+    if tree is None:
+        return True, None
+    if fieldname not in tree:
+        return False, None
+    return True, tree[fieldname]
+
+def make_simple_accessor(fieldname):
+    return lambda lst, x: lst.append(getattr(x, fieldname))
+
+def make_numpy_array_accessor(fieldname):
+    return lambda lst, x: lst.extend(numpy.array(getattr(x, fieldname)).ravel())
+
+def make_obj_accessor(fieldname, func):
+    return lambda lst, x: func(lst, getattr(x, fieldname))
+
+def make_obj_list_accessor(fieldname, func):
+    return lambda lst, x: map(lambda item: func(lst, item), getattr(x, fieldname))
+#    def list_accessor(lst, msg):
+#        msg_lst = getattr(msg, fieldname)
+#        for elem in msg_lst:
+#            func(lst, elem)
+#    return list_accessor
+#
+
+
+def make_lcmtype_accessor(msg, tree=None):
+    funcs = []
+
+    for fieldname in getattr(msg, '__slots__'):
+        selected, sub = _selected(tree, fieldname)
+        if not selected:
+            continue
+        m = getattr(msg, fieldname)
+
+        if type(m) in [ types.IntType, types.LongType, types.FloatType,
+                types.BooleanType ]:
+            # scalar
+            accessor = make_simple_accessor(fieldname)
+            funcs.append(accessor)
+        elif type(m) in [ types.ListType, types.TupleType ]:
+            # convert to a numpy array
+            arr = numpy.array(m)
+
+            # check the data type of the array
+            if arr.dtype.kind in "bif":
+                # numeric data type
+                funcs.append(make_numpy_array_accessor(fieldname))
+            elif arr.dtype.kind == "O":
+                # compound data type
+                typeAccess = make_lcmtype_accessor(m[0], sub)
+                funcs.append(make_obj_list_accessor(fieldname, typeAccess))
+                #pass
+        elif type(m) in types.StringTypes:
+            # ignore strings
+            pass
+        else:
+            funcs.append(make_obj_accessor(fieldname, make_lcmtype_accessor(m, sub)))
+
+    def flatten(lst, m):
+        for func in funcs:
+            func(lst, m)
+    return flatten
+
+def make_flattener(msg, fields=None):
+    """Return a function that flattens messages like msg into a list, of the
+    fields of the projection fields if given."""
+    tree = None
+    if fields is not None:
+        tree = field_tree(fields)
+    accessor = make_lcmtype_accessor(msg, tree)
+    def flattener(m):
+        result = []
+        accessor(result, m)
+        return result
+    return flattener
+
+def make_lcmtype_string(msg, base=True, fields=None, tree=None):
+    typeStr = []
+    count = 0
+    if fields is not None:
+        tree = field_tree(fields)
+    for fieldname in getattr(msg, '__slots__'):
+        selected, sub = _selected(tree, fieldname)
+        if not selected:
+            continue
+        m = getattr(msg, fieldname)
+
+        if type(m) in [ types.IntType, types.LongType, types.FloatType, types.BooleanType ]:
+            count = count + 1
+            if base:
+                typeStr.append("%d- %s" % (count, fieldname))
+            else:
+                typeStr.append(fieldname)
+        elif type(m) in [ types.ListType, types.TupleType ]:
+            # convert to a numpy array
+            arr = numpy.array(m)
+            # check the data type of the array
+            if arr.dtype.kind in "bif":
+                # numeric data type
+
+                if base:
+                    typeStr.append("%d- %s(%d)" % (count + 1, fieldname, len(arr.ravel())))
+                else:
+                    typeStr.append("%s(%d)" % (fieldname, len(arr.ravel())))
+                count = count + len(arr.ravel())
+            elif arr.dtype.kind == "O":
+                # compound data type
+                subStr, subCount = make_lcmtype_string(m[0], False, tree=sub)
+                numSub = len(m)
+                if base:
+                    subStr = "%d- %s<%s>(%d)" % (count + 1, fieldname, ", ".join(subStr), numSub)
+                else:
+                    subStr = "%s<%s>(%d)" % (fieldname, ", ".join(subStr), numSub)
+                typeStr.append(subStr)
+                count = count + numSub * subCount
+                #pass
+        elif type(m) in types.StringTypes:
+            # ignore strings
+            pass
+        else:
+            subStr, subCount = make_lcmtype_string(m, False, tree=sub);
+            if base:
+                for s in subStr:
+                    typeStr.append("%d- %s.%s" % (count+1, fieldname , s))
+                    count = count + subCount
+            else:
+                count = count + subCount
+                for s in subStr:
+                    typeStr.append(fieldname + "." + s)
+
+    return typeStr, count
+
+def make_column_names(msg, prefix="", fields=None, tree=None):
+    """Return the name of every column the flattener of msg produces, e.g.
+    "pos[0]" for array elements and "pose.utime" for nested fields."""
+    names = []
+    if fields is not None:
+        tree = field_tree(fields)
+    for fieldname in getattr(msg, '__slots__'):
+        selected, sub = _selected(tree, fieldname)
+        if not selected:
+            continue
+        m = getattr(msg, fieldname)
+        name = prefix + fieldname
+
+        if type(m) in [ types.IntType, types.LongType, types.FloatType, types.BooleanType ]:
+            names.append(name)
+        elif type(m) in [ types.ListType, types.TupleType ]:
+            arr = numpy.array(m)
+            if arr.dtype.kind in "bif":
+                for index in numpy.ndindex(*arr.shape):
+                    names.append(name + "".join([ "[%d]" % i for i in index ]))
+            elif arr.dtype.kind == "O":
+                for i, item in enumerate(m):
+                    names.extend(make_column_names(item, "%s[%d]." % (name, i), tree=sub))
+        elif type(m) in types.StringTypes:
+            pass
+        else:
+            names.extend(make_column_names(m, name + ".", tree=sub))
+    return names
@@ -0,0 +1,410 @@
+#
+# Streaming HDF5 output for the log converters.
+#
+# Unlike savemat, which needs the whole log in memory and is limited to 2 GB
+# per variable, the HDF5 writers append each channel to chunked datasets in
+# fixed size blocks while the log is being read.  Every channel is a group,
+# named after the channel, holding:
+#
+#   bot-log2mat     data      the rows bot-log2mat stores in the .mat file
+#                   log_time  the log time column of data
+#   --native-types  <field>   a dataset per numeric field of the rows instead
+#                             of data, of the type it has in the LCM type, a
+#                             row per message, zero padded like data
+#                   log_time
+#   bot-log2struct  one dataset per numeric field, messages along the last axis;
+#                   the fields whose length varies from message to message are
+#                   zero padded to the longest, like the rows of bot-log2mat
+#
+# A file opened with mode "a" is appended to: the writers of the channels that
+# are already in the file carry on after their last row.
+#
+# h5py is only needed when this output format is used.
+
+import sys
+import numpy
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+from channel_buffer import ChannelBuffer, RaggedBuffer, FieldBuffer
+
+def group_name(channel):
+    # "/" separates HDF5 path components
+    return channel.replace("/", "_")
+
+class Hdf5Output(object):
+    """HDF5 file holding one group per channel."""
+
+    def __init__(self, fname, blockSize=4096, compression=None, mode="w"):
+        if h5py is None:
+            raise ImportError("the hdf5 output format needs the h5py module")
+        self.fname = fname
+        self.blockSize = blockSize
+        self.compression = compression
+        self.file = h5py.File(fname, mode)
+        self.channels = {}
+
+    @property
+    def attrs(self):
+        """Attributes of the file's root group."""
+        return self.file.attrs
+
+    def _create_group(self, channel, typename):
+        name = group_name(channel)
+        if name in self.file:
+            return self.file[name]
+        group = self.file.create_group(name)
+        group.attrs["channel"] = channel
+        if typename:
+            group.attrs["lcmtype"] = typename
+        return group
+
+    def create_dataset(self, group, name, shape, maxshape, chunks, dtype=numpy.float64):
+        return group.create_dataset(name, shape=shape, maxshape=maxshape,
+                chunks=chunks, dtype=dtype, compression=self.compression)
+
+    def matrix(self, channel, columns=None, typename=None):
+        """Return a ChannelBuffer-like writer of bot-log2mat rows."""
+        writer = Hdf5MatrixBuffer(self, self._create_group(channel, typename), columns)
+        self.channels[channel] = writer
+        return writer
+
+    def ragged(self, channel, columns=None, typename=None):
+        """Return a RaggedBuffer-like writer of bot-log2mat rows."""
+        writer = Hdf5RaggedBuffer(self, self._create_group(channel, typename), columns)
+        self.channels[channel] = writer
+        return writer
+
+    def typed(self, channel, layout, columns=None, typename=None):
+        """Return a ChannelBuffer-like writer of bot-log2mat rows to a dataset
+        per field of layout, a RowLayout."""
+        writer = Hdf5TypedBuffer(self, self._create_group(channel, typename), layout, columns)
+        self.channels[channel] = writer
+        return writer
+
+    def fields(self, channel, typename=None):
+        """Return a writer of bot-log2struct field columns."""
+        writer = Hdf5FieldWriter(self, self._create_group(channel, typename))
+        self.channels[channel] = writer
+        return writer
+
+    def close(self):
+        for writer in self.channels.values():
+            writer.flush()
+        self.file.close()
+
+class Hdf5MatrixBuffer(object):
+    """Drop-in replacement for ChannelBuffer that writes its rows to HDF5.
+
+    Rows are buffered until blockSize of them are pending and are then
+    appended to the "data" dataset, which grows columns when a message is
+    wider than the previous ones.  The log time, the last element of each
+    row, is also written to the "log_time" dataset.  If the group already
+    has these datasets the rows are appended to them.
+    """
+
+    def __init__(self, output, group, columns=None):
+        self.output = output
+        self.group = group
+        self.columns = columns
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+        self._data = None
+        self._log_time = None
+        self._nbytes = 0
+        self._pending = ChannelBuffer(capacity=output.blockSize)
+        self._widths = []
+        if "data" in group:
+            self._open()
+
+    def _open(self):
+        self._data = self.group["data"]
+        self._log_time = self.group["log_time"]
+        self.nrows = len(self._log_time)
+        self._open_widths()
+
+    def _open_widths(self):
+        if "min_width" in self.group.attrs:
+            self.min_width = int(self.group.attrs["min_width"])
+            self.max_width = int(self.group.attrs["max_width"])
+        self._note_size()
+
+    def _save_widths(self):
+        # kept for the writers that append to the group later
+        self.group.attrs["min_width"] = self.min_width
+        self.group.attrs["max_width"] = self.max_width
+
+    def __len__(self):
+        return self.nrows + len(self._pending)
+
+    def _note_width(self, width):
+        if self.min_width is None or width < self.min_width:
+            self.min_width = width
+        if width > self.max_width:
+            self.max_width = width
+
+    def append(self, row):
+        self._pending.append(row)
+        self._widths.append(len(row))
+        self._note_width(len(row))
+        if len(self._pending) >= self.output.blockSize:
+            self.flush()
+
+    def extend(self, rows, widths=None):
+        rows = numpy.atleast_2d(rows)
+        if len(rows) == 0:
+            return
+        if widths is None:
+            widths = [ rows.shape[1] ] * len(rows)
+        self._pending.extend(rows, widths)
+        self._widths.extend(widths)
+        self._note_width(int(min(widths)))
+        self._note_width(int(max(widths)))
+        if len(self._pending) >= self.output.blockSize:
+            self.flush()
+
+    @property
+    def nbytes(self):
+        """Uncompressed size of the datasets written so far."""
+        return self._nbytes
+
+    def _note_size(self):
+        self._nbytes = sum([ ds.size * ds.dtype.itemsize for ds in self._datasets() ])
+
+    def _datasets(self):
+        return [ self._data, self._log_time ]
+
+    def _create(self, ncols):
+        chunkRows = self.output.blockSize
+        self._data = self.output.create_dataset(self.group, "data", (0, ncols),
+                (None, None), (chunkRows, max(ncols, 1)))
+        self._log_time = self.output.create_dataset(self.group, "log_time", (0,),
+                (None,), (chunkRows,))
+        if self.columns is not None:
+            columns = list(self.columns) + [ "log_time" ]
+            self._data.attrs["columns"] = numpy.array(columns, dtype="S")
+            self._data.attrs["log_time_column"] = len(columns) - 1
+
+    def flush(self):
+        """Append the pending rows to the datasets."""
+        count = len(self._pending)
+        if count == 0:
+            return
+        rows = self._pending.array()
+        widths = numpy.array(self._widths, dtype=numpy.int64)
+        if self._data is None:
+            self._create(rows.shape[1])
+        ncols = max(self._data.shape[1], rows.shape[1])
+        self._data.resize((self.nrows + count, ncols))
+        self._data[self.nrows:, :rows.shape[1]] = rows
+        self._log_time.resize((self.nrows + count,))
+        self._log_time[self.nrows:] = rows[numpy.arange(count), widths - 1]
+        self.nrows += count
+        self._pending = ChannelBuffer(capacity=self.output.blockSize)
+        self._widths = []
+        self._note_size()
+        self._save_widths()
+
+class Hdf5RaggedBuffer(Hdf5MatrixBuffer):
+    """Hdf5MatrixBuffer that stores the rows back to back, without padding,
+    in a "values" dataset; rows i spans values[offsets[i]:offsets[i+1]]."""
+
+    def __init__(self, output, group, columns=None):
+        Hdf5MatrixBuffer.__init__(self, output, group, columns)
+        self._pending = RaggedBuffer()
+        self._nvalues = 0
+        if "values" in group:
+            self._data = group["values"]
+            self._offsets = group["offsets"]
+            self._log_time = group["log_time"]
+            self.nrows = len(self._log_time)
+            self._nvalues = int(self._offsets[-1])
+            self._open_widths()
+
+    def _datasets(self):
+        return [ self._data, self._offsets, self._log_time ]
+
+    def _create(self, ncols):
+        chunkRows = self.output.blockSize
+        self._data = self.output.create_dataset(self.group, "values", (0,),
+                (None,), (chunkRows * max(ncols, 1),))
+        self._offsets = self.output.create_dataset(self.group, "offsets", (1,),
+                (None,), (chunkRows,), numpy.int64)
+        self._log_time = self.output.create_dataset(self.group, "log_time", (0,),
+                (None,), (chunkRows,))
+        if self.columns is not None:
+            columns = list(self.columns) + [ "log_time" ]
+            self._data.attrs["columns"] = numpy.array(columns, dtype="S")
+
+    def flush(self):
+        count = len(self._pending)
+        if count == 0:
+            return
+        values, offsets = self._pending.arrays()
+        if self._data is None:
+            self._create(self._pending.max_width)
+        self._data.resize((self._nvalues + len(values),))
+        self._data[self._nvalues:] = values
+        self._offsets.resize((self.nrows + count + 1,))
+        self._offsets[self.nrows + 1:] = offsets[1:] + self._nvalues
+        self._log_time.resize((self.nrows + count,))
+        self._log_time[self.nrows:] = values[offsets[1:] - 1]
+        self._nvalues += len(values)
+        self.nrows += count
+        self._pending = RaggedBuffer()
+        self._widths = []
+        self._note_size()
+        self._save_widths()
+
+class Hdf5TypedBuffer(Hdf5MatrixBuffer):
+    """Hdf5MatrixBuffer that appends each field of layout, a RowLayout, to a
+    dataset of its own type instead of "data".  It takes the rows of
+    messages with append(), and blocks of decoded records with
+    extend_records(), as a FieldBuffer does; their values are written as
+    they are, without going through float64."""
+
+    def __init__(self, output, group, layout, columns=None):
+        self.layout = layout
+        self._fields = {}
+        Hdf5MatrixBuffer.__init__(self, output, group, columns)
+        self._pending = FieldBuffer(layout)
+        if "log_time" in group and "data" not in group:
+            self._log_time = group["log_time"]
+            self.nrows = len(self._log_time)
+            for name, dtype in layout.fields:
+                if name in group:
+                    self._fields[name] = group[name]
+            self._open_widths()
+
+    def _datasets(self):
+        return self._fields.values() + [ self._log_time ]
+
+    def append(self, row):
+        self._pending.append(row)
+        self._added()
+
+    def extend_records(self, fields, times):
+        """Append the fields of a block of messages, from typed_block(), and
+        their log times."""
+        self._pending.extend_records(fields, times)
+        self._added()
+
+    def _added(self):
+        self._note_width(self._pending.min_width)
+        self._note_width(self._pending.max_width)
+        if len(self._pending) >= self.output.blockSize:
+            self.flush()
+
+    def _append_field(self, name, values):
+        ds = self._fields.get(name, None)
+        if ds is None:
+            ds = self.output.create_dataset(self.group, name, (self.nrows, values.shape[1]),
+                    (None, None), (self.output.blockSize, max(values.shape[1], 1)), values.dtype)
+            self._fields[name] = ds
+        ds.resize((self.nrows + len(values), max(ds.shape[1], values.shape[1])))
+        ds[self.nrows:, :values.shape[1]] = values
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        if self._log_time is None:
+            # the datasets of the fields are made as they are written
+            self._log_time = self.output.create_dataset(self.group, "log_time", (0,),
+                    (None,), (self.output.blockSize,))
+        for fields, times in self._pending.blocks():
+            for name, values, widths in fields:
+                self._append_field(name, values)
+            self._log_time.resize((self.nrows + len(times),))
+            self._log_time[self.nrows:] = times
+            self.nrows += len(times)
+        self._pending.clear()
+        self._note_size()
+        self._save_widths()
+
+def _is_ragged(value, count):
+    """Whether a field is the object array of the numeric arrays of count
+    messages of different lengths."""
+    if not isinstance(value, numpy.ndarray) or value.dtype != object or value.shape != (count,):
+        return False
+    for elem in value:
+        if not isinstance(elem, numpy.ndarray) or elem.dtype.kind not in "biuf":
+            return False
+    return True
+
+def _zero_padded(value):
+    """The field of messages along the last axis, like the fields of the same
+    length, with each message zero padded to the longest."""
+    elems = [ elem.T for elem in value ]
+    ndim = max([ elem.ndim for elem in elems ])
+    elems = [ elem.reshape(elem.shape + (1,) * (ndim - elem.ndim)) for elem in elems ]
+    shape = tuple([ max([ elem.shape[i] for elem in elems ]) for i in range(ndim) ])
+    result = numpy.zeros(shape + (len(elems),),
+            dtype=numpy.find_common_type([ elem.dtype for elem in elems ], []))
+    for i, elem in enumerate(elems):
+        result[tuple([ slice(0, n) for n in elem.shape ]) + (i,)] = elem
+    return result
+
+class Hdf5FieldWriter(object):
+    """Writes the per-field columns of bot-log2struct to HDF5.
+
+    append() takes a dict of fields as built for savemat, with the messages
+    along the last axis, and appends every numeric field to a dataset of the
+    same name.  Variable length fields, which savemat stores as cells, are
+    zero padded.  Fields that are not numeric arrays, such as lists of
+    strings, are reported once and skipped, and the datasets of fields that
+    are missing from a block are zero filled, so every dataset has a column
+    per message.
+    """
+
+    def __init__(self, output, group):
+        self.output = output
+        self.group = group
+        self.nrows = 0
+        self.nbytes = 0
+        self._datasets = {}
+        self._skipped = set()
+        if "numMsg" in group.attrs:
+            self.nrows = int(group.attrs["numMsg"])
+            for name, ds in group.items():
+                self._datasets[name] = ds
+                self.nbytes += ds.size * ds.dtype.itemsize
+
+    def append(self, fields, count):
+        if count == 0:
+            return
+        for name, value in fields.items():
+            if name in ("numMsg", "channel", "typename"):
+                continue
+            if _is_ragged(value, count):
+                value = _zero_padded(value)
+            if isinstance(value, numpy.ndarray) and value.dtype.kind in "biuf" \
+                    and value.ndim >= 2 and value.shape[-1] == count:
+                self._append_field(name, value)
+                self.nbytes += value.nbytes
+            elif name not in self._skipped and not (type(value) is list and not value):
+                sys.stderr.write("hdf5: not writing field %s of channel %s\n"
+                        % (name, self.group.attrs["channel"]))
+                self._skipped.add(name)
+        self.nrows += count
+        for name, ds in self._datasets.items():
+            if ds.shape[-1] < self.nrows:
+                ds.resize(ds.shape[:-1] + (self.nrows,))
+        self.group.attrs["numMsg"] = self.nrows
+
+    def _append_field(self, name, value):
+        ds = self._datasets.get(name, None)
+        if ds is None:
+            chunks = tuple([ max(n, 1) for n in value.shape[:-1] ]) + (self.output.blockSize,)
+            ds = self.output.create_dataset(self.group, name, value.shape[:-1] + (self.nrows,),
+                    (None,) * value.ndim, chunks, value.dtype)
+            self._datasets[name] = ds
+        shape = tuple([ max(n, m) for n, m in zip(ds.shape[:-1], value.shape[:-1]) ])
+        ds.resize(shape + (self.nrows + value.shape[-1],))
+        ds[tuple([ slice(0, n) for n in value.shape[:-1] ]) + (slice(self.nrows, None),)] = value
+
+    def flush(self):
+        pass
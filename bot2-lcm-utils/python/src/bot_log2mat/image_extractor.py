@@ -0,0 +1,122 @@
+#
+# Extraction of the frames of bot_core.image_t channels for bot-log2mat
+# --images.
+#
+# The pixels of an image_t are a byte array, which the flattened rows leave
+# out, and which would be one float64 column per byte if they were kept.
+# Instead the pixel bytes of every frame are copied straight from the log
+# into one file per channel, and the channel's matrix only holds the frame
+# metadata:
+#
+#   utime width height row_stride pixelformat size offset log_time
+#
+# where offset is the byte offset of the frame's pixels in the file.  If every
+# frame has the same size and its rows are not padded, the file is
+# <prefix>_<channel>.npy, a uint8 array of shape N x height x width x channels
+# that numpy.load(..., mmap_mode="r") maps without reading it.  Otherwise,
+# e.g. for MJPEG frames, it is <prefix>_<channel>.raw, whose first 128 bytes,
+# the room left for the .npy header, are unused.
+
+import os
+import struct
+import numpy
+
+from conversion import channel_file_name
+
+IMAGE_COLUMNS = [ "utime", "width", "height", "row_stride", "pixelformat",
+        "size", "offset" ]
+
+# the fields before the pixels, after the fingerprint
+_IMAGE_HEADER = struct.Struct(">qiiiii")
+_DATA_OFFSET = 8 + _IMAGE_HEADER.size
+
+# the frames are written after room for the .npy header, which is only known
+# once all of them are
+NPY_HEADER_SIZE = 128
+
+def is_image_type(lcmtype):
+    """Check whether an LCM type is bot_core.image_t."""
+    return lcmtype.__name__ == "image_t" and \
+            lcmtype.__module__.split(".")[0] == "bot_core"
+
+def npy_header(shape, descr="|u1"):
+    """The NPY_HEADER_SIZE bytes of .npy header of an array of shape and
+    the dtype descr."""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': %r, }" % (descr, shape)
+    size = NPY_HEADER_SIZE - 10
+    if len(header) + 1 > size:
+        raise ValueError("array shape %r too long for the .npy header" % (shape,))
+    return "\x93NUMPY\x01\x00" + struct.pack("<H", size) + header.ljust(size - 1) + "\n"
+
+class FrameFile(object):
+    """Frames of one image_t channel, written as they are read."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = open(fname + ".frames", "wb")
+        self.file.write("\0" * NPY_HEADER_SIZE)
+        self.offset = NPY_HEADER_SIZE
+        self.count = 0
+        # (height, width, channels) while all frames are alike, else None
+        self.shape = None
+
+    def add(self, payload):
+        """Write the pixels of an encoded image_t message, and return its
+        metadata row."""
+        utime, width, height, row_stride, pixelformat, size = \
+                _IMAGE_HEADER.unpack_from(payload, 8)
+        if size < 0 or _DATA_OFFSET + size > len(payload):
+            raise ValueError("truncated image")
+        numpy.frombuffer(payload, numpy.uint8, size, _DATA_OFFSET).tofile(self.file)
+
+        shape = None
+        if width > 0 and row_stride % width == 0 and size == row_stride * height:
+            shape = (height, width, row_stride // width)
+        if self.count == 0:
+            self.shape = shape
+        elif shape != self.shape:
+            self.shape = None
+        row = [ utime, width, height, row_stride, pixelformat, size, self.offset ]
+        self.offset += size
+        self.count += 1
+        return row
+
+    def close(self):
+        """Finish the file, and return its name."""
+        if self.shape is not None:
+            self.file.seek(0)
+            self.file.write(npy_header((self.count,) + self.shape))
+            name, stale = self.fname + ".npy", self.fname + ".raw"
+        else:
+            name, stale = self.fname + ".raw", self.fname + ".npy"
+        self.file.close()
+        os.rename(self.fname + ".frames", name)
+        # from an earlier conversion of a log with other frames
+        if os.path.exists(stale):
+            os.remove(stale)
+        return name
+
+class ImageExtractor(object):
+    """Writes the frames of the image_t channels of a conversion to
+    <prefix>_<channel>.npy or .raw, see above."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.channels = {}
+
+    def add(self, channel, payload):
+        """Write the frame of an image_t message, and return its metadata
+        row (without the log time)."""
+        frames = self.channels.get(channel, None)
+        if frames is None:
+            frames = FrameFile(channel_file_name(self.prefix, channel))
+            self.channels[channel] = frames
+        return frames.add(payload)
+
+    def close(self):
+        """Finish the frame files, and return a dict mapping each channel to
+        its file."""
+        files = {}
+        for channel, frames in self.channels.items():
+            files[channel] = frames.close()
+        return files
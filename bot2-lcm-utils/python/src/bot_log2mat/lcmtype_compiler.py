@@ -0,0 +1,833 @@
+#
+# Compiles LCM types into decoders that work directly on the raw message bytes.
+#
+# The wire layout of a type is recovered from the python module generated by
+# lcm-gen (either from the __typenames__/__dimensions__ attributes written by
+# newer versions of lcm-gen, or by reading the generated _decode_one method),
+# or registered for the classes lcmtype_idl makes from .lcm files, and turned
+# into precompiled struct.Struct runs and a NumPy record dtype.
+# Fixed size messages can then be decoded in bulk with numpy.frombuffer, and
+# variable size messages are walked with offset arithmetic, without building
+# the python message objects that lcmtype.decode() creates.
+#
+# A decoder can also be compiled for a projection of the fields of a type (see
+# flatten.py).  It then only reads the selected fields: the others are
+# stepped over using the fixed sizes and the lengths in the message, without
+# being unpacked.
+
+import re
+import sys
+import struct
+import inspect
+import numpy
+
+from flatten import field_tree
+
+# lcm type name -> (struct format character, numpy dtype, size in bytes)
+PRIMITIVE_TYPES = {
+    "int8_t"  : ("b", ">i1", 1),
+    "int16_t" : ("h", ">i2", 2),
+    "int32_t" : ("i", ">i4", 4),
+    "int64_t" : ("q", ">i8", 8),
+    "float"   : ("f", ">f4", 4),
+    "double"  : ("d", ">f8", 8),
+    "boolean" : ("?", ">i1", 1),
+    "byte"    : ("B", ">u1", 1),
+}
+
+# struct format character used by lcm-gen -> lcm type name
+_FORMAT_TYPES = {
+    "b" : "int8_t",
+    "h" : "int16_t",
+    "i" : "int32_t",
+    "q" : "int64_t",
+    "f" : "float",
+    "d" : "double",
+    "?" : "boolean",
+    "B" : "byte",
+}
+
+FINGERPRINT_FIELD = "__fingerprint"
+
+class LcmMember(object):
+    """A single member of an LCM struct.
+
+    typename is the lcm primitive type name ("int32_t", "string", ...) or the
+    name of the nested struct.  dims holds one entry per array dimension:
+    an int for fixed size dimensions, or the name of the member holding the
+    length for variable size ones.
+    """
+    __slots__ = ["name", "typename", "dims", "subtype"]
+
+    def __init__(self, name, typename, dims=None, subtype=None):
+        self.name = name
+        self.typename = typename
+        self.dims = list(dims or [])
+        self.subtype = subtype
+
+    def __repr__(self):
+        dims = "".join("[%s]" % d for d in self.dims)
+        return "%s %s%s" % (self.typename, self.name, dims)
+
+class LcmStruct(object):
+    """Wire layout of an LCM type: its members in declaration order."""
+    __slots__ = ["name", "members", "fingerprint"]
+
+    def __init__(self, name, members=None, fingerprint=None):
+        self.name = name
+        self.members = members or []
+        self.fingerprint = fingerprint
+
+    def __repr__(self):
+        return "struct %s { %s }" % (self.name,
+                "; ".join(repr(m) for m in self.members))
+
+def _product(values):
+    result = 1
+    for v in values:
+        result *= v
+    return result
+
+### Recovering the layout from lcm-gen python modules
+
+_schemas = {}
+
+_SKIP_RE = re.compile(r"^(def _decode_one\(buf\):|self = \w+\(\)|return self"
+        r"|__\w+_len = struct\.unpack\('>I', buf\.read\(4\)\)\[0\])$")
+_FOR_RE = re.compile(r"^for i\d+ in range\((self\.)?(\w+)\):$")
+_FLUSH_RE = re.compile(r"^(self\.\w+(?:, self\.\w+)*) = "
+        r"struct\.unpack\((['\"])>([A-Za-z?]+)\2, buf\.read\(\d+\)\)(\[0\])?$")
+_ACCESSOR_RE = re.compile(r"^self\.(\w+)((?:\[i\d+\])*)( = |\.append ?\()(.*)$")
+_STRING_RE = re.compile(r"^buf\.read\(__\w+_len\)\[:-1\]\.decode\(")
+_BOOL_RE = re.compile(r"^bool\(struct\.unpack\((['\"])b\1, buf\.read\(1\)\)\[0\]\)$")
+_BOOL_LIST_RE = re.compile(r"^map\(bool, struct\.unpack\((['\"])>(\d+|%d)b\1"
+        r"(?: % self\.(\w+))?, ")
+_LIST_RE = re.compile(r"^struct\.unpack\((['\"])>(\d+|%d)([A-Za-z?])\1(?: % self\.(\w+))?, ")
+_SCALAR_RE = re.compile(r"^struct\.unpack\((['\"])>?([A-Za-z?])\1, buf\.read\(\d+\)\)\[0\]$")
+_BYTES_RE = re.compile(r"^(?:bytearray\()?buf\.read\((self\.)?(\w+)\)\)?$")
+_NESTED_RE = re.compile(r"^([\w\.]+)\._decode_one\(buf\)$")
+
+def _dim_value(token):
+    if token.isdigit():
+        return int(token)
+    return token
+
+def _resolve_type(klass, typename):
+    """Find the class for a (possibly dotted) type name used inside klass."""
+    namespace = sys.modules[klass.__module__].__dict__
+    parts = typename.split(".")
+    obj = namespace.get(parts[0], None)
+    if obj is None:
+        obj = sys.modules.get(parts[0], None)
+    for part in parts[1:]:
+        if obj is None:
+            break
+        obj = getattr(obj, part, None)
+    if obj is not None and not isinstance(obj, type):
+        # a module named after the type, as in "import image_metadata_t"
+        obj = getattr(obj, parts[-1], None)
+    if obj is None:
+        modname = ".".join(parts)
+        __import__(modname)
+        obj = getattr(sys.modules[modname], parts[-1])
+    return obj
+
+def _members_from_attributes(klass):
+    members = []
+    for name, typename, dims in zip(klass.__slots__, klass.__typenames__,
+            klass.__dimensions__):
+        dims = [ _dim_value(str(d)) for d in (dims or []) ]
+        member = LcmMember(name, typename, dims)
+        if typename not in PRIMITIVE_TYPES and typename != "string":
+            member.subtype = lcmtype_schema(_resolve_type(klass, typename))
+            member.typename = member.subtype.name
+        members.append(member)
+    return members
+
+def _members_from_source(klass):
+    source = inspect.getsource(klass._decode_one)
+    members = []
+    seen = {}
+    loops = []
+
+    def add(name, typename, dims, subtype=None):
+        if name in seen:
+            return
+        member = LcmMember(name, typename, dims, subtype)
+        seen[name] = member
+        members.append(member)
+
+    for line in source.splitlines():
+        stmt = line.strip()
+        if not stmt or stmt.startswith("#") or stmt.startswith("@"):
+            continue
+        indent = len(line) - len(line.lstrip())
+        while loops and loops[-1][0] >= indent:
+            loops.pop()
+        dims = [ d for i, d in loops ]
+
+        if _SKIP_RE.match(stmt):
+            continue
+        m = _FOR_RE.match(stmt)
+        if m:
+            loops.append((indent, _dim_value(m.group(2))))
+            continue
+        m = _FLUSH_RE.match(stmt)
+        if m:
+            names = [ s.strip()[len("self."):] for s in m.group(1).split(",") ]
+            fmt = m.group(3)
+            if len(names) != len(fmt):
+                raise ValueError("can't parse %s: %s" % (klass.__name__, stmt))
+            for name, c in zip(names, fmt):
+                add(name, _FORMAT_TYPES[c], dims)
+            continue
+
+        m = _ACCESSOR_RE.match(stmt)
+        if not m:
+            raise ValueError("can't parse %s: %s" % (klass.__name__, stmt))
+        name, rhs = m.group(1), m.group(4)
+        if m.group(3) != " = ":
+            rhs = rhs[:-1]
+        if rhs in ("[]", "([])"):
+            # container for a multidimensional array
+            continue
+
+        if _STRING_RE.match(rhs):
+            add(name, "string", dims)
+            continue
+        if _BOOL_RE.match(rhs):
+            add(name, "boolean", dims)
+            continue
+        lm = _BOOL_LIST_RE.match(rhs)
+        if lm:
+            add(name, "boolean", dims + [ _dim_value(lm.group(3) or lm.group(2)) ])
+            continue
+        lm = _LIST_RE.match(rhs)
+        if lm:
+            add(name, _FORMAT_TYPES[lm.group(3)],
+                    dims + [ _dim_value(lm.group(4) or lm.group(2)) ])
+            continue
+        lm = _SCALAR_RE.match(rhs)
+        if lm:
+            add(name, _FORMAT_TYPES[lm.group(2)], dims)
+            continue
+        lm = _BYTES_RE.match(rhs)
+        if lm:
+            add(name, "byte", dims + [ _dim_value(lm.group(2)) ])
+            continue
+        lm = _NESTED_RE.match(rhs)
+        if lm:
+            subtype = lcmtype_schema(_resolve_type(klass, lm.group(1)))
+            add(name, subtype.name, dims, subtype)
+            continue
+        raise ValueError("can't parse %s: %s" % (klass.__name__, stmt))
+    return members
+
+def lcmtype_schema(klass):
+    """Return the LcmStruct describing the wire layout of an lcm-gen class.
+
+    Raises ValueError if the layout can't be recovered.
+    """
+    schema = _schemas.get(klass, None)
+    if schema is not None:
+        return schema
+
+    # register before walking the members, so recursive types terminate
+    schema = LcmStruct(klass.__name__, [], klass._get_packed_fingerprint())
+    _schemas[klass] = schema
+    try:
+        if hasattr(klass, "__typenames__") and hasattr(klass, "__dimensions__"):
+            members = _members_from_attributes(klass)
+        else:
+            members = _members_from_source(klass)
+        if [ m.name for m in members ] != list(klass.__slots__):
+            raise ValueError("recovered members of %s don't match __slots__"
+                    % klass.__name__)
+    except Exception:
+        del _schemas[klass]
+        raise
+    schema.members = members
+    return schema
+
+def register_schema(klass, schema):
+    """Use schema as the wire layout of klass, a class that is not lcm-gen
+    output, such as the ones of lcmtype_idl."""
+    _schemas[klass] = schema
+
+### Compiled decoders
+
+def _is_fixed(schema, visiting=None):
+    if visiting is None:
+        visiting = set()
+    if id(schema) in visiting:
+        return False
+    visiting.add(id(schema))
+    for member in schema.members:
+        if member.typename == "string":
+            return False
+        for d in member.dims:
+            if not isinstance(d, int):
+                return False
+        if member.subtype is not None and \
+                not _is_fixed(member.subtype, visiting):
+            return False
+    visiting.discard(id(schema))
+    return True
+
+def _body_dtype(schema):
+    fields = []
+    for member in schema.members:
+        if member.subtype is not None:
+            base = _body_dtype(member.subtype)
+        else:
+            base = numpy.dtype(PRIMITIVE_TYPES[member.typename][1])
+        if member.dims:
+            fields.append((member.name, base, tuple(member.dims)))
+        else:
+            fields.append((member.name, base))
+    return numpy.dtype(fields)
+
+def _fixed_format(member, tree=None):
+    """struct format for a fixed size member and the number of values it
+    contributes to a flattened row, of the fields of the projection tree if
+    given."""
+    count = _product(member.dims)
+    if member.subtype is not None:
+        sub_fmt, sub_nvalues = _struct_format(member.subtype, tree)
+        return sub_fmt * count, sub_nvalues * count
+    c = PRIMITIVE_TYPES[member.typename][0]
+    if c == "B" and member.dims:
+        # byte arrays are read as strings by lcm-gen, and strings are not
+        # part of a flattened row; a single byte is an int
+        return "%dx" % count, 0
+    return "%d%s" % (count, c), count
+
+def _fixed_size(member):
+    return struct.calcsize(">" + _fixed_format(member)[0])
+
+def _selected(tree, member):
+    """(selected, sub-tree) of a member for a projection tree."""
+    if tree is None:
+        return True, None
+    if member.name not in tree:
+        return False, None
+    return True, tree[member.name]
+
+def _struct_format(schema, tree=None):
+    fmt = []
+    nvalues = 0
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if selected:
+            f, n = _fixed_format(member, sub)
+        else:
+            f, n = "%dx" % _fixed_size(member), 0
+        fmt.append(f)
+        nvalues += n
+    return "".join(fmt), nvalues
+
+def _make_run_step(fmt, refs, keep=None):
+    """Step unpacking a run of fixed size members.  The values are appended
+    to the row, or only the ones at the indices in keep."""
+    s = struct.Struct(">" + fmt)
+    size = s.size
+    unpack_from = s.unpack_from
+    def step(buf, offset, row, env):
+        vals = unpack_from(buf, offset)
+        if keep is None:
+            row.extend(vals)
+        else:
+            row.extend([ vals[i] for i in keep ])
+        for name, idx in refs:
+            env[name] = vals[idx]
+        return offset + size
+    return step
+
+def _make_count(dims):
+    if not dims:
+        return lambda env: 1
+    def count(env):
+        n = 1
+        for d in dims:
+            if not isinstance(d, int):
+                d = env[d]
+            if d < 0:
+                raise ValueError("negative array length")
+            n *= d
+        return n
+    return count
+
+def _make_skip_step(size, count):
+    def step(buf, offset, row, env):
+        return offset + size * count(env)
+    return step
+
+def _make_string_step(count):
+    def step(buf, offset, row, env):
+        for i in xrange(count(env)):
+            offset += 4 + struct.unpack_from(">I", buf, offset)[0]
+        return offset
+    return step
+
+def _make_array_step(typename, count):
+    c, dtype, size = PRIMITIVE_TYPES[typename]
+    if c == "B":
+        def step(buf, offset, row, env):
+            return offset + count(env)
+        return step
+    def step(buf, offset, row, env):
+        n = count(env)
+        row.extend(struct.unpack_from(">%d%s" % (n, c), buf, offset))
+        return offset + n * size
+    return step
+
+def _make_nested_step(sub, count):
+    def step(buf, offset, row, env):
+        flatten_into = sub.flatten_into
+        for i in xrange(count(env)):
+            offset = flatten_into(buf, offset, row)
+        return offset
+    return step
+
+_compiled = {}
+
+class CompiledLcmType(object):
+    """Raw-bytes decoder for one LCM type.
+
+    flatten() produces the same row as the generic __slots__ based flattener
+    in log_to_mat (numeric fields in declaration order, nested types
+    expanded, strings and byte arrays skipped).  Fixed size types also get a
+    NumPy record dtype, so a block of messages can be decoded with a single
+    numpy.frombuffer call.
+
+    With a projection tree (see flatten.field_tree) the rows only hold the
+    selected fields, and for fixed size types the record dtype only has
+    them.
+    """
+
+    def __init__(self, schema, tree=None):
+        self.schema = schema
+        self.tree = tree
+        self.fingerprint = schema.fingerprint
+        self._steps = []
+        if _is_fixed(schema):
+            self.body_dtype = _body_dtype(schema)
+            body = self.body_dtype
+            if tree is not None:
+                body = _projected_dtype(schema, self.body_dtype, tree)
+            self.dtype = numpy.dtype([(FINGERPRINT_FIELD, "V8"), ("body", body)])
+            self.itemsize = self.dtype.itemsize
+        else:
+            self.body_dtype = None
+            self.dtype = None
+            self.itemsize = None
+
+    def _compile_steps(self):
+        tree = self.tree
+        dim_refs = set()
+        for member in self.schema.members:
+            dim_refs.update([ d for d in member.dims if not isinstance(d, int) ])
+
+        # runs of fixed size members are unpacked with one struct; with a
+        # projection, keep has the indices of the values of selected members
+        run_fmt = []
+        run_refs = []
+        run_keep = []
+        run_nvalues = 0
+        def flush_run():
+            keep = None
+            if tree is not None:
+                keep = list(run_keep)
+            self._steps.append(_make_run_step("".join(run_fmt), list(run_refs), keep))
+            del run_fmt[:], run_refs[:], run_keep[:]
+        for member in self.schema.members:
+            selected, sub = _selected(tree, member)
+            fixed = member.typename != "string" and \
+                    all(isinstance(d, int) for d in member.dims) and \
+                    (member.subtype is None or _is_fixed(member.subtype))
+            if fixed:
+                if selected:
+                    fmt, nvalues = _fixed_format(member, sub)
+                    run_keep.extend(range(run_nvalues, run_nvalues + nvalues))
+                elif member.name in dim_refs:
+                    # the length of another member
+                    fmt, nvalues = _fixed_format(member)
+                else:
+                    fmt, nvalues = "%dx" % _fixed_size(member), 0
+                if member.name in dim_refs:
+                    run_refs.append((member.name, run_nvalues))
+                run_fmt.append(fmt)
+                run_nvalues += nvalues
+                continue
+            if run_fmt:
+                flush_run()
+                run_nvalues = 0
+            count = _make_count(member.dims)
+            if member.typename == "string":
+                self._steps.append(_make_string_step(count))
+            elif member.subtype is not None:
+                if not selected:
+                    # walked through without keeping anything
+                    sub = {}
+                if _is_fixed(member.subtype) and not selected:
+                    self._steps.append(_make_skip_step(
+                        _compile_schema(member.subtype).body_dtype.itemsize, count))
+                else:
+                    self._steps.append(_make_nested_step(
+                        _compile_schema(member.subtype, sub), count))
+            elif selected:
+                self._steps.append(_make_array_step(member.typename, count))
+            else:
+                self._steps.append(_make_skip_step(PRIMITIVE_TYPES[member.typename][2], count))
+        if run_fmt:
+            flush_run()
+
+    def flatten_into(self, buf, offset, row):
+        """Append the flattened message starting at offset (just past the
+        fingerprint) to row, and return the offset of the following byte."""
+        env = {}
+        for step in self._steps:
+            offset = step(buf, offset, row, env)
+        return offset
+
+    def flatten(self, data):
+        """Flatten one encoded message, fingerprint included, into a list."""
+        row = []
+        end = self.flatten_into(data, 8, row)
+        if end > len(data):
+            raise ValueError("truncated %s message" % self.schema.name)
+        return row
+
+    def check(self, data):
+        """Raise ValueError if an encoded fixed size message is truncated."""
+        if len(data) < self.itemsize:
+            raise ValueError("truncated %s message" % self.schema.name)
+
+    def decode_block(self, payloads):
+        """Decode a list of encoded fixed size messages into a record array."""
+        size = self.itemsize
+        joined = "".join([ p[:size] for p in payloads ])
+        if len(joined) != size * len(payloads):
+            raise ValueError("truncated %s message" % self.schema.name)
+        return numpy.frombuffer(joined, dtype=self.dtype)["body"]
+
+    def flatten_block(self, records):
+        """Flatten a record array from decode_block into a float64 matrix."""
+        return _flatten_records(self.schema, records, self.tree)
+
+    def row_widths(self, records):
+        """The rows of fixed size messages all have the same width."""
+        return None
+
+    def has_struct_columns(self):
+        """True if struct_columns() can represent this type (fixed size,
+        numeric fields, no arrays of nested types)."""
+        return self.dtype is not None and _is_columnar(self.schema)
+
+    def struct_columns(self, records, base="", native=False):
+        """Split a record array into the per-field matrices log_to_struct
+        builds, keyed by the same '__' joined field names.  The matrices are
+        float64, or with native of the fields' own types."""
+        out = {}
+        _struct_columns(self.schema, records, base, out, native)
+        return out
+
+    def typed_block(self, records):
+        """Split a record array from decode_block into the fields of the
+        RowLayout of this type, each in its own type, as RowLayout.split()
+        does with rows."""
+        out = []
+        _typed_records(self.schema, records, self.tree, "", out)
+        return out
+
+def _is_skipped(member):
+    """Whether a member has no columns in the flattened rows: strings, and
+    byte arrays, which lcm-gen reads as strings."""
+    return member.typename == "string" or (member.typename == "byte" and member.dims)
+
+def _flatten_records(schema, records, tree=None):
+    nrecords = len(records)
+    cols = []
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if _is_skipped(member) or not selected:
+            continue
+        col = records[member.name]
+        if member.subtype is not None:
+            col = _flatten_records(member.subtype, col.reshape(-1), sub)
+        elif member.typename == "boolean":
+            col = col != 0
+        cols.append(col.reshape(nrecords, -1).astype(numpy.float64))
+    if not cols:
+        return numpy.zeros((nrecords, 0))
+    return numpy.hstack(cols)
+
+def _is_columnar(schema):
+    for member in schema.members:
+        if _is_skipped(member):
+            return False
+        if member.subtype is not None and \
+                (member.dims or not _is_columnar(member.subtype)):
+            return False
+    return True
+
+def _struct_columns(schema, records, base, out, native):
+    for member in schema.members:
+        if base:
+            name = base + "__" + member.name
+        else:
+            name = member.name
+        col = records[member.name]
+        if member.subtype is not None:
+            _struct_columns(member.subtype, col, name, out, native)
+            continue
+        if member.typename == "boolean":
+            col = col != 0
+        if native:
+            col = col.astype(col.dtype.newbyteorder("="))
+        else:
+            col = col.astype(numpy.float64)
+        if member.dims:
+            out[name] = col.transpose()
+        else:
+            out[name] = numpy.atleast_2d(col)
+
+def _field_dtypes(schema, base, out):
+    for member in schema.members:
+        if base:
+            name = base + "__" + member.name
+        else:
+            name = member.name
+        if member.subtype is not None:
+            # for an array of nested types these are the names of --ragged
+            _field_dtypes(member.subtype, name, out)
+        elif member.typename == "boolean":
+            out[name] = numpy.dtype(numpy.bool_)
+        elif member.typename != "string":
+            out[name] = numpy.dtype(PRIMITIVE_TYPES[member.typename][1]).newbyteorder("=")
+
+def field_dtypes(klass):
+    """Return a dict mapping the '__' joined names log_to_struct gives the
+    numeric fields of an lcm-gen class to their dtypes, or None if its wire
+    layout can't be recovered."""
+    try:
+        schema = lcmtype_schema(klass)
+    except Exception:
+        return None
+    out = {}
+    _field_dtypes(schema, "", out)
+    return out
+
+def _projected_dtype(schema, body_dtype, tree):
+    """The record dtype of the selected members only, at their offsets in
+    the full record."""
+    names = []
+    formats = []
+    offsets = []
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if not selected:
+            continue
+        dtype, offset = body_dtype.fields[member.name][:2]
+        if sub is not None:
+            base, shape = dtype.base, dtype.shape
+            dtype = numpy.dtype((_projected_dtype(member.subtype, base, sub), shape))
+        names.append(member.name)
+        formats.append(dtype)
+        offsets.append(offset)
+    return numpy.dtype({ "names" : names, "formats" : formats, "offsets" : offsets,
+            "itemsize" : body_dtype.itemsize })
+
+def _tree_key(tree):
+    if tree is None:
+        return None
+    return tuple(sorted([ (name, _tree_key(sub)) for name, sub in tree.items() ]))
+
+def _compile_schema(schema, tree=None):
+    key = (id(schema), _tree_key(tree))
+    compiled = _compiled.get(key, None)
+    if compiled is None:
+        compiled = CompiledLcmType(schema, tree)
+        _compiled[key] = compiled
+        compiled._compile_steps()
+    return compiled
+
+def compile_lcmtype(klass, fields=None):
+    """Return a CompiledLcmType for an lcm-gen class, of the projection
+    fields (a tuple of field names) if given, or None if its wire layout
+    can't be recovered (the caller should fall back to decode())."""
+    tree = None
+    if fields is not None:
+        tree = field_tree(fields)
+    try:
+        return _compile_schema(lcmtype_schema(klass), tree)
+    except Exception:
+        return None
+
+### Typed fields of flattened rows
+
+def _native_dtype(typename):
+    if typename == "boolean":
+        return numpy.dtype(numpy.bool_)
+    return numpy.dtype(PRIMITIVE_TYPES[typename][1]).newbyteorder("=")
+
+def _layout_fields(schema, tree, prefix, out):
+    """Append the (name, dtype) of the fields of the flattened rows of
+    schema to out.  Return whether all the rows have the same columns, or
+    None if the length of a variable size array is not in the rows."""
+    fixed = True
+    columns = set()
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if not selected or _is_skipped(member):
+            continue
+        columns.add(member.name)
+        for d in member.dims:
+            if not isinstance(d, int):
+                if d not in columns:
+                    return None
+                fixed = False
+        name = prefix + member.name
+        if member.subtype is not None:
+            nested = _layout_fields(member.subtype, sub, name + ".", out)
+            if nested is None:
+                return None
+            fixed = fixed and nested
+        else:
+            out.append((name, _native_dtype(member.typename)))
+    return fixed
+
+def _fixed_width(schema, tree):
+    width = 0
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if not selected or _is_skipped(member):
+            continue
+        count = _product(member.dims)
+        if member.subtype is not None:
+            count *= _fixed_width(member.subtype, sub)
+        width += count
+    return width
+
+def _split_row(schema, tree, row, pos, prefix, out):
+    """Add the values of each field in the flattened row from column pos on
+    to the lists of out, and return the column after them."""
+    lengths = {}
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if not selected or _is_skipped(member):
+            continue
+        count = 1
+        for d in member.dims:
+            if not isinstance(d, int):
+                d = int(lengths[d])
+            count *= d
+        name = prefix + member.name
+        if member.subtype is not None:
+            for i in xrange(count):
+                pos = _split_row(member.subtype, sub, row, pos, name + ".", out)
+            continue
+        if not member.dims:
+            lengths[member.name] = row[pos]
+        out[name].extend(row[pos:pos + count])
+        pos += count
+    return pos
+
+def _typed_records(schema, records, tree, prefix, out):
+    """Append the (name, values, None) of the fields of a record array, as
+    RowLayout.split() gives them, to out."""
+    nrecords = len(records)
+    for member in schema.members:
+        selected, sub = _selected(tree, member)
+        if not selected or _is_skipped(member):
+            continue
+        col = records[member.name]
+        name = prefix + member.name
+        if member.subtype is not None:
+            nested = []
+            _typed_records(member.subtype, col.reshape(-1), sub, name + ".", nested)
+            out.extend([ (n, values.reshape(nrecords, -1), None) for n, values, w in nested ])
+            continue
+        if member.typename == "boolean":
+            col = col != 0
+        out.append((name, col.reshape(nrecords, -1).astype(_native_dtype(member.typename)), None))
+
+class RowLayout(object):
+    """The fields of the rows messages of an LCM type are flattened into,
+    for writing each numeric field in its own type.
+
+    fields lists the (name, dtype) of the fields in row order, the fields
+    of nested types being named like "pose.pos".  The values of a field of
+    an array of nested types are the ones of all its elements, in order.
+    width is the number of values of a row, or None if it varies.
+    """
+
+    def __init__(self, schema, tree=None):
+        self.schema = schema
+        self.tree = tree
+        self.fields = []
+        fixed = _layout_fields(schema, tree, "", self.fields)
+        if fixed is None:
+            raise ValueError("%s has arrays whose length is not in its rows" % schema.name)
+        self.width = None
+        self._columns = None
+        if fixed:
+            self.width = _fixed_width(schema, tree)
+            out = dict([ (name, []) for name, dtype in self.fields ])
+            _split_row(schema, tree, range(self.width), 0, "", out)
+            self._columns = []
+            for name, dtype in self.fields:
+                cols = out[name]
+                if cols and cols == range(cols[0], cols[0] + len(cols)):
+                    cols = slice(cols[0], cols[0] + len(cols))
+                self._columns.append((name, dtype, cols))
+
+    def split(self, rows):
+        """Split rows, the lists of values the flatteners make of messages
+        (without the log time), into their fields.
+
+        Return a list of (name, values, widths) in field order, values
+        holding the values of the field of each message, zero padded, in its
+        type, and widths the number of values of each message, or None if
+        they are the same for all.  The values are converted from the python
+        numbers of the rows, never through float64.  Raises ValueError if
+        the rows are not rows of the type."""
+        count = len(rows)
+        if self._columns is not None:
+            block = numpy.empty((count, self.width), dtype=object)
+            for i, row in enumerate(rows):
+                if len(row) != self.width:
+                    raise ValueError("%s rows have %d values, not %d" % (self.schema.name,
+                        len(row), self.width))
+                block[i] = row
+            return [ (name, block[:, cols].astype(dtype), None)
+                    for name, dtype, cols in self._columns ]
+
+        split = []
+        for row in rows:
+            out = dict([ (name, []) for name, dtype in self.fields ])
+            if _split_row(self.schema, self.tree, row, 0, "", out) != len(row):
+                raise ValueError("a row of %d values is not a row of %s"
+                        % (len(row), self.schema.name))
+            split.append(out)
+        result = []
+        for name, dtype in self.fields:
+            fieldWidths = numpy.array([ len(out[name]) for out in split ], dtype=numpy.int64)
+            values = numpy.zeros((count, fieldWidths.max() if count else 0), dtype=dtype)
+            for i, out in enumerate(split):
+                values[i, :fieldWidths[i]] = numpy.array(out[name], dtype=object)
+            if count and fieldWidths.min() == fieldWidths.max():
+                fieldWidths = None
+            result.append((name, values, fieldWidths))
+        return result
+
+def row_layout(klass, fields=None):
+    """Return the RowLayout of the rows of an lcm-gen class, of the
+    projection fields if given, or None if its fields can't be known."""
+    tree = None
+    if fields is not None:
+        tree = field_tree(fields)
+    try:
+        return RowLayout(lcmtype_schema(klass), tree)
+    except Exception:
+        return None
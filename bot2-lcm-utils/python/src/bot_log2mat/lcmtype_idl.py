@@ -0,0 +1,415 @@
+#
+# LCM types read straight from their .lcm definitions, for logs whose lcm-gen
+# python packages are not installed.
+#
+# parse_lcm() reads the structs of a .lcm file, and load_lcm_types() turns the
+# structs of a set of files into classes that stand in for the ones lcm-gen
+# would generate: they have the same __slots__, constants and fingerprint
+# (computed the way lcm-gen computes it), and decode() and encode().  The wire
+# layout of each class is given to lcmtype_compiler, so their messages are
+# decoded by the same compiled decoders as the ones of lcm-gen classes.
+#
+# Directories of .lcm files can be given instead of python packages wherever
+# the converters take lcm_packages, e.g. bot-log2mat -l bot2-core/lcmtypes;
+# the types they define are added to the ones found on the python path.
+
+import os
+import re
+import sys
+import struct
+import binascii
+
+from lcmtype_compiler import PRIMITIVE_TYPES, LcmMember, LcmStruct, register_schema
+
+PRIMITIVES = ("int8_t", "int16_t", "int32_t", "int64_t", "byte", "float", "double",
+        "string", "boolean")
+
+_MASK = (1 << 64) - 1
+
+_COMMENT_RE = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_TOKEN_RE = re.compile(r"\s*(?:([A-Za-z_][\w\.]*)|([-+]?[0-9][\w\.]*(?:[eE][-+]?[0-9]+)?)|(\S))")
+
+class LcmDefinition(object):
+    """A struct of a .lcm file.
+
+    members are (name, typename, dims), typename being a primitive type or
+    the package qualified name of a struct, and dims the sizes as written,
+    a number or the name of the member holding the length.  constants are
+    (name, typename, value).
+    """
+
+    def __init__(self, package, name, members, constants, fname=None):
+        self.package = package
+        self.name = name
+        self.members = members
+        self.constants = constants
+        self.fname = fname
+
+    @property
+    def fullname(self):
+        if self.package:
+            return "%s.%s" % (self.package, self.name)
+        return self.name
+
+    def __repr__(self):
+        return "<LcmDefinition %s>" % self.fullname
+
+def _tokenize(text, fname):
+    tokens = []
+    pos = 0
+    text = _COMMENT_RE.sub(" ", text).rstrip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if m is None:
+            raise ValueError("%s: can't parse %r" % (fname, text[pos:pos + 20]))
+        tokens.append(m.group(m.lastindex))
+        pos = m.end()
+    return tokens
+
+def _constant_value(typename, token, fname):
+    try:
+        if typename in ("float", "double"):
+            return float(token)
+        if typename in ("int8_t", "int16_t", "int32_t", "int64_t", "byte"):
+            return int(token, 0)
+    except ValueError:
+        pass
+    raise ValueError("%s: invalid %s constant %s" % (fname, typename, token))
+
+def parse_lcm(text, fname="<string>"):
+    """Return the LcmDefinitions of the structs in the text of a .lcm file.
+
+    Raises ValueError if it can't be parsed.
+    """
+    tokens = _tokenize(text, fname)
+    pos = [ 0 ]
+
+    def next_token(expected=None):
+        if pos[0] >= len(tokens):
+            raise ValueError("%s: unexpected end of file" % fname)
+        token = tokens[pos[0]]
+        pos[0] += 1
+        if expected is not None and token != expected:
+            raise ValueError("%s: expected %r, found %r" % (fname, expected, token))
+        return token
+
+    def name_token():
+        token = next_token()
+        if not re.match(r"^[A-Za-z_]\w*$", token):
+            raise ValueError("%s: invalid name %r" % (fname, token))
+        return token
+
+    package = ""
+    result = []
+    while pos[0] < len(tokens):
+        token = next_token()
+        if token == "package":
+            package = next_token()
+            next_token(";")
+            continue
+        if token != "struct":
+            raise ValueError("%s: expected a struct, found %r" % (fname, token))
+        name = name_token()
+        next_token("{")
+        members = []
+        constants = []
+        while True:
+            token = next_token()
+            if token == "}":
+                break
+            if token == "const":
+                typename = next_token()
+                while True:
+                    cname = name_token()
+                    next_token("=")
+                    constants.append((cname, typename,
+                            _constant_value(typename, next_token(), fname)))
+                    if next_token() == ";":
+                        break
+                continue
+            typename = token
+            if typename not in PRIMITIVES and "." not in typename and package:
+                typename = "%s.%s" % (package, typename)
+            while True:
+                mname = name_token()
+                dims = []
+                token = next_token()
+                while token == "[":
+                    dim = next_token()
+                    if not dim.isdigit() and dim not in [ m[0] for m in members ]:
+                        raise ValueError("%s: unknown array length %s of %s.%s"
+                                % (fname, dim, name, mname))
+                    dims.append(dim)
+                    next_token("]")
+                    token = next_token()
+                members.append((mname, typename, dims))
+                if token == ";":
+                    break
+                if token != ",":
+                    raise ValueError("%s: expected ';', found %r" % (fname, token))
+        result.append(LcmDefinition(package, name, members, constants, fname))
+    return result
+
+def find_lcm_files(path):
+    """Return the .lcm files in a directory and its subdirectories, or [path]
+    if it is a file."""
+    if not os.path.isdir(path):
+        return [ path ]
+    result = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        result.extend([ os.path.join(dirpath, f) for f in sorted(filenames)
+                if f.endswith(".lcm") ])
+    return result
+
+def is_lcm_directory(path):
+    """Whether path is a directory with .lcm files, rather than the name of a
+    python package."""
+    return os.path.isdir(path) and len(find_lcm_files(path)) > 0
+
+### Fingerprints, as computed by lcm-gen
+
+def _signed64(v):
+    v &= _MASK
+    if v >> 63:
+        v -= 1 << 64
+    return v
+
+def _hash_update(v, c):
+    if c > 127:
+        c -= 256
+    return _signed64(((v << 8) ^ (v >> 55)) + c)
+
+def _hash_string_update(v, s):
+    v = _hash_update(v, len(s))
+    for c in s:
+        v = _hash_update(v, ord(c))
+    return v
+
+def base_hash(definition):
+    """The hash lcm-gen computes of a struct, without its nested types."""
+    v = 0x12345678
+    for name, typename, dims in definition.members:
+        v = _hash_string_update(v, name)
+        if typename in PRIMITIVES:
+            v = _hash_string_update(v, typename)
+        v = _hash_update(v, len(dims))
+        for dim in dims:
+            v = _hash_update(v, not dim.isdigit() and 1 or 0)
+            v = _hash_string_update(v, dim)
+    return v & _MASK
+
+### Classes
+
+_FORMATS = dict([ (name, (fmt, size)) for name, (fmt, dtype, size) in PRIMITIVE_TYPES.items() ])
+_FORMATS["boolean"] = ("b", 1)
+
+def _default(typename, klasses):
+    if typename == "string":
+        return ""
+    if typename == "boolean":
+        return False
+    if typename in ("float", "double"):
+        return 0.0
+    if typename in _FORMATS:
+        return 0
+    return klasses[typename]()
+
+def _default_array(typename, counts, klasses):
+    if not counts:
+        return _default(typename, klasses)
+    if counts[0] is None:
+        return []
+    if typename == "byte" and len(counts) == 1:
+        return "\0" * counts[0]
+    return [ _default_array(typename, counts[1:], klasses) for i in range(counts[0]) ]
+
+def _read(typename, counts, data, offset, klasses):
+    """Decode a member, or an array of them of counts, at offset of data, as
+    lcm-gen does, and return (value, offset after it)."""
+    if not counts:
+        if typename == "string":
+            length = struct.unpack_from(">I", data, offset)[0]
+            return data[offset + 4:offset + 3 + length], offset + 4 + length
+        if typename in _FORMATS:
+            fmt, size = _FORMATS[typename]
+            value = struct.unpack_from(">" + fmt, data, offset)[0]
+            if typename == "boolean":
+                value = bool(value)
+            return value, offset + size
+        return klasses[typename]._decode_one(data, offset)
+    count = counts[0]
+    if len(counts) == 1 and typename in _FORMATS:
+        fmt, size = _FORMATS[typename]
+        if typename == "byte":
+            value = data[offset:offset + count]
+            if len(value) != count:
+                raise struct.error("message is truncated")
+        else:
+            value = struct.unpack_from(">%d%s" % (count, fmt), data, offset)
+            if typename == "boolean":
+                value = map(bool, value)
+        return value, offset + count * size
+    value = []
+    for i in range(count):
+        item, offset = _read(typename, counts[1:], data, offset, klasses)
+        value.append(item)
+    return value, offset
+
+def _write(out, typename, counts, value, klasses):
+    if not counts:
+        if typename == "string":
+            if isinstance(value, unicode):
+                value = value.encode("utf-8")
+            out.append(struct.pack(">I", len(value) + 1) + value + "\0")
+        elif typename in _FORMATS:
+            out.append(struct.pack(">" + _FORMATS[typename][0], value))
+        else:
+            value._encode_one(out)
+        return
+    count = counts[0]
+    if len(counts) == 1 and typename in _FORMATS:
+        if typename == "byte":
+            out.append(str(bytearray(value[:count])))
+        else:
+            out.append(struct.pack(">%d%s" % (count, _FORMATS[typename][0]), *value[:count]))
+        return
+    for i in range(count):
+        _write(out, typename, counts[1:], value[i], klasses)
+
+def _dim(dim):
+    """A dimension as written, as an int if it is a fixed size."""
+    if dim.isdigit():
+        return int(dim)
+    return dim
+
+def _counts(dims, obj):
+    """The lengths of the dimensions of a member of the message obj."""
+    counts = []
+    for dim in dims:
+        if dim.isdigit():
+            counts.append(int(dim))
+        else:
+            counts.append(getattr(obj, dim))
+    return counts
+
+def _make_class(definition, klasses):
+    """Make the class of a struct, whose nested types are in klasses, by
+    package qualified name, once they are all made."""
+    members = definition.members
+    nested = [ typename for name, typename, dims in members if typename not in PRIMITIVES ]
+    baseHash = base_hash(definition)
+
+    def __init__(self):
+        for name, typename, dims in members:
+            counts = [ dim.isdigit() and int(dim) or None for dim in dims ]
+            setattr(self, name, _default_array(typename, counts, klasses))
+
+    def _get_hash_recursive(parents):
+        if klass in parents:
+            return 0
+        parents = parents + [ klass ]
+        h = baseHash
+        for typename in nested:
+            h += klasses[typename]._get_hash_recursive(parents)
+        h &= _MASK
+        return ((h << 1) & _MASK) + (h >> 63)
+
+    fingerprint = []
+    def _get_packed_fingerprint():
+        if not fingerprint:
+            fingerprint.append(struct.pack(">Q", _get_hash_recursive([])))
+        return fingerprint[0]
+
+    def _decode_one(data, offset=0):
+        self = klass()
+        for name, typename, dims in members:
+            value, offset = _read(typename, _counts(dims, self), data, offset, klasses)
+            setattr(self, name, value)
+        return self, offset
+
+    def decode(data):
+        if hasattr(data, "read"):
+            data = data.read()
+        if data[:8] != _get_packed_fingerprint():
+            raise ValueError("Decode error")
+        return _decode_one(data, 8)[0]
+
+    def _encode_one(self, out):
+        for name, typename, dims in members:
+            _write(out, typename, _counts(dims, self), getattr(self, name), klasses)
+
+    def encode(self):
+        out = [ _get_packed_fingerprint() ]
+        self._encode_one(out)
+        return "".join(out)
+
+    attributes = {
+        "__slots__" : [ name for name, typename, dims in members ],
+        "__module__" : definition.fullname,
+        "__doc__" : "LCM type %s, from %s" % (definition.fullname, definition.fname),
+        "__init__" : __init__,
+        "_get_hash_recursive" : staticmethod(_get_hash_recursive),
+        "_get_packed_fingerprint" : staticmethod(_get_packed_fingerprint),
+        "_decode_one" : staticmethod(_decode_one),
+        "decode" : staticmethod(decode),
+        "_encode_one" : _encode_one,
+        "encode" : encode,
+    }
+    for name, typename, value in definition.constants:
+        attributes[name] = value
+    klass = type(definition.name, (object,), attributes)
+    return klass
+
+def _schema(definitions, fullname, klasses, schemas):
+    """The LcmStruct of a struct, made after the ones of its nested types."""
+    if fullname not in schemas:
+        definition = definitions[fullname]
+        schema = schemas[fullname] = LcmStruct(definition.name, [],
+                klasses[fullname]._get_packed_fingerprint())
+        for name, typename, dims in definition.members:
+            member = LcmMember(name, typename, [ _dim(dim) for dim in dims ])
+            if typename not in PRIMITIVES:
+                member.subtype = _schema(definitions, typename, klasses, schemas)
+                member.typename = member.subtype.name
+            schema.members.append(member)
+    return schemas[fullname]
+
+def load_lcm_types(paths):
+    """Return the classes of the structs defined in paths, .lcm files and
+    directories of them, by package qualified name.
+
+    Raises ValueError if a file can't be parsed or a struct uses a type that
+    none of them defines.
+    """
+    definitions = {}
+    for path in paths:
+        for fname in find_lcm_files(path):
+            f = open(fname)
+            try:
+                text = f.read()
+            finally:
+                f.close()
+            for definition in parse_lcm(text, fname):
+                definitions[definition.fullname] = definition
+
+    klasses = {}
+    for fullname, definition in definitions.items():
+        for name, typename, dims in definition.members:
+            if typename not in PRIMITIVES and typename not in definitions:
+                raise ValueError("%s: unknown type %s of %s.%s" % (definition.fname,
+                        typename, definition.name, name))
+        klasses[fullname] = _make_class(definition, klasses)
+
+    schemas = {}
+    for fullname in sorted(definitions):
+        register_schema(klasses[fullname], _schema(definitions, fullname, klasses, schemas))
+    return klasses
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print "usage: %s <.lcm files or directories>" % os.path.basename(sys.argv[0])
+        sys.exit(1)
+    klasses = load_lcm_types(sys.argv[1:])
+    for fullname in sorted(klasses):
+        print binascii.hexlify(klasses[fullname]._get_packed_fingerprint()), fullname
@@ -0,0 +1,389 @@
+#
+# Lazy access to the channels of a log, for interactive analysis without
+# converting the whole log first:
+#
+#   from bot_log2mat import LogDataset
+#   ds = LogDataset("run.log")
+#   ds.channels                  # the channels of known LCM types
+#   pose = ds["POSE"]
+#   pose.times                   # log times of its messages, from the index
+#   pose["pos"][1000:2000]       # the pos columns of messages 1000 to 1999
+#   pose["pos", "vel"].between(10.0, 20.0)
+#   pose[:]                      # the matrix of convert(), with the log time
+#
+# Opening a dataset reads the sidecar index of the log, or indexes it in
+# memory if it has none, and decodes nothing.  The rows of a channel are
+# decoded chunkSize messages at a time, only for the fields asked for, with
+# the compiled decoders of bot-log2mat, and the decoded chunks are kept in an
+# LRU cache of at most cacheBytes, so slicing the same stretch of a channel
+# again doesn't read the log again.  Log times are the ones of convert(), in
+# seconds from the first message that decodes.
+
+import numpy
+from collections import OrderedDict
+
+from scan_for_lcmtypes import get_lcmtype_dictionary
+from event_log import MmapEventLog
+from log_index import LogIndex, load_index
+from channel_buffer import ChannelBuffer
+from conversion import first_decoded_timestamp
+from lcmtype_compiler import compile_lcmtype
+from extractors import block_decoder, with_log_times
+from flatten import check_fields, make_flattener, make_column_names
+
+class ChunkCache(object):
+    """Least recently used cache of decoded chunks, holding at most maxBytes
+    of them (and always the last one added)."""
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._chunks = OrderedDict()
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def get(self, key):
+        chunk = self._chunks.pop(key, None)
+        if chunk is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._chunks[key] = chunk
+        return chunk
+
+    def put(self, key, chunk):
+        old = self._chunks.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._chunks[key] = chunk
+        self.nbytes += chunk.nbytes
+        while self.nbytes > self.maxBytes and len(self._chunks) > 1:
+            oldKey, old = self._chunks.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def clear(self):
+        self._chunks.clear()
+        self.nbytes = 0
+
+def _row_indices(key, count):
+    """Return the row numbers selected by key, an int, slice, or sequence or
+    boolean mask of rows, as an array, and whether key was a single int."""
+    if isinstance(key, (int, long, numpy.integer)):
+        if key < 0:
+            key += count
+        if not 0 <= key < count:
+            raise IndexError("row %d out of range" % key)
+        return numpy.array([ key ]), True
+    return numpy.arange(count)[key], False
+
+class FieldView(object):
+    """The columns of some fields of a channel, decoded when they are
+    indexed.
+
+    Indexing it like a matrix, view[rows] or view[rows, columns], returns
+    the rows of those columns as a float64 array.  Rows of variable length
+    messages are zero padded to the widest of the rows returned, and
+    messages that fail to decode give rows of NaN.
+    """
+
+    def __init__(self, channel, fields=None):
+        self.channel = channel
+        self.fields = fields
+        self.columns = channel._column_names(fields)
+
+    def __len__(self):
+        return len(self.channel)
+
+    @property
+    def shape(self):
+        return (len(self), len(self.columns))
+
+    def __getitem__(self, key):
+        columns = None
+        if isinstance(key, tuple):
+            key, columns = key
+        indices, single = _row_indices(key, len(self))
+        rows = self.channel._rows(self.fields, indices)
+        if columns is not None:
+            rows = rows[:, columns]
+        if single:
+            return rows[0]
+        return rows
+
+    def __array__(self, dtype=None):
+        rows = self.array()
+        if dtype is not None:
+            rows = rows.astype(dtype)
+        return rows
+
+    def array(self):
+        """Return all the rows."""
+        return self[:]
+
+    def between(self, start=None, end=None):
+        """Return the rows of the messages with start <= log time < end,
+        in seconds (None for the start or end of the log)."""
+        lo, hi = self.channel.row_range(start, end)
+        return self[lo:hi]
+
+class ChannelView(FieldView):
+    """A channel of a LogDataset.
+
+    view["pos"] or view["pos", "vel"] is the FieldView of some of its fields
+    ("pose.pos" being the pos field of the nested field pose), and indexing
+    it with rows returns the rows of its matrix as convert() makes it, all
+    the fields followed by the log time (which is only in the last column if
+    the row is the widest).
+    """
+
+    def __init__(self, dataset, name, index):
+        self.dataset = dataset
+        self.name = name
+        self.index = index
+        self.typename = dataset.type_db[index.fingerprint].__name__
+        self._first = None
+        self._decoders = {}
+        self.fields = None
+        self.columns = self._column_names(None) + [ "log_time" ]
+        self.channel = self
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            key = (key,)
+        if isinstance(key, tuple) and key and all([ isinstance(k, basestring) for k in key ]):
+            return FieldView(self, tuple(sorted(set(key))))
+        return FieldView.__getitem__(self, key)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return "<ChannelView %s: %d %s messages>" % (self.name, len(self), self.typename)
+
+    @property
+    def times(self):
+        """The log times of the messages, in seconds."""
+        return (self.index.timestamps - self.dataset.startTime) / 1e6
+
+    def row_range(self, start=None, end=None):
+        """Return (lo, hi), the rows of the messages with start <= log time
+        < end."""
+        timestamps = self.index.timestamps
+        lo, hi = 0, len(timestamps)
+        if start is not None:
+            lo = numpy.searchsorted(timestamps, self.dataset.startTime + start * 1e6, "left")
+        if end is not None:
+            hi = numpy.searchsorted(timestamps, self.dataset.startTime + end * 1e6, "left")
+        return int(lo), int(max(hi, lo))
+
+    def _first_message(self):
+        # the first message that decodes, as the rows of the others are NaN
+        if self._first is None:
+            lcmtype = self.dataset.type_db[self.index.fingerprint]
+            offsets = self.index.offsets
+            for i in range(len(offsets)):
+                e = self.dataset.log.read_event(int(offsets[i]))
+                try:
+                    self._first = lcmtype.decode(e.data)
+                    break
+                except:
+                    if i == len(offsets) - 1:
+                        raise
+        return self._first
+
+    def _column_names(self, fields):
+        if not len(self.index):
+            return []
+        msg = self._first_message()
+        if fields is not None:
+            check_fields(msg, fields)
+        return make_column_names(msg, fields=fields)
+
+    def _decoder(self, fingerprint, fields):
+        """(lcmtype, compiled decoder, block decoder, generic flattener) of
+        the messages with a fingerprint, None for the ones they don't have."""
+        key = (fingerprint, fields)
+        if key not in self._decoders:
+            lcmtype = self.dataset.type_db.get(fingerprint, None)
+            compiled = None
+            decoder = None
+            flattener = None
+            if lcmtype is not None:
+                compiled = compile_lcmtype(lcmtype, fields)
+                decoder = block_decoder(lcmtype, compiled, fields)
+                if compiled is None:
+                    flattener = make_flattener(self._first_message(), fields)
+            self._decoders[key] = (lcmtype, compiled, decoder, flattener)
+        return self._decoders[key]
+
+    def _decode_chunk(self, fields, chunk):
+        """Decode the rows of a chunk of messages, with the log times if
+        fields is None."""
+        size = self.dataset.chunkSize
+        lo = chunk * size
+        hi = min(lo + size, len(self))
+        events = list(self.dataset.log.events_at(self.index.offsets[lo:hi]))
+        times = None
+        if fields is None:
+            times = (self.index.timestamps[lo:hi] - self.dataset.startTime) / 1e6
+        buf = ChannelBuffer(capacity=hi - lo)
+        start = 0
+        # the messages are decoded in runs of the same type
+        while start < len(events):
+            fingerprint = events[start].data[:8]
+            end = start + 1
+            while end < len(events) and events[end].data[:8] == fingerprint:
+                end += 1
+            runTimes = None
+            if times is not None:
+                runTimes = times[start:end]
+            self._decode_run(buf, fingerprint, fields, events[start:end], runTimes)
+            start = end
+        return buf.array()
+
+    def _decode_run(self, buf, fingerprint, fields, events, times):
+        lcmtype, compiled, decoder, flattener = self._decoder(fingerprint, fields)
+        if decoder is None:
+            self._decode_each(buf, lcmtype, compiled, flattener, events, times)
+            return
+        # the messages that pass check() are decoded in blocks, the others
+        # one at a time
+        valid = []
+        for e in events:
+            try:
+                decoder.check(e.data)
+                valid.append(True)
+            except:
+                valid.append(False)
+        start = 0
+        while start < len(events):
+            end = start + 1
+            while end < len(events) and valid[end] == valid[start]:
+                end += 1
+            runTimes = None
+            if times is not None:
+                runTimes = times[start:end]
+            if not valid[start] or not self._decode_block(buf, decoder,
+                    events[start:end], runTimes):
+                self._decode_each(buf, lcmtype, compiled, flattener, events[start:end],
+                        runTimes)
+            start = end
+
+    def _decode_block(self, buf, decoder, events, times):
+        try:
+            records = decoder.decode_block([ e.data for e in events ])
+            rows = decoder.flatten_block(records)
+            widths = decoder.row_widths(records)
+        except ValueError:
+            return False
+        if times is not None:
+            rows, widths = with_log_times(rows, widths, times)
+        buf.extend(rows, widths)
+        return True
+
+    def _decode_each(self, buf, lcmtype, compiled, flattener, events, times):
+        # the rows of the messages that can't be decoded are NaN
+        for i, e in enumerate(events):
+            try:
+                if compiled is not None:
+                    row = compiled.flatten(e.data)
+                else:
+                    row = flattener(lcmtype.decode(e.data))
+            except:
+                row = [ numpy.nan ] * max(buf.max_width - (times is not None), 1)
+            if times is not None:
+                row.append(times[i])
+            buf.append(row)
+
+    def _rows(self, fields, indices):
+        """Return the rows of fields (all of them and the log time if None)
+        of the messages indices."""
+        size = self.dataset.chunkSize
+        cache = self.dataset.cache
+        chunks = indices // size
+        parts = []
+        for chunk in numpy.unique(chunks):
+            key = (self.name, fields, int(chunk))
+            rows = cache.get(key)
+            if rows is None:
+                rows = self._decode_chunk(fields, int(chunk))
+                cache.put(key, rows)
+            parts.append((chunks == chunk, rows[indices[chunks == chunk] - chunk * size]))
+        width = max([ rows.shape[1] for mask, rows in parts ] or [ len(self.columns) ])
+        if len(parts) == 1 and parts[0][1].shape[1] == width:
+            return parts[0][1]
+        result = numpy.zeros((len(indices), width))
+        for mask, rows in parts:
+            result[mask, :rows.shape[1]] = rows
+        return result
+
+class LogDataset(object):
+    """The channels of a log, decoded lazily; see above.
+
+    type_db, a dictionary from make_lcmtype_dictionary(), is used instead of
+    the one for lcm_packages.  chunkSize is the number of messages decoded
+    at a time, and cacheBytes the size of the cache of decoded chunks.
+    """
+
+    def __init__(self, fname, lcm_packages=None, type_db=None, chunkSize=4096,
+            cacheBytes=256 << 20):
+        if type_db is None:
+            type_db = get_lcmtype_dictionary(lcm_packages)
+        self.fname = fname
+        self.type_db = type_db
+        self.chunkSize = chunkSize
+        self.cache = ChunkCache(cacheBytes)
+        self.index = load_index(fname)
+        if self.index is None:
+            self.index = LogIndex(fname)
+            self.index.update()
+        self.log = MmapEventLog(fname)
+        self.channels = sorted([ name for name, chan in self.index.channels.items()
+                if chan.fingerprint in type_db ])
+        self._views = {}
+        self._startTime = None
+
+    @property
+    def startTime(self):
+        """Timestamp of the first message that decodes, in microseconds."""
+        if self._startTime is None:
+            self._startTime = first_decoded_timestamp(self.log,
+                    self.index.select(self.channels), self.type_db)
+        return self._startTime
+
+    def __contains__(self, name):
+        return name in self.channels
+
+    def __iter__(self):
+        return iter(self.channels)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def keys(self):
+        return list(self.channels)
+
+    def __getitem__(self, name):
+        if name not in self._views:
+            if name not in self.index.channels:
+                raise KeyError("no channel %s in %s" % (name, self.fname))
+            if name not in self.channels:
+                raise KeyError("channel %s of %s is not a known LCM type" % (name, self.fname))
+            self._views[name] = ChannelView(self, name, self.index.channels[name])
+        return self._views[name]
+
+    def __repr__(self):
+        return "<LogDataset %s: %d channels>" % (self.fname, len(self.channels))
+
+    def close(self):
+        self.cache.clear()
+        self.log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+#
+# Sidecar index for LCM logs.
+#
+# The index stores, for every channel in a log, the byte offsets, timestamps
+# and payload sizes of its events together with the fingerprint of the
+# channel's first message.  It is written next to the log as <log>.idx.npz and
+# lets the converters read only the events of the requested channels and time
+# window.  Indexing is incremental: re-indexing a log that is still being
+# written only scans the events appended since the last run.
+#
+# The type of a channel is taken to be the one of its first message: the
+# converters decode every message with its own type, but a channel whose first
+# message is of an unknown type is skipped as a whole, as is the rest of a
+# channel whose type changes to an unknown one.
+#
+# The sidecar index only saves time.  A log in a read-only directory, or with
+# an index that can't be read, is indexed in memory instead.
+
+import os
+import sys
+import struct
+import numpy
+
+from event_log import MmapEventLog
+
+INDEX_SUFFIX = ".idx.npz"
+
+def index_path(fname):
+    return fname + INDEX_SUFFIX
+
+class ChannelIndex(object):
+    """Events of one channel, in log order."""
+    __slots__ = ["name", "fingerprint", "offsets", "timestamps", "sizes"]
+
+    def __init__(self, name, fingerprint, offsets, timestamps, sizes):
+        self.name = name
+        self.fingerprint = fingerprint
+        self.offsets = offsets
+        self.timestamps = timestamps
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.offsets)
+
+class LogIndex(object):
+    """Per-channel event index of an LCM log."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.channels = {}
+        self.scanned_to = 0
+        self.first_timestamp = None
+        self._header = ""
+
+    def select(self, channels=None, start=None, end=None):
+        """Return the offsets of the events on the given channels (all of
+        them if channels is None) with start <= timestamp < end, sorted in log
+        order.  start and end are absolute timestamps in microseconds."""
+        if channels is None:
+            channels = self.channels.keys()
+        selected = []
+        for name in channels:
+            chan = self.channels[name]
+            lo = 0
+            hi = len(chan)
+            if start is not None:
+                lo = numpy.searchsorted(chan.timestamps, start, "left")
+            if end is not None:
+                hi = numpy.searchsorted(chan.timestamps, end, "left")
+            if hi > lo:
+                selected.append(chan.offsets[lo:hi])
+        if not selected:
+            return numpy.zeros(0, dtype=numpy.int64)
+        offsets = numpy.concatenate(selected)
+        offsets.sort()
+        return offsets
+
+    def partition(self, type_db, is_ignored):
+        """Split the indexed channels into (selected, ignored, unknown), where
+        unknown channels are the ones whose type, the type of their first
+        message, is not in type_db."""
+        selected = []
+        ignored = []
+        unknown = []
+        for name in sorted(self.channels.keys()):
+            if is_ignored(name):
+                ignored.append(name)
+            elif self.channels[name].fingerprint not in type_db:
+                unknown.append(name)
+            else:
+                selected.append(name)
+        return selected, ignored, unknown
+
+    def update(self):
+        """Index the events appended to the log since the last update, and
+        return how many there were."""
+        log = MmapEventLog(self.fname)
+        try:
+            if not self._header:
+                self._header = log.read_header_bytes()
+            new = {}
+            count = 0
+            for offset, timestamp, channel, datalen in log.headers(self.scanned_to):
+                if self.first_timestamp is None:
+                    self.first_timestamp = timestamp
+                lists = new.get(channel, None)
+                if lists is None:
+                    lists = new[channel] = ([], [], [])
+                    if channel not in self.channels:
+                        self.channels[channel] = ChannelIndex(channel,
+                                log.fingerprint_at(offset),
+                                numpy.zeros(0, dtype=numpy.int64),
+                                numpy.zeros(0, dtype=numpy.int64),
+                                numpy.zeros(0, dtype=numpy.uint32))
+                lists[0].append(offset)
+                lists[1].append(timestamp)
+                lists[2].append(datalen)
+                count += 1
+            self.scanned_to = log.tell()
+        finally:
+            log.close()
+
+        for channel, (offsets, timestamps, sizes) in new.items():
+            chan = self.channels[channel]
+            chan.offsets = numpy.concatenate((chan.offsets,
+                numpy.array(offsets, dtype=numpy.int64)))
+            chan.timestamps = numpy.concatenate((chan.timestamps,
+                numpy.array(timestamps, dtype=numpy.int64)))
+            chan.sizes = numpy.concatenate((chan.sizes,
+                numpy.array(sizes, dtype=numpy.uint32)))
+        return count
+
+    def is_valid(self):
+        """Check that the index still describes the log on disk: the log must
+        start with the same event and must not have shrunk."""
+        if not os.path.exists(self.fname):
+            return False
+        if os.path.getsize(self.fname) < self.scanned_to:
+            return False
+        log = MmapEventLog(self.fname)
+        try:
+            return log.read_header_bytes() == self._header
+        finally:
+            log.close()
+
+    def save(self, path=None):
+        if path is None:
+            path = index_path(self.fname)
+        names = sorted(self.channels.keys())
+        chans = [ self.channels[n] for n in names ]
+        ptr = numpy.zeros(len(chans) + 1, dtype=numpy.int64)
+        ptr[1:] = numpy.cumsum([ len(c) for c in chans ])
+        def joined(attr, dtype):
+            if not chans:
+                return numpy.zeros(0, dtype=dtype)
+            return numpy.concatenate([ getattr(c, attr) for c in chans ])
+        fingerprints = [ struct.unpack(">Q", c.fingerprint.ljust(8, "\0"))[0] for c in chans ]
+        if self.first_timestamp is None:
+            first_timestamp = -1
+        else:
+            first_timestamp = self.first_timestamp
+
+        # write a temporary file and move it over the index, so a reader never
+        # sees a partly written index
+        tmp_path = path + ".tmp"
+        f = open(tmp_path, "wb")
+        saved = False
+        try:
+            numpy.savez(f,
+                    channel_names=numpy.array(names, dtype="S"),
+                    fingerprints=numpy.array(fingerprints, dtype=numpy.uint64),
+                    channel_ptr=ptr,
+                    offsets=joined("offsets", numpy.int64),
+                    timestamps=joined("timestamps", numpy.int64),
+                    sizes=joined("sizes", numpy.uint32),
+                    scanned_to=numpy.int64(self.scanned_to),
+                    first_timestamp=numpy.int64(first_timestamp),
+                    log_header=numpy.frombuffer(self._header, dtype=numpy.uint8))
+            saved = True
+        finally:
+            f.close()
+            if not saved:
+                os.remove(tmp_path)
+        os.rename(tmp_path, path)
+
+    @staticmethod
+    def load(fname, path=None):
+        if path is None:
+            path = index_path(fname)
+        index = LogIndex(fname)
+        npz = numpy.load(path)
+        try:
+            names = [ str(n) for n in npz["channel_names"] ]
+            fingerprints = npz["fingerprints"]
+            ptr = npz["channel_ptr"]
+            offsets = npz["offsets"]
+            timestamps = npz["timestamps"]
+            sizes = npz["sizes"]
+            for i, name in enumerate(names):
+                lo, hi = ptr[i], ptr[i + 1]
+                index.channels[name] = ChannelIndex(name,
+                        struct.pack(">Q", int(fingerprints[i])),
+                        offsets[lo:hi], timestamps[lo:hi], sizes[lo:hi])
+            index.scanned_to = int(npz["scanned_to"])
+            first_timestamp = int(npz["first_timestamp"])
+            if first_timestamp >= 0:
+                index.first_timestamp = first_timestamp
+            index._header = npz["log_header"].tostring()
+        finally:
+            npz.close()
+        return index
+
+def build_index(fname, saveErrors=True):
+    """Create or incrementally update the sidecar index of a log.
+
+    An index that can't be read is rebuilt.  If the index can't be written,
+    the IOError or OSError is raised, unless saveErrors is False.
+    """
+    index = None
+    if os.path.exists(index_path(fname)):
+        try:
+            index = LogIndex.load(fname)
+        except Exception:
+            # a corrupt or partly written index
+            index = None
+        if index is not None and not index.is_valid():
+            index = None
+    if index is None:
+        index = LogIndex(fname)
+    if index.update() or not os.path.exists(index_path(fname)):
+        try:
+            index.save()
+        except (IOError, OSError):
+            if saveErrors:
+                raise
+    return index
+
+def load_index(fname):
+    """Return the index of a log if it has a sidecar index, else None.
+
+    An index that no longer matches the log, or can't be read, is rebuilt,
+    and one that lags behind a growing log is brought up to date first.
+    Without write access to the index the result is only kept in memory.
+    """
+    if not os.path.exists(index_path(fname)):
+        return None
+    return build_index(fname, saveErrors=False)
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        sys.stderr.write("usage: %s <logfile> [<logfile> ...]\n" % os.path.basename(sys.argv[0]))
+        sys.stderr.write("Write or update the sidecar index <logfile>%s\n" % INDEX_SUFFIX)
+        sys.exit(1)
+    for fname in sys.argv[1:]:
+        index = build_index(fname)
+        nevents = sum([ len(c) for c in index.channels.values() ])
+        sys.stderr.write("indexed %s: %d events on %d channels\n" % (fname, nevents, len(index.channels)))
+
+if __name__ == "__main__":
+    main()
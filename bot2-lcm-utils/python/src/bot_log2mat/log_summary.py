@@ -0,0 +1,373 @@
+#!/usr/bin/python
+#
+# Summary of the channels of an LCM log, for bot-log-summary.
+#
+# Only the event headers are read: no payload is decoded, and of each
+# channel only the fingerprint of its first message is looked at.  In one
+# pass over the log every channel gets:
+#
+#   - its number of messages and payload bytes
+#   - its mean rate, and the 5th, 50th and 95th percentile of the rates
+#     between consecutive messages
+#   - the jitter of its messages, the standard deviation of the intervals
+#     between them
+#   - its largest gaps, the longest intervals without a message
+#   - a histogram of its payload sizes in powers of two
+#
+# The headers are parsed into blocks of events, which are added to the
+# statistics of their channels with numpy.  The intervals go to a histogram
+# with logarithmic bins, so memory does not grow with the length of the log,
+# and a percentile is the mean of the intervals in its bin, which is within a
+# few percent of it.
+
+import os
+import sys
+import time
+import getopt
+import numpy
+
+try:
+    import json
+except ImportError:
+    json = None
+
+from event_log import MmapEventLog
+
+# intervals between messages, in microseconds, are histogrammed in bins of
+# a twentieth of a decade from 1 us to 1e11 us, with the intervals under
+# 1 us in bin 0
+INTERVAL_BINS_PER_DECADE = 20
+INTERVAL_DECADES = 11
+# payload size bin k holds the sizes with k significant bits
+SIZE_BINS = 33
+
+def interval_bins(intervals):
+    bins = numpy.floor(numpy.log10(numpy.maximum(intervals, 1)) * INTERVAL_BINS_PER_DECADE)
+    bins = numpy.where(intervals < 1, 0, bins.astype(numpy.intp) + 1)
+    return numpy.minimum(bins, INTERVAL_DECADES * INTERVAL_BINS_PER_DECADE)
+
+def size_bin_range(k):
+    """Smallest and largest payload size in size bin k."""
+    if k == 0:
+        return 0, 0
+    return 1 << (k - 1), (1 << k) - 1
+
+class ChannelSummary(object):
+    """Statistics of the messages of one channel, added a block at a time."""
+
+    def __init__(self, channel, fingerprint, maxGaps=5):
+        self.channel = channel
+        self.fingerprint = fingerprint
+        self.maxGaps = maxGaps
+        self.count = 0
+        self.payloadBytes = 0
+        self.minSize = None
+        self.maxSize = None
+        self.firstTime = None
+        self.lastTime = None
+        # mean and sum of squared deviations of the intervals
+        self.intervalMean = 0.0
+        self.intervalM2 = 0.0
+        self.intervalHist = numpy.zeros(INTERVAL_DECADES * INTERVAL_BINS_PER_DECADE + 1,
+                dtype=numpy.int64)
+        self.intervalSums = numpy.zeros(len(self.intervalHist))
+        self.sizeHist = numpy.zeros(SIZE_BINS, dtype=numpy.int64)
+        # (interval, timestamp of the message before it), longest first
+        self.gaps = []
+
+    def add(self, timestamps, sizes):
+        """Add the messages of the channel in a block of events, given their
+        timestamps and payload sizes in log order."""
+        if not len(timestamps):
+            return
+        if self.count:
+            times = numpy.concatenate(([ self.lastTime ], timestamps))
+        else:
+            self.firstTime = int(timestamps[0])
+            times = timestamps
+        self.lastTime = int(timestamps[-1])
+        self._add_intervals(numpy.diff(times), times[:-1])
+
+        self.count += len(timestamps)
+        self.payloadBytes += int(sizes.sum())
+        lo, hi = int(sizes.min()), int(sizes.max())
+        if self.minSize is None or lo < self.minSize:
+            self.minSize = lo
+        if self.maxSize is None or hi > self.maxSize:
+            self.maxSize = hi
+        self.sizeHist += numpy.bincount(numpy.frexp(sizes)[1], minlength=SIZE_BINS)
+
+    def _add_intervals(self, intervals, starts):
+        n = len(intervals)
+        if not n:
+            return
+        m = self.count - 1
+        if m < 0:
+            m = 0
+        intervals = intervals.astype(numpy.float64)
+        mean = intervals.mean()
+        m2 = ((intervals - mean) ** 2).sum()
+        # combine with the earlier intervals (Chan et al.)
+        delta = mean - self.intervalMean
+        total = m + n
+        self.intervalMean += delta * n / total
+        self.intervalM2 += m2 + delta * delta * m * n / total
+        bins = interval_bins(intervals)
+        self.intervalHist += numpy.bincount(bins, minlength=len(self.intervalHist))
+        self.intervalSums += numpy.bincount(bins, intervals, minlength=len(self.intervalHist))
+
+        if self.maxGaps:
+            k = min(self.maxGaps, n)
+            longest = numpy.argpartition(-intervals, k - 1)[:k]
+            self.gaps.extend([ (int(intervals[i]), int(starts[i])) for i in longest ])
+            self.gaps.sort(key=lambda gap: (-gap[0], gap[1]))
+            del self.gaps[self.maxGaps:]
+
+    def intervals(self):
+        return max(self.count - 1, 0)
+
+    def mean_rate(self):
+        """Messages per second over the time the channel was recorded."""
+        if self.count < 2 or self.lastTime == self.firstTime:
+            return 0.0
+        return (self.count - 1) * 1e6 / (self.lastTime - self.firstTime)
+
+    def interval_percentile(self, p):
+        """Estimate of the pth percentile of the intervals, in microseconds,
+        or None if there are none."""
+        n = self.intervals()
+        if not n:
+            return None
+        k = int(numpy.searchsorted(numpy.cumsum(self.intervalHist), p / 100.0 * n))
+        k = min(k, len(self.intervalHist) - 1)
+        return self.intervalSums[k] / self.intervalHist[k]
+
+    def rate_percentile(self, p):
+        """Estimate of the pth percentile of the rates between consecutive
+        messages, 1 / interval, or None if there are none."""
+        interval = self.interval_percentile(100.0 - p)
+        if interval is None:
+            return None
+        if interval == 0:
+            return float("inf")
+        return 1e6 / interval
+
+    def jitter(self):
+        """Standard deviation of the intervals, in microseconds."""
+        n = self.intervals()
+        if not n:
+            return 0.0
+        return (self.intervalM2 / n) ** 0.5
+
+    def to_dict(self, startTime=0, typename=None):
+        return {
+            "channel" : self.channel,
+            "typename" : typename,
+            "fingerprint" : self.fingerprint.encode("hex"),
+            "count" : self.count,
+            "payload_bytes" : self.payloadBytes,
+            "min_size" : self.minSize,
+            "max_size" : self.maxSize,
+            "first_time" : (self.firstTime - startTime) / 1e6,
+            "last_time" : (self.lastTime - startTime) / 1e6,
+            "mean_rate" : self.mean_rate(),
+            "rate_percentiles" : dict([ ("p%d" % p, self.rate_percentile(p))
+                    for p in (5, 50, 95) ]),
+            "mean_interval" : self.intervalMean / 1e6,
+            "jitter" : self.jitter() / 1e6,
+            "gaps" : [ { "time" : (start - startTime) / 1e6, "length" : interval / 1e6 }
+                    for interval, start in self.gaps ],
+            "size_histogram" : [ { "min" : size_bin_range(k)[0], "max" : size_bin_range(k)[1],
+                    "count" : int(c) } for k, c in enumerate(self.sizeHist) if c ],
+        }
+
+class LogSummary(object):
+    """Summary of all the channels of a log, see above."""
+
+    def __init__(self, fname, maxGaps=5):
+        self.fname = fname
+        self.maxGaps = maxGaps
+        self.channels = {}
+        self.count = 0
+        self.scannedBytes = 0
+        self.startTime = None
+        self.endTime = None
+        self.wallTime = 0.0
+
+    def scan(self, blockSize=1 << 16):
+        """Read the headers of all the events of the log."""
+        t0 = time.time()
+        log = MmapEventLog(self.fname)
+        try:
+            names = []
+            ids = {}
+            channelIds = []
+            timestamps = []
+            sizes = []
+            for offset, timestamp, channel, datalen in log.headers():
+                k = ids.get(channel, None)
+                if k is None:
+                    k = ids[channel] = len(names)
+                    names.append(channel)
+                    if channel not in self.channels:
+                        self.channels[channel] = ChannelSummary(channel,
+                                log.fingerprint_at(offset), self.maxGaps)
+                channelIds.append(k)
+                timestamps.append(timestamp)
+                sizes.append(datalen)
+                if len(channelIds) == blockSize:
+                    self._add_block(names, channelIds, timestamps, sizes)
+                    channelIds, timestamps, sizes = [], [], []
+            self._add_block(names, channelIds, timestamps, sizes)
+            self.scannedBytes = log.tell()
+        finally:
+            log.close()
+        self.wallTime = time.time() - t0
+
+    def _add_block(self, names, channelIds, timestamps, sizes):
+        if not channelIds:
+            return
+        channelIds = numpy.array(channelIds, dtype=numpy.intp)
+        timestamps = numpy.array(timestamps, dtype=numpy.int64)
+        sizes = numpy.array(sizes, dtype=numpy.int64)
+        if self.startTime is None:
+            self.startTime = int(timestamps[0])
+        self.endTime = int(timestamps[-1])
+        self.count += len(channelIds)
+        # the events of each channel, still in log order
+        order = numpy.argsort(channelIds, kind="mergesort")
+        counts = numpy.bincount(channelIds, minlength=len(names))
+        bounds = numpy.concatenate(([ 0 ], numpy.cumsum(counts)))
+        for k, name in enumerate(names):
+            if counts[k]:
+                sel = order[bounds[k]:bounds[k + 1]]
+                self.channels[name].add(timestamps[sel], sizes[sel])
+
+    def duration(self):
+        if self.startTime is None:
+            return 0.0
+        return (self.endTime - self.startTime) / 1e6
+
+    def sorted_channels(self):
+        return sorted(self.channels.values(), key=lambda c: c.channel)
+
+    def report(self, out=sys.stdout, type_db=None):
+        out.write("%s: %d events on %d channels, %.1f MB, %.2f s of log\n" % (self.fname,
+                self.count, len(self.channels), self.scannedBytes / 1e6, self.duration()))
+        header = "%-24s %-28s %9s %9s %9s %9s %9s %10s %10s %10s" % ("channel", "type",
+                "messages", "mean Hz", "p5 Hz", "p50 Hz", "p95 Hz", "jitter ms", "max gap s",
+                "payload MB")
+        out.write(header + "\n")
+        out.write("-" * len(header) + "\n")
+        for chan in self.sorted_channels():
+            maxGap = chan.gaps and chan.gaps[0][0] / 1e6 or 0.0
+            out.write("%-24s %-28s %9d %9.2f %9s %9s %9s %10.3f %10.3f %10.2f\n" % (
+                    chan.channel, _typename(type_db, chan.fingerprint), chan.count,
+                    chan.mean_rate(), _format_rate(chan.rate_percentile(5)),
+                    _format_rate(chan.rate_percentile(50)), _format_rate(chan.rate_percentile(95)),
+                    chan.jitter() / 1e3, maxGap, chan.payloadBytes / 1e6))
+
+        for chan in self.sorted_channels():
+            out.write("\n%s\n" % chan.channel)
+            if chan.gaps:
+                out.write("  largest gaps:  %s\n" % ", ".join([ "%.3f s at %.3f s" %
+                        (interval / 1e6, (start - self.startTime) / 1e6)
+                        for interval, start in chan.gaps ]))
+            out.write("  payload sizes: %d to %d bytes, %.0f on average\n" % (chan.minSize,
+                    chan.maxSize, float(chan.payloadBytes) / chan.count))
+            for k, c in enumerate(chan.sizeHist):
+                if c:
+                    lo, hi = size_bin_range(k)
+                    out.write("    %10d - %-10d %9d %s\n" % (lo, hi, c,
+                            "#" * int(numpy.ceil(40.0 * c / chan.sizeHist.max()))))
+        if self.wallTime > 0:
+            out.write("\nread in %.2f s, %.0f events/s, %.1f MB/s\n" % (self.wallTime,
+                    self.count / self.wallTime, self.scannedBytes / self.wallTime / 1e6))
+
+    def to_dict(self, type_db=None):
+        return {
+            "log" : self.fname,
+            "events" : self.count,
+            "bytes" : self.scannedBytes,
+            "duration" : self.duration(),
+            "wall_time" : self.wallTime,
+            "channels" : [ c.to_dict(self.startTime, _typename(type_db, c.fingerprint) or None)
+                    for c in self.sorted_channels() ],
+        }
+
+def _typename(type_db, fingerprint):
+    if type_db is None or fingerprint not in type_db:
+        return ""
+    return type_db.module_name(fingerprint)
+
+def _format_rate(rate):
+    if rate is None:
+        return "-"
+    return "%.2f" % rate
+
+def summarize_log(fname, maxGaps=5):
+    """Return the LogSummary of a log."""
+    summary = LogSummary(fname, maxGaps)
+    summary.scan()
+    return summary
+
+def usage():
+    pname, sname = os.path.split(sys.argv[0])
+    sys.stderr.write("usage: %s [options] <logfile>\n" % sname)
+    print """
+    Print the channels of an LCM log with their message counts, rates, jitter,
+    largest gaps and payload sizes, reading only the event headers.
+
+    -h --help                 print this message
+    -l --lcmtype_pkgs=pkgs    name the types from the LCM types in the comma seperated list of
+                              packages [pkgs] defaults to all packages on the python path
+                              or directories of .lcm files
+    -n --no-types             do not look for LCM types to name the types of the channels
+    -g --gaps=N               report the [N] largest gaps of every channel defaults to [5]
+       --json=file            also write the summary to [file] as JSON
+    """
+    sys.exit()
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hl:ng:",
+                [ "help", "lcmtype_pkgs=", "no-types", "gaps=", "json=" ])
+    except getopt.GetoptError, err:
+        print str(err)
+        usage()
+    if len(args) != 1:
+        usage()
+    lcm_packages = None
+    findTypes = True
+    maxGaps = 5
+    jsonFname = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+        elif o in ("-l", "--lcmtype_pkgs"):
+            lcm_packages = a.split(",")
+        elif o in ("-n", "--no-types"):
+            findTypes = False
+        elif o in ("-g", "--gaps"):
+            maxGaps = int(a)
+        elif o == "--json":
+            jsonFname = a
+
+    summary = summarize_log(args[0], maxGaps)
+    type_db = None
+    if findTypes:
+        from scan_for_lcmtypes import get_lcmtype_dictionary
+        type_db = get_lcmtype_dictionary(lcm_packages)
+    summary.report(sys.stdout, type_db)
+    if jsonFname is not None:
+        if json is None:
+            raise ImportError("writing the summary as JSON needs the json module")
+        f = open(jsonFname, "w")
+        try:
+            json.dump(summary.to_dict(type_db), f, indent=2, sort_keys=True)
+            f.write("\n")
+        finally:
+            f.close()
+
+if __name__ == "__main__":
+    main()
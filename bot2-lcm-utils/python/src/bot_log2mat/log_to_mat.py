@@ -4,6 +4,21 @@
 #tools such as Matlab. The set of messages on a given channel can be represented
 #as a matrix, where the columns of this matrix are the the fields of the lcm type
 #with one message per row
+#
+# The conversion can also be used from python, e.g. to convert many logs in
+# one process:
+#
+#   from bot_log2mat.log_to_mat import convert, iter_channels
+#   data = convert("run1.log", out="run1.mat", channels="POSE|LIDAR")
+#   for channel, rows in iter_channels("run2.log", ignore="CAMERA.*"):
+#       ...
+#
+# A log that is still being recorded can be converted a piece at a time to an
+# HDF5 file with update(), or with follow(), which calls it periodically
+# (bot-log2mat --follow).
+#
+# The LCM type dictionary and the compiled decoders are made once per process
+# and shared by all the conversions.
 
 import os
 import sys
@@ -12,6 +27,9 @@ import types
 import numpy
 import re
 import getopt
+import time
+import json
+import signal
 
 # check which version for mio location
 if sys.version_info < (2, 6):
@@ -19,8 +37,24 @@ if sys.version_info < (2, 6):
 else:
     import scipy.io.matlab.mio
 
-from lcm import EventLog
 from scan_for_lcmtypes import *
+from event_log import MmapEventLog
+from channel_buffer import ChannelBuffer, RaggedBuffer
+from lcmtype_compiler import compile_lcmtype, row_layout
+from extractors import block_decoder, with_log_times
+from flatten import *
+from parallel_convert import convert_parallel
+from hdf5_output import Hdf5Output
+from event_filter import EventFilter, ChannelSelector, parse_channel_setting, channel_settings, \
+        channel_setting
+from conversion_stats import ConversionStats
+from conversion import default_output_name, output_format, select_events, \
+        channel_offsets, first_decoded_timestamp
+from batch_convert import convert_batch, report_batch
+from image_extractor import ImageExtractor, IMAGE_COLUMNS, is_image_type
+from print_output import LinePrinter, ChannelFiles
+from pyramid import pyramid_factory, parse_factors
+from spill_buffer import MemoryBudget, parse_memory_limit, is_spilled_matrix, append_mat_matrix
 
 def usage():
     pname, sname = os.path.split(sys.argv[0])
@@ -34,130 +68,68 @@ def usage():
     -i --ignore=chan          Ignore channelsToProcess that match Python regex [chan]
                               ignores take precedence over includes!
     -o --outfile=ofname       output data to [ofname] instead of default [filename.mat or stdout]
-    -l --lcmtype_pkgs=pkgs    load python modules from comma seperated list of packages [pkgs] defaults to ["botlcm"]
+    -l --lcmtype_pkgs=pkgs    load LCM types from comma seperated list of packages [pkgs] defaults to all packages on the python path
+                              an entry of [pkgs] may be a directory of .lcm files, whose types are
+                              decoded without their lcm-gen python modules
+    -j --jobs=N               decode the log in N worker processes (not used with -p)
+       --batch=dir            convert every log under [dir], including the .00, .01, ... parts of
+                              split logs, in -j processes (defaults to one per CPU), skipping the
+                              logs whose output is newer; -o sets the output directory
+       --follow               convert a log that is still being recorded: append the messages
+                              recorded since the last run to the hdf5 output, then keep
+                              appending new ones every --interval seconds until interrupted
+       --interval=sec         seconds between the updates of --follow defaults to [5],
+                              0 to update once and exit
+       --output-format=fmt    write the output as [fmt], mat, hdf5, csv or npy defaults to [mat], or
+                              [hdf5] if ofname ends with .h5 or .hdf5, [csv] or [npy] if it ends
+                              with .csv or .npy; csv and npy write one file per channel,
+                              [ofname]_[chan].csv (for channels of fixed length messages only),
+                              or the little-endian float64 matrix
+                              [ofname]_[chan].npy (and [ofname]_[chan]_offsets.npy for variable
+                              length messages)
+       --compression=method   compress the hdf5 datasets with [method] (gzip or lzf)
+       --images               write the frames of bot_core.image_t channels to [ofname]_[chan].npy,
+                              or .raw if their size varies, and only their metadata to the output
+       --ragged               store channels with variable length messages as a flat [values]
+                              array and [offsets] of each message instead of zero padding them
+       --start=sec            skip the messages before [sec] seconds from the start of the log
+       --end=sec              skip the messages from [sec] seconds from the start of the log
+       --every=[chan=]N       keep every [N]th message of the channels that match [chan],
+                              or of all channels (can be repeated)
+       --max-rate=[chan=]hz   keep at most [hz] messages per second of the channels that
+                              match [chan], or of all channels (can be repeated)
+       --pyramid=f[,f...]     also save min/max/mean levels of every [f] messages of the channels
+                              with fixed length messages, e.g. 16,256,4096, for plotting them
+                              with bot_log2mat.pyramid.load_level (mat and hdf5 output)
+       --memory-limit=MB      keep at most [MB] megabytes of channels in memory, moving the largest
+                              ones to temporary files once it is exceeded (mat output, the others
+                              are written while the log is read)
+       --spill-dir=dir        make the temporary files of --memory-limit in [dir]
+       --native-types         write every numeric field of a channel in the type it has in the
+                              LCM type, e.g. int64 utime, instead of one float64 matrix: a dataset
+                              per field in the channel's group of hdf5 output, or
+                              [ofname]_[chan].[field].npy (and [ofname]_[chan].[field]_offsets.npy
+                              for variable length fields) and [ofname]_[chan].log_time.npy
+                              (not used with -j)
+       --fields=chan:f[,f...] only convert the fields [f] of the channels that match [chan], e.g.
+                              POSE:utime,pos or CAM.*:utime; pose.pos is the pos field of the
+                              nested field pose (can be repeated)
+       --stats                print the messages, payload bytes, decode and flatten time and
+                              output bytes of every channel
+       --stats-json=file      also write these statistics to [file] as JSON
     -v                        Verbose
 
     """
     sys.exit()
 
-flatteners = {}
-data = {}
-
-def make_simple_accessor(fieldname):
-    return lambda lst, x: lst.append(getattr(x, fieldname))
-
-def make_numpy_array_accessor(fieldname):
-    return lambda lst, x: lst.extend(numpy.array(getattr(x, fieldname)).ravel())
-
-def make_obj_accessor(fieldname, func):
-    return lambda lst, x: func(lst, getattr(x, fieldname))
-
-def make_obj_list_accessor(fieldname, func):
-    return lambda lst, x: map(lambda item: func(lst, item), getattr(x, fieldname))
-#    def list_accessor(lst, msg):
-#        msg_lst = getattr(msg, fieldname)
-#        for elem in msg_lst:
-#            func(lst, elem)
-#    return list_accessor
-#
-
-
-def make_lcmtype_accessor(msg):
-    funcs = []
-
-    for fieldname in getattr(msg, '__slots__'):
-        m = getattr(msg, fieldname)
-
-        if type(m) in [ types.IntType, types.LongType, types.FloatType,
-                types.BooleanType ]:
-            # scalar
-            accessor = make_simple_accessor(fieldname)
-            funcs.append(accessor)
-        elif type(m) in [ types.ListType, types.TupleType ]:
-            # convert to a numpy array
-            arr = numpy.array(m)
-
-            # check the data type of the array
-            if arr.dtype.kind in "bif":
-                # numeric data type
-                funcs.append(make_numpy_array_accessor(fieldname))
-            elif arr.dtype.kind == "O":
-                # compound data type
-                typeAccess = make_lcmtype_accessor(m[0])
-                funcs.append(make_obj_list_accessor(fieldname, typeAccess))
-                #pass
-        elif type(m) in types.StringTypes:
-            # ignore strings
-            pass
-        else:
-            funcs.append(make_obj_accessor(fieldname, make_lcmtype_accessor(m)))
-
-    def flatten(lst, m):
-        for func in funcs:
-            func(lst, m)
-    return flatten
-
-def make_flattener(msg):
-    accessor = make_lcmtype_accessor(msg)
-    def flattener(m):
-        result = []
-        accessor(result, m)
-        return result
-    return flattener
-
-
-
-
-def make_lcmtype_string(msg, base=True):
-    typeStr = []
-    count = 0
-    for fieldname in getattr(msg, '__slots__'):
-        m = getattr(msg, fieldname)
-
-        if type(m) in [ types.IntType, types.LongType, types.FloatType, types.BooleanType ]:
-            count = count + 1
-            if base:
-                typeStr.append("%d- %s" % (count, fieldname))
-            else:
-                typeStr.append(fieldname)
-        elif type(m) in [ types.ListType, types.TupleType ]:
-            # convert to a numpy array
-            arr = numpy.array(m)
-            # check the data type of the array
-            if arr.dtype.kind in "bif":
-                # numeric data type
-
-                if base:
-                    typeStr.append("%d- %s(%d)" % (count + 1, fieldname, len(arr.ravel())))
-                else:
-                    typeStr.append("%s(%d)" % (fieldname, len(arr.ravel())))
-                count = count + len(arr.ravel())
-            elif arr.dtype.kind == "O":
-                # compound data type
-                subStr, subCount = make_lcmtype_string(m[0], False)
-                numSub = len(m)
-                if base:
-                    subStr = "%d- %s<%s>(%d)" % (count + 1, fieldname, ", ".join(subStr), numSub)
-                else:
-                    subStr = "%s<%s>(%d)" % (fieldname, ", ".join(subStr), numSub)
-                typeStr.append(subStr)
-                count = count + numSub * subCount
-                #pass
-        elif type(m) in types.StringTypes:
-            # ignore strings
-            pass
-        else:
-            subStr, subCount = make_lcmtype_string(m, False);
-            if base:
-                for s in subStr:
-                    typeStr.append("%d- %s.%s" % (count+1, fieldname , s))
-                    count = count + subCount
-            else:
-                count = count + subCount
-                for s in subStr:
-                    typeStr.append(fieldname + "." + s)
-
-    return typeStr, count
+# fixed size messages are decoded in blocks of up to blockSize messages
+blockSize = 4096
+# the formats convert() writes
+OUTPUT_FORMATS = ("mat", "hdf5", "csv", "npy")
+# (compiled decoder, block decoder) by packed fingerprint, None for the types
+# that need the generic decoder or are decoded one at a time, shared by all
+# conversions
+compiled_types = {}
 
 def deleteStatusMsg(statMsg):
     if statMsg:
@@ -166,184 +138,334 @@ def deleteStatusMsg(statMsg):
         sys.stderr.write("\r")
     return ""
 
-longOpts = ["help", "print", "format", "separator", "channelsToProcess", "ignore", "outfile", "lcm_packages"]
-
-### Start of processing
-try:
-    opts, args = getopt.gnu_getopt(sys.argv[1:], "hpvfs:c:i:o:l:", longOpts)
-except getopt.GetoptError, err:
-    # print help information and exit:
-    print str(err) # will print something like "option -a not recognized"
-    usage()
-if len(args) != 1:
-    usage()
-#default options
-fname = args[0]
-lcm_packages = [ "botlcm"]
-
-outDir, outFname = os.path.split(os.path.abspath(fname))
-outFname = outFname.replace(".", "_")
-outFname = outFname.replace("-", "_")
-outFname = outDir + "/" + outFname + ".mat"
-printFname = "stdout"
-printFile = sys.stdout
-verbose = False
-printOutput = False
-printFormat = False
-channelsToIgnore = ""
-checkIgnore = False
-channelsToProcess = ".*"
-separator = ' '
-for o, a in opts:
-    if o == "-v":
-        verbose = True
-    elif o in ("-h", "--help"):
-        usage()
-    elif o in ("-p", "--print"):
-        printOutput = True
-    elif o in ("-f", "--format"):
-        printFormat = True
-    elif o in ("-s", "--separator="):
-        separator = a
-    elif o in ("-o", "--outfile="):
-        outFname = a
-        printFname = a
-    elif o in ("-c", "--channelsToProcess="):
-        channelsToProcess = a
-    elif o in ("-i", "--ignore="):
-        channelsToIgnore = a
-        checkIgnore = True
-    elif o in ("-l", "--lcm_packages="):
-        lcm_packages = a.split(",")
-    else:
-        assert False, "unhandled option"
-
-fullPathName = os.path.abspath(outFname)
-dirname = os.path.dirname(fullPathName)
-outBaseName = ".".join(os.path.basename(outFname).split(".")[0:-1])
-fullBaseName = dirname + "/" + outBaseName
-
-type_db = make_lcmtype_dictionary()
-
-channelsToProcess = re.compile(channelsToProcess)
-channelsToIgnore = re.compile(channelsToIgnore)
-log = EventLog(fname, "r")
-
-if printOutput:
-    sys.stderr.write("opened % s, printing output to %s \n" % (fname, printFname))
-    if printFname == "stdout":
-        printFile = sys.stdout
-    else:
-        printFile = open(printFname, "w")
-else:
-    sys.stderr.write("opened % s, outputing to % s\n" % (fname, outFname))
-
-ignored_channels = []
-msgCount = 0
-statusMsg = ""
-startTime = 0
-
-### Start processing the log ###
-for e in log:
-    if msgCount == 0:
-        startTime = e.timestamp
-
-    if e.channel in ignored_channels:
-        continue
-    if ((checkIgnore and channelsToIgnore.match(e.channel) and len(channelsToIgnore.match(e.channel).group())==len(e.channel)) \
-         or (not channelsToProcess.match(e.channel))):
-        if verbose:
-            statusMsg = deleteStatusMsg(statusMsg)
-            sys.stderr.write("ignoring channel %s\n" % e.channel)
-        ignored_channels.append(e.channel)
-        continue
-
-    ## This is an event we actually want to process
-    packed_fingerprint = e.data[:8]
-    lcmtype = type_db.get(packed_fingerprint, None)
-    if not lcmtype:
-        if verbose:
-            statusMsg = deleteStatusMsg(statusMsg)
-            sys.stderr.write("ignoring channel %s -not a known LCM type\n" % e.channel)
-        ignored_channels.append(e.channel)
-        continue
-    try:
-        msg = lcmtype.decode(e.data)
-    except:
-        statusMsg = deleteStatusMsg(statusMsg)
-        sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
-        continue
-
-    ## We were successfully able to decode the message
-    msgCount = msgCount + 1
-    if (msgCount % 5000) == 0:
-        statusMsg = deleteStatusMsg(statusMsg)
-        statusMsg = "read % d messages, % d %% done" % (msgCount, log.tell() / float(log.size())*100)
-        sys.stderr.write(statusMsg)
-        sys.stderr.flush()
-
-    ## Figure out how to parse this message
-    if e.channel in flatteners:
-        flattener = flatteners[e.channel]
-    else:
-        flattener = make_flattener(msg)
-        flatteners[e.channel] = flattener
-        data[e.channel] = []
-        if printFormat:
-            statusMsg = deleteStatusMsg(statusMsg)
-            typeStr, fieldCount = make_lcmtype_string(msg)
-            typeStr.append("%d- log_timestamp" % (fieldCount + 1))
-
-            typeStr = "\n#%s  %s :\n#[\n#%s\n#]\n" % (e.channel, lcmtype, "\n#".join(typeStr))
-            sys.stderr.write(typeStr)
-
-
-    ## Parse the message
-    a = flattener(msg)
-    #in case the initial flattener didn't work for whatever reason :-/
-    # convert to a numpy array
-    arr = numpy.array(a)
-    # check the data type of the array
-    if not(arr.dtype.kind in "bif"):
-        statusMsg = deleteStatusMsg(statusMsg)
-        sys.stderr.write("WARNING: needed to create new flattener for channel %s\n" % (e.channel))
-        flattener = make_flattener(msg)
-        flatteners[e.channel] = flattener
-        a = flattener(msg)
-
-    ## Compute the log time
-    a.append((e.timestamp - startTime) / 1e6)
-    ## Place the new data in a structure
-    if printOutput:
-        printFile.write("%s%s%s\n" % (e.channel, separator, separator.join([str(k) for k in a])))
-    else:
-        data[e.channel].append(a)
-
-
-
-
-deleteStatusMsg(statusMsg)
-if not printOutput:
-    #need to pad variable length messages with zeros...
-    for chan in data:
-        lengths = map(len, data[chan])
-        maxLen = max(lengths)
-        minLen = min(lengths)
-        if maxLen != minLen:
-            sys.stderr.write("padding channel %s with zeros, messages ranged from %d to %d \n" % (chan, minLen, maxLen))
-            count = 0
-            for i in data[chan]:
-                pad = numpy.zeros(maxLen - lengths[count])
-                i.extend(pad)
-                count = count + 1
-
-
-    sys.stderr.write("loaded all %d messages, saving to % s\n" % (msgCount, outFname))
+class MatrixConverter(object):
+    """Flattens the messages of a log into one matrix per channel.
+
+    The events are passed in log order to add_events(), in one or more
+    calls, and finish() decodes the messages still waiting in blocks.  The
+    rows of each channel go to self.data, a buffer per channel made by
+    newBuffer(channel, columns, typename, layout), layout being the
+    RowLayout of the rows, or with printFile are written to it as lines of
+    text instead, blockSize messages at a time.  With images, an ImageExtractor, the frames of
+    image_t messages are written by it and their rows are its metadata.
+    fields is a list of settings from parse_fields_setting(): the channels
+    they match only get the columns of those fields, and the other fields of
+    their messages are skipped over rather than decoded.  With nativeTypes
+    the buffers of the channels whose layout is known are typed ones, like
+    a FieldBuffer: they get the decoded records of blocks of messages with
+    extend_records(), and the rows of the others as python numbers, rather
+    than float64 rows.
+
+    Log times are relative to startTime, by default the timestamp of the
+    first message that decodes.
+    """
 
+    def __init__(self, type_db, selector, eventFilter=None, newBuffer=None,
+            printFile=None, separator=" ", printFormat=False, stats=None,
+            verbose=False, progress=False, startTime=None, images=None, fields=None,
+            nativeTypes=False):
+        self.type_db = type_db
+        self.selector = selector
+        self.eventFilter = None
+        if eventFilter is not None and eventFilter.is_active():
+            self.eventFilter = eventFilter
+        self.printer = None
+        if printFile is not None:
+            self.printer = LinePrinter(printFile, separator)
+            newBuffer = self.printer.buffer
+        elif newBuffer is None:
+            newBuffer = buffer_factory()
+        self.newBuffer = newBuffer
+        self.printFormat = printFormat
+        self.stats = stats
+        self.verbose = verbose
+        self.progress = progress
+        self.images = images
+        self.fields = fields or []
+        self.nativeTypes = nativeTypes
+        # the channels whose buffers take the records of blocks
+        self.typedChannels = set()
+        # the projection of each channel, None for all of its fields
+        self.channelFields = {}
+        self.flatteners = {}
+        self.data = {}
+        # the column names of each channel, without the log time
+        self.columns = {}
+        # fixed size messages waiting to be decoded as one block, keyed by channel
+        self.pending = {}
+        self.ignored_channels = set()
+        self.msgCount = 0
+        self.startTime = 0
+        self._fixedStart = startTime is not None
+        if self._fixedStart:
+            self.startTime = startTime
+        self.statusMsg = ""
+
+    def _flush_pending(self, channel):
+        decoder, payloads, logTimes = self.pending.pop(channel)
+        stats = self.stats
+        if stats is not None:
+            t0 = time.time()
+        records = decoder.decode_block(payloads)
+        if stats is not None:
+            t1 = time.time()
+        if channel in self.typedChannels:
+            self.data[channel].extend_records(decoder.typed_block(records), logTimes)
+        else:
+            rows = decoder.flatten_block(records)
+            self.data[channel].extend(*with_log_times(rows, decoder.row_widths(records), logTimes))
+        if stats is not None:
+            chanStats = stats.channel(channel)
+            chanStats.decodeTime += t1 - t0
+            chanStats.flattenTime += time.time() - t1
+
+    def _channel_fields(self, channel):
+        if channel not in self.channelFields:
+            self.channelFields[channel] = channel_setting(self.fields, channel)
+        return self.channelFields[channel]
+
+    def _add_image(self, e, lcmtype):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.time()
+        try:
+            row = self.images.add(e.channel, e.data)
+        except:
+            self.statusMsg = deleteStatusMsg(self.statusMsg)
+            sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
+            return
+        self.msgCount += 1
+        if e.channel not in self.data:
+            self.columns[e.channel] = IMAGE_COLUMNS
+            self.data[e.channel] = self.newBuffer(e.channel, IMAGE_COLUMNS, lcmtype.__name__)
+        row.append((e.timestamp - self.startTime) / 1e6)
+        self.data[e.channel].append(row)
+        if stats is not None:
+            chanStats = stats.channel(e.channel, lcmtype.__name__)
+            chanStats.count += 1
+            chanStats.payloadBytes += len(e.data)
+            chanStats.decodeTime += time.time() - t0
+
+    def add_events(self, events, log=None):
+        """Convert events, e.g. from an MmapEventLog.  log is only used to
+        report the progress."""
+        type_db = self.type_db
+        flatteners = self.flatteners
+        data = self.data
+        pending = self.pending
+        ignored_channels = self.ignored_channels
+        eventFilter = self.eventFilter
+        stats = self.stats
+        verbose = self.verbose
+        printer = self.printer
+        for e in events:
+            if printer is not None and printer.pending() >= blockSize:
+                self._print_lines()
+            if self.msgCount == 0 and not self._fixedStart:
+                self.startTime = e.timestamp
+
+            if e.channel in ignored_channels:
+                continue
+            if self.selector.is_ignored(e.channel):
+                if verbose:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    sys.stderr.write("ignoring channel %s\n" % e.channel)
+                ignored_channels.add(e.channel)
+                continue
+            if eventFilter is not None and not eventFilter.keep(e.channel, e.timestamp):
+                continue
+
+            ## This is an event we actually want to process
+            packed_fingerprint = e.data[:8]
+            lcmtype = type_db.get(packed_fingerprint, None)
+            if not lcmtype:
+                if verbose:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    sys.stderr.write("ignoring channel %s -not a known LCM type\n" % e.channel)
+                ignored_channels.add(e.channel)
+                continue
+            if self.images is not None and is_image_type(lcmtype):
+                ## The pixels are written as they are, without decoding
+                self._add_image(e, lcmtype)
+                continue
+            fields = None
+            if self.fields:
+                fields = self._channel_fields(e.channel)
+            compiledKey = packed_fingerprint
+            if fields is not None:
+                compiledKey = (packed_fingerprint, fields)
+            if self.nativeTypes:
+                compiledKey = (compiledKey, "typed")
+            if compiledKey in compiled_types:
+                compiled, decoder = compiled_types[compiledKey]
+            else:
+                compiled = compile_lcmtype(lcmtype, fields)
+                decoder = block_decoder(lcmtype, compiled, fields, self.nativeTypes)
+                compiled_types[compiledKey] = (compiled, decoder)
+                if verbose and compiled is None and decoder is None:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    sys.stderr.write("using the generic decoder for %s\n" % lcmtype)
+            # fixed size messages, and the ones of extractors, are decoded in blocks
+            inBlock = decoder is not None
+            if stats is not None:
+                t0 = time.time()
+            flattenTime = 0.0
+            try:
+                if compiled is None or e.channel not in flatteners:
+                    msg = lcmtype.decode(e.data)
+                if inBlock:
+                    decoder.check(e.data)
+                elif compiled is not None:
+                    # decodes and flattens in one pass, counted as flattening
+                    if stats is not None:
+                        t1 = time.time()
+                    a = compiled.flatten(e.data)
+                    if stats is not None:
+                        flattenTime = time.time() - t1
+            except:
+                self.statusMsg = deleteStatusMsg(self.statusMsg)
+                sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
+                continue
+
+            ## We were successfully able to decode the message
+            self.msgCount += 1
+            if printer is not None:
+                printer.add(e.channel)
+            if stats is not None:
+                chanStats = stats.channel(e.channel, lcmtype.__name__)
+                chanStats.count += 1
+                chanStats.payloadBytes += len(e.data)
+                chanStats.decodeTime += time.time() - t0 - flattenTime
+                chanStats.flattenTime += flattenTime
+            if self.progress and log is not None and (self.msgCount % 5000) == 0:
+                self.statusMsg = deleteStatusMsg(self.statusMsg)
+                self.statusMsg = "read % d messages, % d %% done" % (self.msgCount, log.tell() / float(log.size())*100)
+                sys.stderr.write(self.statusMsg)
+                sys.stderr.flush()
+
+            ## Figure out how to parse this message
+            if e.channel in flatteners:
+                flattener = flatteners[e.channel]
+            else:
+                if fields is not None:
+                    check_fields(msg, fields)
+                flattener = make_flattener(msg, fields)
+                flatteners[e.channel] = flattener
+                self.columns[e.channel] = make_column_names(msg, fields=fields)
+                layout = row_layout(lcmtype, fields)
+                data[e.channel] = self.newBuffer(e.channel, self.columns[e.channel],
+                        lcmtype.__name__, layout)
+                if self.nativeTypes and layout is not None:
+                    self.typedChannels.add(e.channel)
+                if self.printFormat:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    typeStr, fieldCount = make_lcmtype_string(msg, fields=fields)
+                    typeStr.append("%d- log_timestamp" % (fieldCount + 1))
+
+                    typeStr = "\n#%s  %s :\n#[\n#%s\n#]\n" % (e.channel, lcmtype, "\n#".join(typeStr))
+                    sys.stderr.write(typeStr)
+
+            ## Compute the log time
+            logTime = (e.timestamp - self.startTime) / 1e6
+
+            ## Keep the channel's messages in log order if its type changes
+            if e.channel in pending and (not inBlock or pending[e.channel][0] is not decoder):
+                self._flush_pending(e.channel)
+            if inBlock:
+                if e.channel not in pending:
+                    pending[e.channel] = (decoder, [], [])
+                pending[e.channel][1].append(e.data)
+                pending[e.channel][2].append(logTime)
+                if len(pending[e.channel][1]) >= blockSize:
+                    self._flush_pending(e.channel)
+                continue
+
+            ## Parse the message
+            if stats is not None:
+                t0 = time.time()
+            if compiled is None:
+                a = flattener(msg)
+                #in case the initial flattener didn't work for whatever reason :-/
+                # convert to a numpy array
+                arr = numpy.array(a)
+                # check the data type of the array
+                if not(arr.dtype.kind in "bif"):
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    sys.stderr.write("WARNING: needed to create new flattener for channel %s\n" % (e.channel))
+                    flattener = make_flattener(msg, fields)
+                    flatteners[e.channel] = flattener
+                    a = flattener(msg)
+
+            a.append(logTime)
+            ## Place the new data in a structure
+            data[e.channel].append(a)
+            if stats is not None:
+                chanStats.flattenTime += time.time() - t0
+
+    def _print_lines(self):
+        # the rows of all the messages so far are needed to print them in order
+        for chan in self.pending.keys():
+            self._flush_pending(chan)
+        self.printer.write()
+
+    def finish(self):
+        """Decode the messages still waiting in blocks."""
+        for chan in self.pending.keys():
+            self._flush_pending(chan)
+        if self.printer is not None:
+            self.printer.write()
+        self.statusMsg = deleteStatusMsg(self.statusMsg)
+
+def buffer_factory(h5out=None, ragged=False, budget=None, nativeTypes=False):
+    """Return a function newBuffer(channel, columns, typename, layout=None)
+    that makes the buffer of a channel: in memory, or datasets of h5out, an
+    Hdf5Output; with ragged, one that keeps variable length messages
+    unpadded.  The matrices in memory are spilled to disk by budget, a
+    MemoryBudget, if given.  With nativeTypes the channels whose layout, a
+    RowLayout, is known get a dataset per field of h5out in its own type."""
+    def newBuffer(channel, columns, typename, layout=None):
+        if h5out is not None:
+            if nativeTypes and layout is not None:
+                return h5out.typed(channel, layout, columns, typename)
+            if ragged:
+                return h5out.ragged(channel, columns, typename)
+            return h5out.matrix(channel, columns, typename)
+        if ragged:
+            return RaggedBuffer()
+        if budget is not None:
+            return budget.buffer(channel, columns, typename)
+        return ChannelBuffer()
+    return newBuffer
+
+def buffer_output(channel, buf, ragged=False):
+    """Return the matrix of a channel's buffer, or with ragged its
+    {"values", "offsets"} if the messages have variable length."""
+    if ragged and buf.max_width != buf.min_width:
+        values, offsets = buf.arrays()
+        return { "values" : values, "offsets" : offsets }
+    #variable length messages were zero padded as they were buffered
+    if buf.max_width != buf.min_width:
+        sys.stderr.write("padding channel %s with zeros, messages ranged from %d to %d \n" % (channel, buf.min_width, buf.max_width))
+    return buf.array()
+
+def save_mat(outFname, data, imageFiles=None):
+    """Save the matrices of convert() to a .mat file, with a .m file next to
+    it that loads it, and that returns the frame files of imageFiles, a dict
+    mapping channels to the files written by an ImageExtractor, in its
+    imFnames struct.  The matrices of spilled buffers are copied to the file
+    a chunk at a time."""
+    spilled = dict([ (name, value) for name, value in data.items() if is_spilled_matrix(value) ])
+    data = dict([ (name, value) for name, value in data.items() if name not in spilled ])
     if sys.version_info < (2, 6):
         scipy.io.mio.savemat(outFname, data)
     else:
         scipy.io.matlab.mio.savemat(outFname, data, oned_as='row')
+    for name in sorted(spilled.keys()):
+        append_mat_matrix(outFname, name, spilled[name])
+
+    fullPathName = os.path.abspath(outFname)
+    dirname = os.path.dirname(fullPathName)
+    outBaseName = ".".join(os.path.basename(outFname).split(".")[0:-1])
 
     ## Write the actual file
     mfile = open(dirname + "/" + outBaseName + ".m", "w")
@@ -358,8 +480,538 @@ else
 end
 d = load(filename);
 """ % (outBaseName, outFname, fullPathName)
-
+    if imageFiles is not None:
+        loadFunc += "imFnames = struct();\n"
+        for chan in sorted(imageFiles.keys()):
+            loadFunc += "imFnames.%s = fullfile(fileparts(filename), '%s');\n" % \
+                    (chan, os.path.basename(imageFiles[chan]))
 
 
     mfile.write(loadFunc);
     mfile.close()
+
+def convert(fname, out=None, channels=".*", ignore=None, lcm_packages=None,
+        jobs=1, outFormat=None, compression=None, start=None, end=None,
+        every=None, maxRate=None, ragged=False, printFormat=False, stats=None,
+        verbose=False, progress=False, type_db=None, images=False, fields=None,
+        pyramid=None, memoryLimit=None, spillDir=None, nativeTypes=False):
+    """Convert a log to one matrix per channel and save them to out.
+
+    channels and ignore are the regexes of a ChannelSelector.  start and end
+    are in seconds from the start of the log, every and maxRate a number for
+    all channels or a list of settings from parse_channel_setting().  fields
+    is a list of settings from parse_fields_setting(), which restrict the
+    channels they match to the columns of some of their fields.
+    outFormat is one of OUTPUT_FORMATS, by default hdf5 if out ends with .h5
+    or .hdf5, csv or npy if it ends with .csv or .npy, else mat.  csv and npy
+    write a file per channel named after out, see print_output.
+    stats, a ConversionStats, is filled in if given, and progress writes the
+    progress of the conversion to stderr.  type_db, a dictionary from
+    make_lcmtype_dictionary(), is used instead of the one for lcm_packages.
+    With images the frames of bot_core.image_t channels are written next to
+    out by an ImageExtractor, and their matrices only hold the metadata of
+    the frames.  pyramid, a list of decimation factors, also saves min/max/mean
+    levels of every channel with fixed length messages, see pyramid.py.
+    memoryLimit, in bytes, is the most memory the channels of mat output take
+    before the largest are moved to temporary files in spillDir, see
+    spill_buffer.py.  With nativeTypes, hdf5 and npy output write every
+    numeric field of a channel as a dataset or file of its own, of the type
+    it has in the LCM type, instead of the float64 matrix of the channel.
+    The fields are taken from the decoded messages, so they need a single
+    job: the workers of jobs only hand back float64 rows.
+
+    Returns a dict mapping each channel to its matrix, or with ragged to
+    {"values", "offsets"} for channels with variable length messages, and
+    with pyramid <channel>_pyramid to the levels of the channel.  The
+    matrices of the channels moved to temporary files are numpy memmaps.
+    Nothing is saved if out is None.  HDF5, csv and npy output is written
+    while the log is read, and returns None.
+    """
+    outFormat = output_format(out, outFormat, OUTPUT_FORMATS)
+    if outFormat != "mat" and out is None:
+        raise ValueError("%s output needs an output file" % outFormat.upper())
+    if images and (out is None or jobs > 1):
+        raise ValueError("extracting images needs an output file and a single job")
+    if pyramid and outFormat not in ("mat", "hdf5"):
+        raise ValueError("pyramids are written to mat or hdf5 output")
+    if nativeTypes and (outFormat not in ("hdf5", "npy") or ragged or pyramid or jobs > 1):
+        raise ValueError("native types are written to hdf5 or npy output by a single job, "
+                "without ragged or pyramids")
+    if type_db is None:
+        type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
+    try:
+        ## Messages are selected by time and rate from their header, before decoding
+        eventFilter = EventFilter(log.first_timestamp(), start, end,
+                channel_settings(every), channel_settings(maxRate))
+
+        ## With a sidecar index only the events of the selected channels are read
+        events, offsets, ignored = select_events(log, type_db, selector, eventFilter, verbose)
+
+        ## HDF5 output is written while the log is read
+        h5out = None
+        channelFiles = None
+        budget = None
+        if outFormat == "hdf5":
+            h5out = Hdf5Output(out, blockSize, compression)
+            newBuffer = buffer_factory(h5out, ragged, nativeTypes=nativeTypes)
+        elif outFormat in ("csv", "npy"):
+            channelFiles = ChannelFiles(os.path.splitext(out)[0], outFormat, blockSize,
+                    nativeTypes)
+            newBuffer = channelFiles.buffer
+        else:
+            if memoryLimit is not None:
+                budget = MemoryBudget(memoryLimit, spillDir)
+            newBuffer = buffer_factory(None, ragged, budget)
+        if pyramid:
+            newBuffer = pyramid_factory(newBuffer, pyramid, h5out, blockSize)
+        extractor = None
+        if images:
+            extractor = ImageExtractor(os.path.splitext(out)[0])
+
+        if jobs > 1:
+            if progress:
+                sys.stderr.write("opened % s, outputing to % s using %d processes\n" % (fname, out, jobs))
+            if eventFilter.is_active():
+                offsets = eventFilter.select(log, selector.is_ignored, offsets)
+            data, msgCount = convert_parallel(fname, jobs, type_db, selector,
+                    printFormat, verbose, offsets, newBuffer, stats, fields)
+        else:
+            if progress:
+                sys.stderr.write("opened % s, outputing to % s\n" % (fname, out))
+            converter = MatrixConverter(type_db, selector, eventFilter, newBuffer,
+                    printFormat=printFormat, stats=stats, verbose=verbose,
+                    progress=progress, images=extractor, fields=fields,
+                    nativeTypes=nativeTypes)
+            converter.ignored_channels.update(ignored)
+            converter.add_events(events, log)
+            converter.finish()
+            data = converter.data
+            msgCount = converter.msgCount
+    finally:
+        log.close()
+    imageFiles = None
+    if extractor is not None:
+        imageFiles = extractor.close()
+
+    result = {}
+    for chan in data.keys():
+        if pyramid:
+            levels = data[chan].finish()
+            if levels is not None:
+                result[chan + "_pyramid"] = levels
+        if h5out is None and channelFiles is None:
+            result[chan] = buffer_output(chan, data[chan], ragged)
+        elif h5out is not None and not ragged and data[chan].max_width != data[chan].min_width:
+            buf = data[chan]
+            sys.stderr.write("padding channel %s with zeros, messages ranged from %d to %d \n" % (chan, buf.min_width, buf.max_width))
+
+    if stats is not None:
+        saveStart = time.time()
+    if h5out is not None:
+        if imageFiles is not None:
+            for chan, name in imageFiles.items():
+                h5out.channels[chan].group.attrs["frames"] = os.path.basename(name)
+        h5out.close()
+        result = None
+        if progress:
+            sys.stderr.write("wrote all %d messages to % s\n" % (msgCount, out))
+    elif channelFiles is not None:
+        files = channelFiles.close()
+        result = None
+        if progress:
+            sys.stderr.write("wrote all %d messages to %d %s files\n" % (msgCount,
+                    sum([ len(names) for names in files.values() ]), outFormat))
+    elif out is not None:
+        if progress:
+            sys.stderr.write("loaded all %d messages, saving to % s\n" % (msgCount, out))
+        save_mat(out, result, imageFiles)
+    if budget is not None:
+        if progress and budget.spilledBytes:
+            sys.stderr.write("moved %.1f MB of channels to temporary files\n" %
+                    (budget.spilledBytes / float(1 << 20)))
+        budget.cleanup()
+
+    if stats is not None:
+        stats.saveTime = time.time() - saveStart
+        for chan, buf in data.items():
+            stats.channel(chan).outputBytes = buf.nbytes
+        stats.finish()
+    return result
+
+def print_log(fname, printFile=None, channels=".*", ignore=None, lcm_packages=None,
+        separator=" ", start=None, end=None, every=None, maxRate=None,
+        printFormat=False, stats=None, verbose=False, fields=None):
+    """Write one line per message of a log to printFile (stdout by default):
+    the channel, the flattened message and its log time, separated by
+    separator.  The other arguments are the ones of convert()."""
+    if printFile is None:
+        printFile = sys.stdout
+    type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
+    try:
+        eventFilter = EventFilter(log.first_timestamp(), start, end,
+                channel_settings(every), channel_settings(maxRate))
+        events, offsets, ignored = select_events(log, type_db, selector, eventFilter, verbose)
+        converter = MatrixConverter(type_db, selector, eventFilter, printFile=printFile,
+                separator=separator, printFormat=printFormat, stats=stats,
+                verbose=verbose, fields=fields)
+        converter.ignored_channels.update(ignored)
+        converter.add_events(events, log)
+        converter.finish()
+    finally:
+        log.close()
+    if stats is not None:
+        stats.finish()
+    return converter.msgCount
+
+def iter_channels(fname, channels=".*", ignore=None, lcm_packages=None, start=None,
+        end=None, every=None, maxRate=None, ragged=False, verbose=False, fields=None,
+        columns=False):
+    """Yield (channel, matrix) for every converted channel of a log, in the
+    order of the channel names, or with columns (channel, matrix, column
+    names), the last one being log_time.
+
+    The channels are converted one at a time, using the sidecar index of the
+    log or else an index built in memory, so only one matrix is in memory at
+    a time.  The matrices and their log times are the ones of convert(),
+    whose arguments these are.
+    """
+    type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
+    try:
+        eventFilter = EventFilter(log.first_timestamp(), start, end,
+                channel_settings(every), channel_settings(maxRate))
+        selected = channel_offsets(log, type_db, selector, eventFilter, verbose)
+        if not selected:
+            return
+        startTime = first_decoded_timestamp(log,
+                numpy.concatenate(selected.values()), type_db)
+        for channel in sorted(selected.keys()):
+            converter = MatrixConverter(type_db, selector, newBuffer=buffer_factory(None, ragged),
+                    verbose=verbose, startTime=startTime, fields=fields)
+            converter.add_events(log.events_at(selected[channel]))
+            converter.finish()
+            if channel not in converter.data:
+                continue
+            matrix = buffer_output(channel, converter.data[channel], ragged)
+            if columns:
+                yield channel, matrix, converter.columns[channel] + [ "log_time" ]
+            else:
+                yield channel, matrix
+    finally:
+        log.close()
+
+def update(fname, out, channels=".*", ignore=None, lcm_packages=None,
+        compression=None, start=None, end=None, every=None, maxRate=None,
+        ragged=False, verbose=False, type_db=None, fields=None):
+    """Convert the events appended to a log since the last update of out, an
+    HDF5 file, and append their rows to it.  Returns the number of messages
+    added.
+
+    The first update creates out.  out also keeps the offset in the log at
+    which the next update resumes, the start time of the log times and the
+    state of the every and maxRate filters, so converting a log that is still
+    being recorded a piece at a time gives the same result as converting it
+    once it is complete.  The arguments are the ones of convert(), and must
+    be the same for every update of out.
+    """
+    if type_db is None:
+        type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
+    try:
+        logStart = log.first_timestamp()
+        if logStart is None:
+            # nothing recorded yet
+            return 0
+        h5out = Hdf5Output(out, blockSize, compression, mode="a")
+        try:
+            attrs = h5out.attrs
+            if "follow_offset" in attrs:
+                offset = int(attrs["follow_offset"])
+                if attrs["follow_log_header"].tostring() != log.read_header_bytes() \
+                        or offset > log.size():
+                    raise ValueError("%s was converted from a different log than %s" % (out, fname))
+                if bool(attrs["follow_ragged"]) != ragged:
+                    raise ValueError("%s was %sconverted with ragged" % (out, ragged and "not " or ""))
+            elif len(h5out.file):
+                raise ValueError("%s was not written by an update" % out)
+            else:
+                offset = 0
+                attrs["follow_log_header"] = numpy.frombuffer(log.read_header_bytes(), dtype=numpy.uint8)
+                attrs["follow_ragged"] = ragged
+
+            eventFilter = EventFilter(logStart, start, end,
+                    channel_settings(every), channel_settings(maxRate))
+            if "follow_filter" in attrs:
+                eventFilter.restore(json.loads(attrs["follow_filter"]))
+            startTime = None
+            if "follow_start_time" in attrs:
+                startTime = int(attrs["follow_start_time"])
+            converter = MatrixConverter(type_db, selector, eventFilter,
+                    buffer_factory(h5out, ragged), verbose=verbose, startTime=startTime,
+                    fields=fields)
+            ## Events that are still being written are left for the next update
+            converter.add_events(log.events(offset), log)
+            converter.finish()
+
+            ## The state is written after the rows, and both on close
+            attrs["follow_offset"] = log.tell()
+            attrs["follow_filter"] = json.dumps(eventFilter.state())
+            if startTime is None and converter.msgCount:
+                attrs["follow_start_time"] = converter.startTime
+        finally:
+            h5out.close()
+    finally:
+        log.close()
+    return converter.msgCount
+
+def follow(fname, out, interval=5.0, channels=".*", ignore=None, lcm_packages=None,
+        compression=None, start=None, end=None, every=None, maxRate=None,
+        ragged=False, verbose=False, progress=False, type_db=None, fields=None):
+    """update() out from a log every interval seconds, until SIGINT or
+    SIGTERM.  The signal is acted on between updates, so out is never left
+    with half an update.  With interval 0 out is updated once.
+
+    out is closed between updates, so it can be read while the log is
+    followed.  Returns the number of messages added.
+    """
+    if type_db is None:
+        type_db = get_lcmtype_dictionary(lcm_packages)
+    stopped = []
+    def stop(signum, frame):
+        stopped.append(signum)
+    handlers = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        handlers[signum] = signal.signal(signum, stop)
+    total = 0
+    try:
+        while not stopped:
+            count = update(fname, out, channels, ignore, lcm_packages, compression,
+                    start, end, every, maxRate, ragged, verbose, type_db, fields)
+            total += count
+            if progress and count:
+                sys.stderr.write("added %d messages to %s, %d in total\n" % (count, out, total))
+            if interval <= 0:
+                break
+            # a signal cuts the sleep short
+            time.sleep(interval)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    return total
+
+longOpts = ["help", "print", "format", "separator", "channelsToProcess", "ignore", "outfile", "lcm_packages", "jobs=", "output-format=", "compression=", "start=", "end=", "every=", "max-rate=", "ragged", "stats", "stats-json=", "batch=", "follow", "interval=", "images", "fields=", "pyramid=", "memory-limit=", "spill-dir=", "native-types"]
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hpvfs:c:i:o:l:j:", longOpts)
+    except getopt.GetoptError, err:
+        # print help information and exit:
+        print str(err) # will print something like "option -a not recognized"
+        usage()
+    batchDir = None
+    for o, a in opts:
+        if o == "--batch":
+            batchDir = a
+    if len(args) != (batchDir is None and 1 or 0):
+        usage()
+    #default options
+    fname = batchDir or args[0]
+    lcm_packages = None
+
+    outFname = default_output_name(fname)
+    outFnameGiven = False
+    printFname = "stdout"
+    printFile = sys.stdout
+    verbose = False
+    printOutput = False
+    printFormat = False
+    channelsToIgnore = None
+    channelsToProcess = ".*"
+    separator = ' '
+    jobs = None
+    outFormat = None
+    compression = None
+    windowStart = None
+    windowEnd = None
+    every = []
+    maxRate = []
+    ragged = False
+    stats = None
+    statsJson = None
+    followLog = False
+    interval = 5.0
+    images = False
+    fields = []
+    pyramid = None
+    memoryLimit = None
+    spillDir = None
+    nativeTypes = False
+    for o, a in opts:
+        if o == "-v":
+            verbose = True
+        elif o in ("-h", "--help"):
+            usage()
+        elif o in ("-p", "--print"):
+            printOutput = True
+        elif o in ("-f", "--format"):
+            printFormat = True
+        elif o in ("-s", "--separator="):
+            separator = a
+        elif o in ("-o", "--outfile="):
+            outFname = a
+            outFnameGiven = True
+            printFname = a
+        elif o in ("-c", "--channelsToProcess="):
+            channelsToProcess = a
+        elif o in ("-i", "--ignore="):
+            channelsToIgnore = a
+        elif o in ("-l", "--lcm_packages="):
+            lcm_packages = a.split(",")
+        elif o in ("-j", "--jobs"):
+            jobs = int(a)
+        elif o == "--output-format":
+            outFormat = a
+        elif o == "--compression":
+            compression = a
+        elif o == "--start":
+            windowStart = float(a)
+        elif o == "--end":
+            windowEnd = float(a)
+        elif o == "--every":
+            every.append(parse_channel_setting(a, int))
+        elif o == "--max-rate":
+            maxRate.append(parse_channel_setting(a, float))
+        elif o == "--ragged":
+            ragged = True
+        elif o == "--stats":
+            stats = ConversionStats()
+        elif o == "--stats-json":
+            statsJson = a
+            stats = ConversionStats()
+        elif o == "--batch":
+            pass
+        elif o == "--follow":
+            followLog = True
+        elif o == "--interval":
+            interval = float(a)
+        elif o == "--images":
+            images = True
+        elif o == "--pyramid":
+            try:
+                pyramid = parse_factors(a)
+            except ValueError, err:
+                print str(err)
+                usage()
+        elif o == "--memory-limit":
+            try:
+                memoryLimit = parse_memory_limit(a)
+            except ValueError, err:
+                print str(err)
+                usage()
+        elif o == "--spill-dir":
+            if not os.path.isdir(a) or not os.access(a, os.W_OK | os.X_OK):
+                sys.stderr.write("error: --spill-dir %s is not a writable directory\n" % a)
+                sys.exit(1)
+            spillDir = a
+        elif o == "--native-types":
+            nativeTypes = True
+        elif o == "--fields":
+            try:
+                fields.append(parse_fields_setting(a))
+            except ValueError, err:
+                print str(err)
+                usage()
+        else:
+            assert False, "unhandled option"
+
+    if followLog and outFormat is None and not outFnameGiven:
+        outFormat = "hdf5"
+    try:
+        outFormat = output_format(outFnameGiven and batchDir is None and outFname or None,
+                outFormat, OUTPUT_FORMATS)
+    except ValueError, err:
+        print str(err)
+        usage()
+    if batchDir is not None:
+        if printOutput or stats is not None or followLog:
+            print "-p, --stats and --follow are not used with --batch"
+            usage()
+        if outFormat not in ("mat", "hdf5"):
+            print "--batch writes mat or hdf5 output"
+            usage()
+        outDir = None
+        if outFnameGiven:
+            outDir = outFname
+        t0 = time.time()
+        results, skipped = convert_batch(batchDir, convert, outDir, jobs, lcm_packages,
+                outFormat, progress=True, channels=channelsToProcess,
+                ignore=channelsToIgnore, compression=compression, start=windowStart,
+                end=windowEnd, every=every, maxRate=maxRate, ragged=ragged,
+                verbose=verbose, images=images, fields=fields, pyramid=pyramid,
+                memoryLimit=memoryLimit, spillDir=spillDir, nativeTypes=nativeTypes)
+        report_batch(results, skipped, time.time() - t0, batchDir)
+        if [ r for r in results if r.error is not None ]:
+            sys.exit(1)
+        return
+
+    if not outFnameGiven:
+        if outFormat == "hdf5":
+            outFname = outFname + ".h5"
+        elif outFormat == "mat":
+            outFname = outFname + ".mat"
+
+    if followLog:
+        if printOutput or stats is not None or jobs or images or pyramid or nativeTypes:
+            print "-p, -j, --stats, --images, --pyramid and --native-types are not used with --follow"
+            usage()
+        if outFormat != "hdf5":
+            print "--follow writes hdf5 output"
+            usage()
+        sys.stderr.write("following % s, outputing to % s\n" % (fname, outFname))
+        try:
+            follow(fname, outFname, interval, channelsToProcess, channelsToIgnore,
+                    lcm_packages, compression, windowStart, windowEnd, every, maxRate,
+                    ragged, verbose, progress=True, fields=fields)
+        except ValueError, err:
+            sys.stderr.write("error: %s\n" % err)
+            sys.exit(1)
+        return
+
+    if images and (printOutput or (jobs or 1) > 1):
+        print "--images is not used with -p or -j"
+        usage()
+
+    try:
+        if printOutput:
+            sys.stderr.write("opened % s, printing output to %s \n" % (fname, printFname))
+            if printFname != "stdout":
+                printFile = open(printFname, "w")
+            print_log(fname, printFile, channelsToProcess, channelsToIgnore, lcm_packages,
+                    separator, windowStart, windowEnd, every, maxRate, printFormat, stats,
+                    verbose, fields)
+            if printFile is not sys.stdout:
+                printFile.close()
+        else:
+            convert(fname, outFname, channelsToProcess, channelsToIgnore, lcm_packages,
+                    jobs or 1, outFormat, compression, windowStart, windowEnd, every, maxRate,
+                    ragged, printFormat, stats, verbose, progress=True, images=images,
+                    fields=fields, pyramid=pyramid, memoryLimit=memoryLimit,
+                    spillDir=spillDir, nativeTypes=nativeTypes)
+    except ValueError, err:
+        # e.g. a field of --fields that the channel's type doesn't have
+        sys.stderr.write("\nerror: %s\n" % err)
+        sys.exit(1)
+
+    if stats is not None:
+        stats.report()
+        if statsJson:
+            stats.write_json(statsJson)
+
+if __name__ == "__main__":
+    main()
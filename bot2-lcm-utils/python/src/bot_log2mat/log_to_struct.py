@@ -4,6 +4,11 @@
 #tools such as Matlab. The set of messages on a given channel can be represented 
 #as a matrix, where the columns of this matrix are the the fields of the lcm type
 #with one message per row
+#
+# Like log_to_mat, the conversion can also be used from python:
+#
+#   from bot_log2mat.log_to_struct import convert, iter_channels
+#   structs = convert("run1.log", out="run1.mat", ignore="CAMERA.*")
 
 import os
 import sys
@@ -12,11 +17,18 @@ import types
 import numpy
 import re
 import getopt
+import time
 
 from scipy.io import savemat
 
-from lcm import EventLog
 from scan_for_lcmtypes import *
+from event_log import MmapEventLog
+from lcmtype_compiler import compile_lcmtype, field_dtypes
+from hdf5_output import Hdf5Output
+from event_filter import ChannelSelector
+from conversion_stats import ConversionStats, output_nbytes
+from conversion import default_output_name, output_format, select_events, \
+        channel_offsets, first_decoded_timestamp
 
 def usage():
     pname, sname = os.path.split(sys.argv[0])
@@ -30,13 +42,29 @@ def usage():
     -i --ignore=chan          Ignore channelsToProcess that match Python regex [chan]
                               ignores take precedence over includes!
     -o --outfile=ofname       output data to [ofname] instead of default [filename.mat or stdout]
-    -l --lcmtype_pkgs=pkgs    load python modules from comma seperated list of packages [pkgs] defaults to ["botlcm"]
+    -l --lcmtype_pkgs=pkgs    load LCM types from comma seperated list of packages [pkgs] defaults to all packages on the python path
+                              an entry of [pkgs] may be a directory of .lcm files, whose types are
+                              decoded without their lcm-gen python modules
+       --native-types         store every field with the type it has in the LCM type, e.g. int64
+                              utimes and float32 ranges, instead of converting it to double
+       --ragged               store variable length arrays and lists of LCM types as the
+                              concatenated values plus a [field]__offsets array (.mat only)
+       --output-format=fmt    write the output as [fmt], mat or hdf5 defaults to [mat], or [hdf5]
+                              if ofname ends with .h5 or .hdf5
+       --compression=method   compress the hdf5 datasets with [method] (gzip or lzf)
+       --stats                print the messages, payload bytes, decode and addMessage time
+                              and output bytes of every channel
+       --stats-json=file      also write these statistics to [file] as JSON
     -v                        Verbose
 
     """
     sys.exit()
 
-data = {}
+# fixed size messages are decoded in blocks of up to blockSize messages
+blockSize = 4096
+# compiled decoders by packed fingerprint, None for the types whose fields
+# are built message by message, shared by all conversions
+compiled_types = {}
 
 def make_lcmtype_string(msg, base=True):
     typeStr = []
@@ -111,9 +139,13 @@ def getUnderlyingType(val):
     # Wasn't a list/tuple, so just return
     return type(val)
 
-# Parse out the values of the dict to be the right shape/data type (float at the moment)
-def convertSingleDict(origDict):
+# Parse out the values of the dict to be the right shape/data type: float, or
+# with dtypes the dtype it gives for the field
+def convertSingleDict(origDict, dtypes=None):
     for field in origDict:
+        dtype = float
+        if dtypes is not None:
+            dtype = dtypes.get(field, float)
         # Check that this is actually a list
         if type(origDict[field]) in [ types.ListType, types.TupleType ]:
             # If use, find the underlying type
@@ -126,269 +158,602 @@ def convertSingleDict(origDict):
                 # Find the next type
                 if (type(origDict[field][0]) in [ types.IntType, types.LongType, types.BooleanType, types.FloatType ]):
                     # Single type class
-                    origDict[field] = numpy.atleast_2d(numpy.array(origDict[field], dtype=float))
+                    origDict[field] = numpy.atleast_2d(numpy.array(origDict[field], dtype=dtype))
                 else:
                     origData = origDict[field]
-                    # Convert underlying elements to float
+                    # Convert underlying elements to the field's type
                     newData = []
                     for elem in origData:
-                        newData.append(numpy.array(elem, dtype=float))
+                        newData.append(numpy.array(elem, dtype=dtype))
 
                     newData = numpy.array(newData).transpose()
 
                     origDict[field] = newData
 
         elif type(origDict[field]) in [ types.IntType, types.LongType, types.BooleanType ]:
-            origDict[field] = numpy.array(origDict[field], dtype=float)
+            origDict[field] = numpy.array(origDict[field], dtype=dtype)
 
     return origDict
 
 
-# Take in a dict, squash numeric data of the same size, convert numeric data to double and char data to string
-def makeArrayDict(dictIn):
-    dictOut = {}
-    for channel in dictIn:
-        if verbose:
-            sys.stderr.write("making a dict out of channel %s \n" % (chan))
-
-        dictOut[channel + 'Parsed'] = convertSingleDict(dictIn[channel])
-    return dictOut
-
-# Take a list of lcm message (or a list of lists, etc) and parse into a list of dicts
-def addMessageList(field):
-    # Check that his function wasn't called incorrectly
-    basetype = getUnderlyingType(field)
-    if not hasattr(basetype, '__slots__'):
-        raise ValueError('Tried to run addMessageList with a non-lcm base type')
-
-    # Check if we are only one level away
-    if (len(field) == 0):
-        return {}
-
-    if hasattr(field[0], '__slots__'):
-        # Only one level down, first create the empty structure
-        # Outputs a structure of concatenated data, concatenated along the list
-        msgStruct = addMessage({}, '', field[0], True)
-        msgStruct['numMsg'] = 0
-        # Add everything to the structure
-        for item in field:
-            msgStruct = addMessage(msgStruct, '', item)
-            msgStruct['numMsg'] += 1
-
-        # Convert the dictionary to approriate form
-        return convertSingleDict(msgStruct)
-
-    # At least one level of lists lie between this and the underlying messeges
-    # This will output a list of struct/lists (depending on the next level
-    outList = []
-    for item in field:
-        outList.append(addMessageList(item))
-
-    return outList
-
 def makeVarName(baseName, fieldName):
     if len(baseName) == 0:
         return fieldName
     else:
         return baseName + '__' + fieldName
 
-# Take the message structure and output a decomposed version
-def addMessage(struct, baseName, msg, create = False):
-    for fieldName in getattr(msg, '__slots__'):
-        field = getattr(msg, fieldName)
-        if hasattr(field, '__slots__'):
-            # The field is another lcm type
-            struct = addMessage(struct, makeVarName(baseName, fieldName), field, create)
-        else:
-            basetype = getUnderlyingType(field)
-            if hasattr(basetype, '__slots__'):
-                # The field is a tuple/list of another lcmtype
-                if (create):
-                    struct[makeVarName(baseName, fieldName)] = []
-                else:
-                    # Appends either a struct, or a list of structs, or...
-                    struct[makeVarName(baseName, fieldName)].append(addMessageList(field))
+def isRaggedList(field):
+    if type(field) not in [ types.ListType, types.TupleType ]:
+        return False
+    if len(field) == 0:
+        return True
+    return type(field[0]) in [ types.IntType, types.LongType, types.BooleanType, types.FloatType ] \
+            or hasattr(field[0], '__slots__')
+
+class StructConverter(object):
+    """Decomposes the messages of a log into a struct of fields per channel.
+
+    The events are passed in log order to add_events(), in one or more
+    calls, and finish() completes the fields of the messages decoded in
+    blocks.  self.data maps each channel to its dict of fields, and arrays()
+    converts them to the arrays that are saved.  With h5out, an Hdf5Output,
+    the fields are written to it every blockSize messages instead, and with
+    printFile each message is printed to it.  The fields are float64, or
+    with nativeTypes of their types in the LCM type.
+
+    Log times are relative to startTime, by default the timestamp of the
+    first message that decodes.
+    """
 
+    def __init__(self, type_db, selector, h5out=None, ragged=False, printFile=None,
+            printFormat=False, stats=None, verbose=False, progress=False,
+            startTime=None, nativeTypes=False):
+        self.type_db = type_db
+        self.selector = selector
+        self.h5out = h5out
+        self.ragged = ragged
+        self.printFile = printFile
+        self.printFormat = printFormat
+        self.stats = stats
+        self.verbose = verbose
+        self.progress = progress
+        self.nativeTypes = nativeTypes
+        self.data = {}
+        # with nativeTypes, the field dtypes of each channel and of each nested type
+        self.dtypes = {}
+        self.typeDtypes = {}
+        # channels decoded in blocks: channel -> (compiled type, record arrays, pending payloads)
+        self.blocks = {}
+        # list fields of LCM messages whose sub-fields exist, with ragged
+        self.raggedCreated = set()
+        self.ignored_channels = set()
+        self.msgCount = 0
+        self.startTime = 0
+        self._fixedStart = startTime is not None
+        if self._fixedStart:
+            self.startTime = startTime
+        self.statusMsg = ""
+
+    # The dtypes of the fields of the type of msg with nativeTypes, else None
+    def fieldDtypes(self, msg):
+        if not self.nativeTypes:
+            return None
+        klass = msg.__class__
+        if klass not in self.typeDtypes:
+            self.typeDtypes[klass] = field_dtypes(klass)
+        return self.typeDtypes[klass]
+
+    # Decode the fixed size messages buffered for a channel into a record array
+    def flushBlock(self, channel):
+        compiled, records, payloads = self.blocks[channel]
+        if payloads:
+            if self.stats is not None:
+                t0 = time.time()
+            records.append(compiled.decode_block(payloads))
+            del payloads[:]
+            if self.stats is not None:
+                self.stats.channel(channel).decodeTime += time.time() - t0
+
+    # Write the messages buffered for a channel to the HDF5 file and empty its lists
+    def flushStruct(self, channel):
+        struct = self.data[channel]
+        fields = dict(struct)
+        if channel in self.blocks:
+            self.flushBlock(channel)
+            compiled, records, payloads = self.blocks[channel]
+            if records:
+                fields.update(compiled.struct_columns(numpy.concatenate(records),
+                    native=self.nativeTypes))
+                del records[:]
+        self.h5out.channels[channel].append(convertSingleDict(fields, self.dtypes.get(channel)),
+                struct['numMsg'])
+        for field in struct:
+            if type(struct[field]) is types.ListType:
+                struct[field] = []
+        struct['numMsg'] = 0
+
+    # Take a list of lcm message (or a list of lists, etc) and parse into a list of dicts
+    def addMessageList(self, field):
+        # Check that his function wasn't called incorrectly
+        basetype = getUnderlyingType(field)
+        if not hasattr(basetype, '__slots__'):
+            raise ValueError('Tried to run addMessageList with a non-lcm base type')
+
+        # Check if we are only one level away
+        if (len(field) == 0):
+            return {}
+
+        if hasattr(field[0], '__slots__'):
+            # Only one level down, first create the empty structure
+            # Outputs a structure of concatenated data, concatenated along the list
+            msgStruct = self.addMessage({}, '', field[0], True)
+            msgStruct['numMsg'] = 0
+            # Add everything to the structure
+            for item in field:
+                msgStruct = self.addMessage(msgStruct, '', item)
+                msgStruct['numMsg'] += 1
+
+            # Convert the dictionary to approriate form
+            return convertSingleDict(msgStruct, self.fieldDtypes(field[0]))
+
+        # At least one level of lists lie between this and the underlying messeges
+        # This will output a list of struct/lists (depending on the next level
+        outList = []
+        for item in field:
+            outList.append(self.addMessageList(item))
+
+        return outList
+
+    # Take the message structure and output a decomposed version
+    def addMessage(self, struct, baseName, msg, create = False):
+        for fieldName in getattr(msg, '__slots__'):
+            field = getattr(msg, fieldName)
+            if hasattr(field, '__slots__'):
+                # The field is another lcm type
+                struct = self.addMessage(struct, makeVarName(baseName, fieldName), field, create)
             else:
-                # Non message field, we can just append
-                if (create):
-                    struct[makeVarName(baseName, fieldName)] = []
+                basetype = getUnderlyingType(field)
+                if self.ragged and isRaggedList(field):
+                    self.addRaggedList(struct, makeVarName(baseName, fieldName), field, create)
+                elif hasattr(basetype, '__slots__'):
+                    # The field is a tuple/list of another lcmtype
+                    if (create):
+                        struct[makeVarName(baseName, fieldName)] = []
+                    else:
+                        # Appends either a struct, or a list of structs, or...
+                        struct[makeVarName(baseName, fieldName)].append(self.addMessageList(field))
+
                 else:
-                    struct[makeVarName(baseName, fieldName)].append(field)
-
-    return struct
-
-### Start of processing
-longOpts = ["help", "print", "format", "separator", "channelsToProcess", "ignore", "outfile", "lcm_packages"]
-
-try:
-    opts, args = getopt.gnu_getopt(sys.argv[1:], "hpvfs:c:i:o:l:", longOpts)
-except getopt.GetoptError, err:
-    # print help information and exit:
-    print str(err) # will print something like "option -a not recognized"
-    usage()
-if len(args) != 1:
-    usage()
-#default options
-fname = args[0]
-lcm_packages = [ "botlcm"]
-
-outDir, outFname = os.path.split(os.path.abspath(fname))
-outFname = outFname.replace(".", "_")
-outFname = outFname.replace("-", "_")
-outFname = outDir + "/" + outFname + "_parsed.mat"
-printFile = sys.stdout
-verbose = False
-printOutput = False
-printFormat = False
-channelsToIgnore = ""
-checkIgnore = False
-channelsToProcess = ".*"
-separator = ' '
-for o, a in opts:
-    if o == "-v":
-        verbose = True
-    elif o in ("-h", "--help"):
-        usage()
-    elif o in ("-p", "--print"):
-        printOutput = True
-    elif o in ("-f", "--format"):
-        printFormat = True
-    elif o in ("-s", "--separator="):
-        separator = a
-    elif o in ("-o", "--outfile="):
-        outFname = a
-    elif o in ("-c", "--channelsToProcess="):
-        channelsToProcess = a
-    elif o in ("-i", "--ignore="):
-        channelsToIgnore = a
-        checkIgnore = True
-    elif o in ("-l", "--lcm_packages="):
-        lcm_packages = a.split(",")
-    else:
-        assert False, "unhandled option"
-
-fullPathName = os.path.abspath(outFname)
-dirname = os.path.dirname(fullPathName)
-outBaseName = ".".join(os.path.basename(outFname).split(".")[0:-1])
-fullBaseName = dirname + "/" + outBaseName
-
-type_db = make_lcmtype_dictionary()
-
-channelsToProcess = re.compile(channelsToProcess)
-channelsToIgnore = re.compile(channelsToIgnore)
-log = EventLog(fname, "r")
-
-if printOutput:
-    sys.stderr.write("opened % s, printing output to %s \n" % (fname, stdout))
-else:
-    sys.stderr.write("opened % s, outputing to % s\n" % (fname, outFname))
-
-ignored_channels = []
-msgCount = 0
-statusMsg = ""
-startTime = 0
-
-### Start processing the log ###
-for e in log:
-    if msgCount == 0:
-        startTime = e.timestamp
-
-    if e.channel in ignored_channels:
-        continue
-    if ((checkIgnore and channelsToIgnore.match(e.channel) and len(channelsToIgnore.match(e.channel).group())==len(e.channel)) \
-         or (not channelsToProcess.match(e.channel))):
-        if verbose:
-            statusMsg = deleteStatusMsg(statusMsg)
-            sys.stderr.write("ignoring channel %s\n" % e.channel)
-        ignored_channels.append(e.channel)
-        continue
-
-    ## This is an event we actually want to process
-    packed_fingerprint = e.data[:8]
-    lcmtype = type_db.get(packed_fingerprint, None)
-    if not lcmtype:
-        if verbose:
-            statusMsg = deleteStatusMsg(statusMsg)
-            sys.stderr.write("ignoring channel %s -not a known LCM type\n" % e.channel)
-        ignored_channels.append(e.channel)
-        continue
+                    # Non message field, we can just append
+                    if (create):
+                        struct[makeVarName(baseName, fieldName)] = []
+                    else:
+                        struct[makeVarName(baseName, fieldName)].append(field)
+
+        return struct
+
+    # Append a list field to a ragged field: the values of every message, or the
+    # fields of every element for a list of LCM messages, are concatenated and
+    # name__offsets marks where the elements of each message start
+    def addRaggedList(self, struct, name, field, create):
+        offsetsName = makeVarName(name, 'offsets')
+        if create:
+            struct[offsetsName] = [0]
+            return
+        offsets = struct[offsetsName]
+        if len(field) and hasattr(field[0], '__slots__'):
+            if (id(struct), name) not in self.raggedCreated:
+                self.addMessage(struct, name, field[0], True)
+                self.raggedCreated.add((id(struct), name))
+            for item in field:
+                self.addMessage(struct, name, item)
+        else:
+            struct.setdefault(name, []).extend(field)
+        offsets.append(offsets[-1] + len(field))
+
+    def add_events(self, events, log=None):
+        """Convert events, e.g. from an MmapEventLog.  log is only used to
+        report the progress."""
+        data = self.data
+        blocks = self.blocks
+        stats = self.stats
+        verbose = self.verbose
+        for e in events:
+            if self.msgCount == 0 and not self._fixedStart:
+                self.startTime = e.timestamp
+
+            if e.channel in self.ignored_channels:
+                continue
+            if self.selector.is_ignored(e.channel):
+                if verbose:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    sys.stderr.write("ignoring channel %s\n" % e.channel)
+                self.ignored_channels.add(e.channel)
+                continue
+
+            ## This is an event we actually want to process
+            packed_fingerprint = e.data[:8]
+            lcmtype = self.type_db.get(packed_fingerprint, None)
+            if not lcmtype:
+                if verbose:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    sys.stderr.write("ignoring channel %s -not a known LCM type\n" % e.channel)
+                self.ignored_channels.add(e.channel)
+                continue
+            if packed_fingerprint in compiled_types:
+                compiled = compiled_types[packed_fingerprint]
+            else:
+                compiled = compile_lcmtype(lcmtype)
+                if compiled is not None and not compiled.has_struct_columns():
+                    compiled = None
+                compiled_types[packed_fingerprint] = compiled
+            # fixed size numeric messages are decoded in blocks, straight into columns
+            inBlock = compiled is not None and self.printFile is None
+            if stats is not None:
+                t0 = time.time()
+            try:
+                if not inBlock or not e.channel in data:
+                    msg = lcmtype.decode(e.data)
+                elif len(e.data) < compiled.itemsize:
+                    raise ValueError("truncated message")
+            except:
+                self.statusMsg = deleteStatusMsg(self.statusMsg)
+                sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
+                continue
+
+            ## We were successfully able to decode the message
+            self.msgCount += 1
+            if stats is not None:
+                chanStats = stats.channel(e.channel, lcmtype.__name__)
+                chanStats.count += 1
+                chanStats.payloadBytes += len(e.data)
+                chanStats.decodeTime += time.time() - t0
+            if self.progress and log is not None and (self.msgCount % 5000) == 0:
+                self.statusMsg = deleteStatusMsg(self.statusMsg)
+                self.statusMsg = "read % d messages, % d %% done" % (self.msgCount, log.tell() / float(log.size())*100)
+                sys.stderr.write(self.statusMsg)
+                sys.stderr.flush()
+
+            ## Figure out how to parse this message
+            if not e.channel in data:
+                # Create empty data structure with expanded field
+                basestruct = self.addMessage({}, '', msg, True)
+
+                basestruct['logTime'] = []
+                basestruct['channel'] = str(e.channel)
+                basestruct['typename'] = msg.__class__.__name__
+                basestruct['numMsg'] = 0
+
+                data[e.channel] = basestruct
+                self.dtypes[e.channel] = self.fieldDtypes(msg)
+                if self.h5out is not None:
+                    self.h5out.fields(e.channel, basestruct['typename'])
+
+                if self.printFormat:
+                    self.statusMsg = deleteStatusMsg(self.statusMsg)
+                    typeStr, fieldCount = make_lcmtype_string(msg)
+                    typeStr.append("%d- log_timestamp" % (fieldCount + 1))
+
+                    typeStr = "\n#%s  %s :\n#[\n#%s\n#]\n" % (e.channel, lcmtype, "\n#".join(typeStr))
+                    sys.stderr.write(typeStr)
+
+            ## Compute the log time
+            logTime = (e.timestamp - self.startTime) / 1e6
+
+            ## Place the new data in a structure
+            if self.printFile is not None:
+                # Make a single struct, then print it
+                struct = self.addMessage(self.addMessage({}, '', msg, True), '', msg)
+                struct['logTime'] = [ logTime ]
+                struct['numMsg'] = 1
+                self.printFile.write("%s %s\n" % (e.channel, struct))
+            else:
+                # Append the structn
+                if inBlock:
+                    if not e.channel in blocks:
+                        blocks[e.channel] = (compiled, [], [])
+                    blocks[e.channel][2].append(e.data)
+                    if len(blocks[e.channel][2]) >= blockSize:
+                        self.flushBlock(e.channel)
+                else:
+                    if stats is not None:
+                        t0 = time.time()
+                    data[e.channel] = self.addMessage(data[e.channel], '', msg)
+                    if stats is not None:
+                        chanStats.flattenTime += time.time() - t0
+                data[e.channel]['logTime'].append(logTime)
+                data[e.channel]['numMsg'] += 1
+                if self.h5out is not None and data[e.channel]['numMsg'] >= blockSize:
+                    self.flushStruct(e.channel)
+
+    def finish(self):
+        """Write the remaining messages to the HDF5 file, or add the fields of
+        the messages decoded in blocks."""
+        self.statusMsg = deleteStatusMsg(self.statusMsg)
+        if self.printFile is not None:
+            return
+        if self.h5out is not None:
+            for chan in self.data:
+                self.flushStruct(chan)
+            return
+        for chan in self.blocks:
+            self.flushBlock(chan)
+            compiled, records, payloads = self.blocks[chan]
+            if not records:
+                continue
+            if self.stats is not None:
+                t0 = time.time()
+            self.data[chan].update(compiled.struct_columns(numpy.concatenate(records),
+                native=self.nativeTypes))
+            del records[:]
+            if self.stats is not None:
+                self.stats.channel(chan).flattenTime += time.time() - t0
+
+    # Turn the ragged fields into arrays; the ones that turned out to have a
+    # fixed length are stored like any other array field
+    def finishRagged(self, struct, dtypes=None):
+        for offsetsName in [ k for k in struct.keys() if k.endswith('__offsets') ]:
+            offsets = struct[offsetsName]
+            if type(offsets) is not types.ListType:
+                continue
+            if len(offsets) != struct['numMsg'] + 1:
+                # decoded in blocks, not through addMessage
+                del struct[offsetsName]
+                continue
+            offsets = numpy.array(offsets, dtype=numpy.int64)
+            name = offsetsName[:-len('__offsets')]
+            values = struct.get(name, None)
+            if type(values) is types.ListType and \
+                    (len(values) == 0 or type(values[0]) in [ types.IntType, types.LongType, types.BooleanType, types.FloatType ]):
+                dtype = float
+                if dtypes is not None:
+                    dtype = dtypes.get(name, float)
+                values = numpy.array(values, dtype=dtype)
+                lengths = numpy.diff(offsets)
+                if len(lengths) and lengths[0] > 0 and (lengths == lengths[0]).all():
+                    struct[name] = values.reshape(len(lengths), lengths[0]).transpose()
+                    del struct[offsetsName]
+                    continue
+                struct[name] = values
+            struct[offsetsName] = offsets
+        return struct
+
+    # Squash numeric data of the same size, convert numeric data to double (or
+    # to its own type with nativeTypes) and char data to string
+    def arrays(self):
+        """Return a dict mapping each channel to its fields as arrays."""
+        dictOut = {}
+        for channel in self.data:
+            if self.verbose:
+                sys.stderr.write("making a dict out of channel %s \n" % (channel))
+
+            if self.stats is not None:
+                t0 = time.time()
+            dtypes = self.dtypes.get(channel)
+            if self.ragged:
+                self.finishRagged(self.data[channel], dtypes)
+            dictOut[channel] = convertSingleDict(self.data[channel], dtypes)
+            if self.stats is not None:
+                chanStats = self.stats.channel(channel)
+                chanStats.flattenTime += time.time() - t0
+                chanStats.outputBytes = output_nbytes(dictOut[channel])
+        return dictOut
+
+def save_struct(outFname, data):
+    """Save the structs of convert() to a .mat file, as a CHANNELParsed
+    variable per channel."""
+    d = {}
+    for channel in data:
+        d[channel + 'Parsed'] = data[channel]
+    savemat(outFname, d, oned_as='column')
+
+def convert(fname, out=None, channels=".*", ignore=None, lcm_packages=None,
+        outFormat=None, compression=None, ragged=False, printFormat=False,
+        stats=None, verbose=False, progress=False, type_db=None, nativeTypes=False):
+    """Convert a log to a struct of fields per channel and save them to out.
+
+    The arguments are the ones of log_to_mat.convert().  With nativeTypes
+    every field keeps the type it has in the LCM type, e.g. int64 utimes and
+    float32 ranges, instead of being converted to float64.  Returns a dict
+    mapping each channel to its dict of fields.  Nothing is saved if out is
+    None.  HDF5 output is written while the log is read, and returns None.
+    """
+    outFormat = output_format(out, outFormat)
+    if outFormat == "hdf5" and out is None:
+        raise ValueError("HDF5 output needs an output file")
+    if ragged and outFormat == "hdf5":
+        raise ValueError("--ragged is only supported for .mat output")
+    if type_db is None:
+        type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
     try:
-        msg = lcmtype.decode(e.data)
-    except:
-        statusMsg = deleteStatusMsg(statusMsg)
-        sys.stderr.write("error: couldn't decode msg on channel %s\n" % e.channel)
-        continue
-
-    ## We were successfully able to decode the message
-    msgCount = msgCount + 1
-    if (msgCount % 5000) == 0:
-        statusMsg = deleteStatusMsg(statusMsg)
-        statusMsg = "read % d messages, % d %% done" % (msgCount, log.tell() / float(log.size())*100)
-        sys.stderr.write(statusMsg)
-        sys.stderr.flush()
-
-    ## Figure out how to parse this message
-    if not e.channel in data:
-        # Create empty data structure with expanded field
-        basestruct = addMessage({}, '', msg, True)
-
-        basestruct['logTime'] = []
-        basestruct['channel'] = str(e.channel)
-        basestruct['typename'] = msg.__class__.__name__
-        basestruct['numMsg'] = 0
-
-        data[e.channel] = basestruct
-
-        if printFormat:
-            statusMsg = deleteStatusMsg(statusMsg)
-            typeStr, fieldCount = make_lcmtype_string(msg)
-            typeStr.append("%d- log_timestamp" % (fieldCount + 1))
-
-            typeStr = "\n#%s  %s :\n#[\n#%s\n#]\n" % (e.channel, lcmtype, "\n#".join(typeStr))
-            sys.stderr.write(typeStr)
-
-    ## Compute the log time
-    logTime = (e.timestamp - startTime) / 1e6
-
-    ## Place the new data in a structure
-    if printOutput:
-        # Make a single struct, then print it
-        datacopy = data;
-        datacopy = addMessage(datacopy, '', msg)
-        datacopy['logTime'].append(logTime)
-        datacopy['numMsg'] += 1
-        print datacopy
+        ## HDF5 output is written while the log is read
+        h5out = None
+        if outFormat == "hdf5":
+            h5out = Hdf5Output(out, blockSize, compression)
+
+        if progress:
+            sys.stderr.write("opened % s, outputing to % s\n" % (fname, out))
+
+        ## With a sidecar index only the events of the selected channels are read
+        events, offsets, ignored = select_events(log, type_db, selector, None, verbose)
+        converter = StructConverter(type_db, selector, h5out, ragged, printFormat=printFormat,
+                stats=stats, verbose=verbose, progress=progress, nativeTypes=nativeTypes)
+        converter.ignored_channels.update(ignored)
+        converter.add_events(events, log)
+        converter.finish()
+    finally:
+        log.close()
+
+    result = None
+    if h5out is not None:
+        if stats is not None:
+            saveStart = time.time()
+        h5out.close()
+        if stats is not None:
+            stats.saveTime = time.time() - saveStart
+            for chan, writer in h5out.channels.items():
+                stats.channel(chan).outputBytes = writer.nbytes
+        if progress:
+            sys.stderr.write("wrote all %d messages to % s\n" % (converter.msgCount, out))
     else:
-        # Append the structn
-        data[e.channel] = addMessage(data[e.channel], '', msg)
-        data[e.channel]['logTime'].append(logTime)
-        data[e.channel]['numMsg'] += 1
+        result = converter.arrays()
+        if out is not None:
+            if progress:
+                sys.stderr.write("loaded all %d messages, saving to % s\n" % (converter.msgCount, out))
+            if stats is not None:
+                saveStart = time.time()
+            save_struct(out, result)
+            if stats is not None:
+                stats.saveTime = time.time() - saveStart
+
+    if stats is not None:
+        stats.finish()
+    return result
+
+def print_log(fname, printFile=None, channels=".*", ignore=None, lcm_packages=None,
+        printFormat=False, stats=None, verbose=False):
+    """Print the struct of every message of a log to printFile (stdout by
+    default).  The other arguments are the ones of convert()."""
+    if printFile is None:
+        printFile = sys.stdout
+    type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
+    try:
+        events, offsets, ignored = select_events(log, type_db, selector, None, verbose)
+        converter = StructConverter(type_db, selector, printFile=printFile,
+                printFormat=printFormat, stats=stats, verbose=verbose)
+        converter.ignored_channels.update(ignored)
+        converter.add_events(events, log)
+        converter.finish()
+    finally:
+        log.close()
+    if stats is not None:
+        stats.finish()
+    return converter.msgCount
+
+def iter_channels(fname, channels=".*", ignore=None, lcm_packages=None, ragged=False,
+        verbose=False, nativeTypes=False):
+    """Yield (channel, fields) for every converted channel of a log, in the
+    order of the channel names.
+
+    The channels are converted one at a time, like log_to_mat.iter_channels(),
+    and the fields are the ones of convert().
+    """
+    type_db = get_lcmtype_dictionary(lcm_packages)
+    selector = ChannelSelector(channels, ignore)
+    log = MmapEventLog(fname)
+    try:
+        selected = channel_offsets(log, type_db, selector, None, verbose)
+        if not selected:
+            return
+        startTime = first_decoded_timestamp(log,
+                numpy.concatenate(selected.values()), type_db)
+        for channel in sorted(selected.keys()):
+            converter = StructConverter(type_db, selector, ragged=ragged,
+                    verbose=verbose, startTime=startTime, nativeTypes=nativeTypes)
+            converter.add_events(log.events_at(selected[channel]))
+            converter.finish()
+            arrays = converter.arrays()
+            if channel in arrays:
+                yield channel, arrays[channel]
+    finally:
+        log.close()
+
+longOpts = ["help", "print", "format", "separator", "channelsToProcess", "ignore", "outfile", "lcm_packages", "output-format=", "compression=", "ragged", "stats", "stats-json=", "native-types"]
+
+def main():
+    try:
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hpvfs:c:i:o:l:", longOpts)
+    except getopt.GetoptError, err:
+        # print help information and exit:
+        print str(err) # will print something like "option -a not recognized"
+        usage()
+    if len(args) != 1:
+        usage()
+    #default options
+    fname = args[0]
+    lcm_packages = None
+
+    outFname = default_output_name(fname, "_parsed")
+    outFnameGiven = False
+    verbose = False
+    printOutput = False
+    printFormat = False
+    channelsToIgnore = None
+    channelsToProcess = ".*"
+    separator = ' '
+    outFormat = None
+    compression = None
+    ragged = False
+    nativeTypes = False
+    stats = None
+    statsJson = None
+    for o, a in opts:
+        if o == "-v":
+            verbose = True
+        elif o in ("-h", "--help"):
+            usage()
+        elif o in ("-p", "--print"):
+            printOutput = True
+        elif o in ("-f", "--format"):
+            printFormat = True
+        elif o in ("-s", "--separator="):
+            separator = a
+        elif o in ("-o", "--outfile="):
+            outFname = a
+            outFnameGiven = True
+        elif o in ("-c", "--channelsToProcess="):
+            channelsToProcess = a
+        elif o in ("-i", "--ignore="):
+            channelsToIgnore = a
+        elif o in ("-l", "--lcm_packages="):
+            lcm_packages = a.split(",")
+        elif o == "--output-format":
+            outFormat = a
+        elif o == "--compression":
+            compression = a
+        elif o == "--ragged":
+            ragged = True
+        elif o == "--native-types":
+            nativeTypes = True
+        elif o == "--stats":
+            stats = ConversionStats()
+        elif o == "--stats-json":
+            statsJson = a
+            stats = ConversionStats()
+        else:
+            assert False, "unhandled option"
 
+    try:
+        outFormat = output_format(outFnameGiven and outFname or None, outFormat)
+    except ValueError, err:
+        print str(err)
+        usage()
+    if ragged and outFormat == "hdf5":
+        print "--ragged is only supported for .mat output"
+        usage()
+    if not outFnameGiven:
+        if outFormat == "hdf5":
+            outFname = outFname + ".h5"
+        else:
+            outFname = outFname + ".mat"
 
-deleteStatusMsg(statusMsg)
-if not printOutput:
-    d = makeArrayDict(data)
-    sys.stderr.write("loaded all %d messages, saving to % s\n" % (msgCount, outFname))
+    if printOutput:
+        sys.stderr.write("opened % s, printing output to stdout \n" % fname)
+        print_log(fname, sys.stdout, channelsToProcess, channelsToIgnore, lcm_packages,
+                printFormat, stats, verbose)
+    else:
+        convert(fname, outFname, channelsToProcess, channelsToIgnore, lcm_packages,
+                outFormat, compression, ragged, printFormat, stats, verbose,
+                progress=True, nativeTypes=nativeTypes)
 
-    savemat(outFname, d, oned_as='column')
+    if stats is not None:
+        stats.report()
+        if statsJson:
+            stats.write_json(statsJson)
 
-    # Stop writing the stupid .m files
-#     ## Write the actual file
-#     mfile = open(dirname + "/" + outBaseName + ".m", "w")
-#     ## Write the .m to load it
-#     loadFunc = """function [d imFnames]=%s()
-# full_fname = '%s';
-# fname = '%s';
-# if (exist(full_fname,'file'))
-#     filename = full_fname;
-# else
-#     filename = fname;
-# end
-# d = load(filename);
-# """ % (outBaseName, outFname, fullPathName)
-
-
-
-#     mfile.write(loadFunc);
-#     mfile.close()
+if __name__ == "__main__":
+    main()
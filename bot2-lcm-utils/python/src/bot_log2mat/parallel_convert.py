@@ -0,0 +1,271 @@
+#
+# Multi-process conversion of a single log for bot-log2mat.
+#
+# The log is split into byte ranges at event boundaries, each range is decoded
+# and flattened in a worker process, and the per-channel results are merged
+# back in log order.  The merged data is identical to what the serial loop in
+# log_to_mat produces, including the startTime-relative log time column.
+
+import sys
+import time
+import multiprocessing
+import numpy
+
+from channel_buffer import ChannelBuffer
+from lcmtype_compiler import compile_lcmtype
+from extractors import block_decoder, with_log_times
+from event_log import MmapEventLog, find_event_boundaries
+from flatten import make_flattener, make_lcmtype_string, make_column_names, check_fields
+from event_filter import channel_setting
+from conversion_stats import ChannelStats
+
+# options shared with the worker processes, set by _init_worker
+_worker = {}
+
+def _init_worker(type_db, selector, printFormat, collectStats, fields):
+    _worker["type_db"] = type_db
+    _worker["selector"] = selector
+    _worker["printFormat"] = printFormat
+    _worker["compiled_types"] = {}
+    _worker["collectStats"] = collectStats
+    _worker["fields"] = fields
+
+class _ChunkChannel(object):
+    """Rows decoded from one channel in one byte range.
+
+    Each row ends with a placeholder for the log time, which can only be
+    computed once startTime is known; widths records where it is.
+    """
+    def __init__(self, firstIndex):
+        self.firstIndex = firstIndex
+        self.rows = ChannelBuffer()
+        self.widths = []
+        self.timestamps = []
+        self.flattener = None
+        self.formatStr = None
+        self.columns = None
+        self.typename = None
+        self.pending = None
+        self.stats = None
+
+    def flush(self):
+        if self.pending:
+            decoder, payloads = self.pending
+            if self.stats is not None:
+                t0 = time.time()
+            records = decoder.decode_block(payloads)
+            if self.stats is not None:
+                t1 = time.time()
+            rows = decoder.flatten_block(records)
+            if self.stats is not None:
+                self.stats.decodeTime += t1 - t0
+                self.stats.flattenTime += time.time() - t1
+            rows, widths = with_log_times(rows, decoder.row_widths(records),
+                    numpy.zeros(len(rows)))
+            self.rows.extend(rows, widths)
+            if widths is None:
+                self.widths.extend([ rows.shape[1] ] * len(rows))
+            else:
+                self.widths.extend(widths)
+        self.pending = None
+
+    def result(self):
+        self.flush()
+        return (self.firstIndex, self.rows.array(),
+                numpy.array(self.widths, dtype=numpy.int64),
+                numpy.array(self.timestamps, dtype=numpy.int64),
+                self.formatStr, self.columns, self.typename, self.stats)
+
+def _convert_range(byteRange):
+    """Decode and flatten the events in one byte range of the log, or at the
+    given event offsets."""
+    fname, start, end, offsets = byteRange
+    type_db = _worker["type_db"]
+    compiled_types = _worker["compiled_types"]
+    channels = {}
+    ignored = {}
+    unknown = {}
+    errors = []
+    collectStats = _worker["collectStats"]
+    is_ignored = _worker["selector"].is_ignored
+    fieldSettings = _worker["fields"]
+    channelFields = {}
+
+    # the payload views stay valid only while the log is mapped
+    log = MmapEventLog(fname)
+    try:
+        if offsets is None:
+            events = log.events(start, end)
+        else:
+            events = log.events_at(offsets)
+        index = -1
+        for e in events:
+            index += 1
+            if e.channel in ignored:
+                continue
+            if is_ignored(e.channel):
+                ignored[e.channel] = index
+                continue
+
+            packed_fingerprint = e.data[:8]
+            lcmtype = type_db.get(packed_fingerprint, None)
+            if not lcmtype:
+                ignored[e.channel] = index
+                unknown[e.channel] = index
+                continue
+            fields = None
+            if fieldSettings:
+                if e.channel not in channelFields:
+                    channelFields[e.channel] = channel_setting(fieldSettings, e.channel)
+                fields = channelFields[e.channel]
+            compiledKey = packed_fingerprint
+            if fields is not None:
+                compiledKey = (packed_fingerprint, fields)
+            if compiledKey in compiled_types:
+                compiled, decoder = compiled_types[compiledKey]
+            else:
+                compiled = compile_lcmtype(lcmtype, fields)
+                decoder = block_decoder(lcmtype, compiled, fields)
+                compiled_types[compiledKey] = (compiled, decoder)
+            inBlock = decoder is not None
+
+            chan = channels.get(e.channel, None)
+            if collectStats:
+                t0 = time.time()
+            flattenTime = 0.0
+            try:
+                if compiled is None or chan is None:
+                    msg = lcmtype.decode(e.data)
+                if inBlock:
+                    decoder.check(e.data)
+                elif compiled is not None:
+                    # decodes and flattens in one pass, counted as flattening
+                    if collectStats:
+                        t1 = time.time()
+                    a = compiled.flatten(e.data)
+                    if collectStats:
+                        flattenTime = time.time() - t1
+            except:
+                errors.append(e.channel)
+                continue
+
+            if chan is None:
+                if fields is not None:
+                    check_fields(msg, fields)
+                chan = _ChunkChannel(index)
+                chan.flattener = make_flattener(msg, fields)
+                chan.columns = make_column_names(msg, fields=fields)
+                chan.typename = lcmtype.__name__
+                if _worker["printFormat"]:
+                    typeStr, fieldCount = make_lcmtype_string(msg, fields=fields)
+                    typeStr.append("%d- log_timestamp" % (fieldCount + 1))
+                    chan.formatStr = "\n#%s  %s :\n#[\n#%s\n#]\n" % (e.channel, lcmtype, "\n#".join(typeStr))
+                if collectStats:
+                    chan.stats = ChannelStats(e.channel, chan.typename)
+                channels[e.channel] = chan
+
+            if collectStats:
+                chan.stats.count += 1
+                chan.stats.payloadBytes += len(e.data)
+                chan.stats.decodeTime += time.time() - t0 - flattenTime
+                chan.stats.flattenTime += flattenTime
+                t0 = time.time()
+            chan.timestamps.append(e.timestamp)
+            if chan.pending and (not inBlock or chan.pending[0] is not decoder):
+                chan.flush()
+            if inBlock:
+                if chan.pending is None:
+                    chan.pending = (decoder, [])
+                chan.pending[1].append(e.data)
+                continue
+
+            if compiled is None:
+                a = chan.flattener(msg)
+                arr = numpy.array(a)
+                if not(arr.dtype.kind in "bif"):
+                    chan.flattener = make_flattener(msg, fields)
+                    a = chan.flattener(msg)
+            a.append(0.0)
+            chan.rows.append(a)
+            chan.widths.append(len(a))
+            if collectStats:
+                chan.stats.flattenTime += time.time() - t0
+
+        results = {}
+        for channel, chan in channels.items():
+            results[channel] = chan.result()
+    finally:
+        log.close()
+    return results, ignored, unknown, errors
+
+def convert_parallel(fname, njobs, type_db, selector, printFormat=False, verbose=False,
+        offsets=None, newBuffer=None, stats=None, fields=None):
+    """Convert the channels of a log that selector (a ChannelSelector) does
+    not ignore with a pool of njobs worker processes.
+
+    If offsets is given (see LogIndex.select), only the events at those
+    offsets are converted and they are shared out between the workers instead
+    of byte ranges of the log.
+
+    newBuffer(channel, columns, typename), if given, creates the buffer of
+    each channel instead of a ChannelBuffer.  The statistics of the workers
+    are added to stats, a ConversionStats, if given.  fields are the
+    projections of MatrixConverter.
+
+    Returns (data, msgCount), where data maps each channel to its
+    ChannelBuffer.  Status, format and error messages are written to stderr
+    the same way the serial loop reports them.
+    """
+    if offsets is None:
+        bounds = find_event_boundaries(fname, njobs)
+        ranges = [ (fname, bounds[i], bounds[i+1], None) for i in range(len(bounds) - 1) ]
+    else:
+        ranges = [ (fname, 0, None, part) for part in numpy.array_split(offsets, njobs) ]
+
+    pool = multiprocessing.Pool(njobs, _init_worker,
+            (type_db, selector, printFormat, stats is not None, fields or []))
+    try:
+        chunks = pool.map(_convert_range, ranges)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Channels whose first message had an unknown type are ignored for the
+    # rest of the log, as in the serial loop.
+    dropped = set()
+    ignoredReported = set()
+    startTime = None
+    data = {}
+    msgCount = 0
+    for results, ignored, unknown, errors in chunks:
+        for channel in errors:
+            sys.stderr.write("error: couldn't decode msg on channel %s\n" % channel)
+        for channel, index in sorted(ignored.items(), key=lambda item: item[1]):
+            if verbose and channel not in ignoredReported:
+                if channel in unknown:
+                    sys.stderr.write("ignoring channel %s -not a known LCM type\n" % channel)
+                else:
+                    sys.stderr.write("ignoring channel %s\n" % channel)
+            ignoredReported.add(channel)
+
+        kept = [ (results[c][0], c) for c in results if c not in dropped ]
+        kept.sort()
+        if startTime is None and kept:
+            startTime = results[kept[0][1]][3][0]
+
+        for firstIndex, channel in kept:
+            index, rows, widths, timestamps, formatStr, columns, typename, chanStats = results[channel]
+            rows[numpy.arange(len(rows)), widths - 1] = (timestamps - startTime) / 1e6
+            if channel not in data:
+                if newBuffer is None:
+                    data[channel] = ChannelBuffer()
+                else:
+                    data[channel] = newBuffer(channel, columns, typename)
+                if formatStr:
+                    sys.stderr.write(formatStr)
+            data[channel].extend(rows, widths)
+            if stats is not None:
+                stats.channel(channel).merge(chanStats)
+            msgCount += len(rows)
+        dropped.update(unknown.keys())
+    return data, msgCount
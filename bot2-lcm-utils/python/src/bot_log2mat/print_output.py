@@ -0,0 +1,300 @@
+#
+# Text and binary output of the flattened rows of bot-log2mat: the lines of
+# -p, and the per channel files of --output-format=csv and npy.
+#
+# Rows are collected per channel, as bot-log2mat collects them for a .mat
+# file, and written a block at a time instead of one message at a time.  A
+# block of rows is formatted with a single % operation: the format of one
+# row, repeated for every row, applied to all of the block's values.  Columns
+# whose values in the block are all integers are written as such, the others
+# with the shortest repr that reads back as the same float.
+#
+#   -p    one line per message, "CHANNEL values... log_time", in log order
+#   csv   <prefix>_<channel>.csv, a header line of column names, then a line
+#         per message; only for channels whose messages all have the same
+#         columns, as the header can't name the columns of variable length
+#         messages
+#   npy   <prefix>_<channel>.npy, the little-endian float64 matrix of the
+#         channel, or for channels with variable length messages the rows
+#         back to back, with <prefix>_<channel>_offsets.npy giving the extent
+#         of each row (as --ragged)
+#   npy with --native-types
+#         <prefix>_<channel>.<field>.npy for every numeric field, in the type
+#         it has in the LCM type, the fields of variable length back to back
+#         with <prefix>_<channel>.<field>_offsets.npy, and the float64 log
+#         times in <prefix>_<channel>.log_time.npy
+
+import os
+import numpy
+
+from channel_buffer import RaggedBuffer, FieldBuffer
+from conversion import channel_file_name
+from image_extractor import npy_header, NPY_HEADER_SIZE
+
+# largest float64 below which every integer is exact
+_MAX_EXACT_INT = 2.0 ** 53
+
+def _width_runs(offsets):
+    """Return (start, end, width) of the runs of rows of equal width of a
+    ragged block."""
+    widths = numpy.diff(offsets)
+    bounds = numpy.concatenate(([ 0 ], numpy.nonzero(numpy.diff(widths))[0] + 1,
+            [ len(widths) ]))
+    return [ (int(bounds[i]), int(bounds[i + 1]), int(widths[bounds[i]]))
+            for i in range(len(bounds) - 1) ]
+
+def _runs(buf):
+    """Yield the rows of a RaggedBuffer as 2-d blocks of rows of one width."""
+    values, offsets = buf.arrays()
+    for start, end, width in _width_runs(offsets):
+        yield values[offsets[start]:offsets[end]].reshape(end - start, width)
+
+def format_rows(rows, separator=" ", prefix=""):
+    """Format a 2-d block of rows as lines of text, each starting with
+    prefix, and return them as one string."""
+    count, width = rows.shape
+    if count == 0:
+        return ""
+    integral = (numpy.abs(rows) < _MAX_EXACT_INT) & (rows == numpy.floor(rows))
+    integral = integral.all(axis=0)
+    rowFormat = prefix.replace("%", "%%") + separator.replace("%", "%%").join(
+            [ integral[k] and "%d" or "%r" for k in range(width) ]) + "\n"
+    return (rowFormat * count) % tuple(rows.ravel().tolist())
+
+class LinePrinter(object):
+    """Writes the lines of -p to out: the rows of the buffers it makes, in
+    the order of the messages.
+
+    The converter notes the channel of every message as it is read with
+    add(), and its rows go to the channel's buffer, perhaps later and a block
+    at a time.  write() writes the lines of all the messages noted so far,
+    whose rows must all be in the buffers by then.
+    """
+
+    def __init__(self, out, separator=" "):
+        self.out = out
+        self.separator = separator
+        self.buffers = {}
+        # the channel of every message not written yet
+        self.order = []
+
+    def buffer(self, channel, columns=None, typename=None, layout=None):
+        """newBuffer() of MatrixConverter."""
+        buf = self.buffers[channel] = RaggedBuffer()
+        return buf
+
+    def add(self, channel):
+        self.order.append(channel)
+
+    def pending(self):
+        return len(self.order)
+
+    def write(self):
+        if not self.order:
+            return
+        lines = {}
+        for channel, buf in self.buffers.items():
+            if not len(buf):
+                continue
+            text = "".join([ format_rows(rows, self.separator, channel + self.separator)
+                    for rows in _runs(buf) ])
+            lines[channel] = iter(text.split("\n"))
+            buf.clear()
+        self.out.write("\n".join([ lines[channel].next() for channel in self.order ]) + "\n")
+        del self.order[:]
+
+class ChannelFile(object):
+    """Buffer of a channel that writes its rows to a file, blockSize rows at
+    a time.  It has the interface of ChannelBuffer, without array()."""
+
+    def __init__(self, fname, blockSize=4096):
+        self.fname = fname
+        self.blockSize = blockSize
+        self.file = open(fname, "wb")
+        self._pending = RaggedBuffer()
+        self.nrows = 0
+        self.min_width = None
+        self.max_width = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return self.nrows
+
+    def append(self, row):
+        self._pending.append(row)
+        self._added(1)
+
+    def extend(self, rows, widths=None):
+        rows = numpy.atleast_2d(rows)
+        self._pending.extend(rows, widths)
+        self._added(len(rows))
+
+    def _added(self, count):
+        self.nrows += count
+        buf = self._pending
+        if self.min_width is None or buf.min_width < self.min_width:
+            self.min_width = buf.min_width
+        self.max_width = max(self.max_width, buf.max_width)
+        if len(buf) >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        if len(self._pending):
+            self._write(self._pending)
+            self._pending.clear()
+
+    def close(self):
+        """Write the rows still pending and close the file, and return the
+        names of the files written."""
+        self.flush()
+        self.file.close()
+        return [ self.fname ]
+
+def _variable_length_error(channel):
+    return ValueError("channel %s has variable length messages, which csv can't hold: "
+            "write npy, which gives the extent of each row in _offsets.npy, or select "
+            "fixed length fields with --fields" % channel)
+
+class CsvChannelFile(ChannelFile):
+    """Rows of a channel as CSV, with a header line of column names.  Raises
+    ValueError when given a row of a different width than the header."""
+
+    def __init__(self, fname, columns, blockSize=4096, channel=None):
+        ChannelFile.__init__(self, fname, blockSize)
+        self.channel = channel
+        self.columns = list(columns) + [ "log_time" ]
+        header = ",".join(self.columns) + "\n"
+        self.file.write(header)
+        self.nbytes += len(header)
+
+    def _added(self, count):
+        buf = self._pending
+        if buf.min_width != len(self.columns) or buf.max_width != len(self.columns):
+            raise _variable_length_error(self.channel)
+        ChannelFile._added(self, count)
+
+    def _write(self, buf):
+        for rows in _runs(buf):
+            text = format_rows(rows, ",")
+            self.file.write(text)
+            self.nbytes += len(text)
+
+class NpyChannelFile(ChannelFile):
+    """Rows of a channel as a little-endian .npy file of dtype, float64 by
+    default, see above."""
+
+    def __init__(self, fname, blockSize=4096, dtype="<f8"):
+        ChannelFile.__init__(self, fname, blockSize)
+        self.dtype = numpy.dtype(dtype).newbyteorder("<")
+        self.file.write("\0" * NPY_HEADER_SIZE)
+        self.nvalues = 0
+        # the widths of the rows, in case they vary
+        self.widths = []
+
+    def _write(self, buf):
+        values, offsets = buf.arrays()
+        self.write_values(values, numpy.diff(offsets))
+
+    def write_values(self, values, widths):
+        """Write the values of rows of widths, back to back."""
+        values.astype(self.dtype).tofile(self.file)
+        self.nvalues += len(values)
+        self.nbytes += values.size * self.dtype.itemsize
+        self.widths.append(widths)
+
+    def close(self):
+        self.flush()
+        names = [ self.fname ]
+        widths = numpy.concatenate(self.widths or [ numpy.zeros(0, dtype=numpy.int64) ])
+        self.file.seek(0)
+        if len(widths) == 0 or widths.min() == widths.max():
+            self.file.write(npy_header((len(widths), len(widths) and int(widths[0])),
+                    self.dtype.str))
+        else:
+            self.file.write(npy_header((self.nvalues,), self.dtype.str))
+            offsets = numpy.zeros(len(widths) + 1, dtype="<i8")
+            numpy.cumsum(widths, out=offsets[1:])
+            name = os.path.splitext(self.fname)[0] + "_offsets.npy"
+            numpy.save(name, offsets)
+            self.nbytes += offsets.nbytes
+            names.append(name)
+        self.file.close()
+        return names
+
+class NpyFieldFiles(ChannelFile):
+    """Messages of a channel as a .npy file per field of layout, a RowLayout,
+    of the field's type, see above.  It takes the rows of messages with
+    append(), and blocks of decoded records with extend_records(), as a
+    FieldBuffer does.  The file of the buffer is the one of the log times."""
+
+    def __init__(self, base, layout, blockSize=4096):
+        ChannelFile.__init__(self, base + ".log_time.npy", blockSize)
+        self.file.write("\0" * NPY_HEADER_SIZE)
+        self._pending = FieldBuffer(layout)
+        self.fields = [ NpyChannelFile("%s.%s.npy" % (base, name), blockSize, dtype)
+                for name, dtype in layout.fields ]
+
+    def extend_records(self, fields, times):
+        """Append the fields of a block of messages, from typed_block(), and
+        their log times."""
+        self._pending.extend_records(fields, times)
+        self._added(len(times))
+
+    def _write(self, buf):
+        for fields, times in buf.blocks():
+            times.astype("<f8").tofile(self.file)
+            self.nbytes += len(times) * 8
+            for out, (name, values, widths) in zip(self.fields, fields):
+                if widths is None:
+                    out.write_values(values.ravel(), numpy.repeat(values.shape[1], len(values)))
+                else:
+                    out.write_values(values[numpy.arange(values.shape[1]) < widths[:, None]],
+                            widths)
+
+    def close(self):
+        self.flush()
+        self.file.seek(0)
+        self.file.write(npy_header((self.nrows,), "<f8"))
+        self.file.close()
+        names = [ self.fname ]
+        for out in self.fields:
+            names.extend(out.close())
+            self.nbytes += out.nbytes
+        return names
+
+class ChannelFiles(object):
+    """Per channel csv or npy files of a conversion, named after prefix.
+    With nativeTypes the npy files are the ones of each field."""
+
+    def __init__(self, prefix, outFormat, blockSize=4096, nativeTypes=False):
+        if outFormat not in ("csv", "npy"):
+            raise ValueError("unknown per channel file format %s" % outFormat)
+        self.prefix = prefix
+        self.outFormat = outFormat
+        self.blockSize = blockSize
+        self.nativeTypes = nativeTypes
+        self.channels = {}
+
+    def buffer(self, channel, columns, typename=None, layout=None):
+        """newBuffer() of MatrixConverter."""
+        if self.nativeTypes and layout is not None:
+            buf = NpyFieldFiles(channel_file_name(self.prefix, channel), layout, self.blockSize)
+            self.channels[channel] = buf
+            return buf
+        fname = "%s.%s" % (channel_file_name(self.prefix, channel), self.outFormat)
+        if self.outFormat == "csv":
+            if layout is not None and layout.width is None:
+                raise _variable_length_error(channel)
+            buf = CsvChannelFile(fname, columns, self.blockSize, channel)
+        else:
+            buf = NpyChannelFile(fname, self.blockSize)
+        self.channels[channel] = buf
+        return buf
+
+    def close(self):
+        """Finish the files, and return a dict mapping each channel to the
+        files written for it."""
+        files = {}
+        for channel, buf in self.channels.items():
+            files[channel] = buf.close()
+        return files
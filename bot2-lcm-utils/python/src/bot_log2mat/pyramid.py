@@ -0,0 +1,328 @@
+#
+# Min/max/mean decimation levels of the channels of bot-log2mat --pyramid,
+# for plotting long channels without loading all of their rows.
+#
+# Level f of a channel has a row per f consecutive rows of its matrix, the
+# last one perhaps for fewer, holding the column-wise minimum, maximum and
+# mean of those rows.  The log time is one of the columns, so the min and
+# max of its column are the time span of each row of the level.  The levels
+# are built while the rows are converted, each from the rows of the channel,
+# so only fewer than f rows per level are kept in memory.  They are saved:
+#
+#   mat   as the struct <chan>_pyramid, with a field f<f> for every level
+#         holding its min, max and mean matrices
+#   hdf5  as the datasets pyramid/<f>/min, max and mean of the channel's
+#         group, written as the levels are built
+#
+# Channels with variable length messages get no levels.  load_level() reads
+# the level of a channel that is fine enough for a time window and a plot
+# width, and only that window of it.
+
+import os
+import sys
+import numpy
+
+# check which version for mio location
+if sys.version_info < (2, 6):
+    import scipy.io.mio
+else:
+    import scipy.io.matlab.mio
+
+DEFAULT_FACTORS = (16, 256, 4096)
+STATISTICS = ("min", "max", "mean")
+
+def parse_factors(value):
+    """Parse a comma separated list of decimation factors, e.g. 16,256,4096,
+    into a sorted tuple."""
+    try:
+        factors = sorted(set([ int(f) for f in value.split(",") ]))
+    except ValueError:
+        raise ValueError("invalid pyramid factors %r, expected e.g. 16,256,4096" % value)
+    if not factors or factors[0] < 2:
+        raise ValueError("pyramid factors must be at least 2")
+    return tuple(factors)
+
+def decimate(rows, factor):
+    """Return the (min, max, mean) of every factor rows of a 2-d block, the
+    last rows making a row of their own if there are fewer than factor."""
+    count, width = rows.shape
+    full = count // factor * factor
+    parts = []
+    if full:
+        bins = rows[:full].reshape(full // factor, factor, width)
+        parts.append((bins.min(axis=1), bins.max(axis=1), bins.mean(axis=1)))
+    if full < count:
+        rest = rows[full:]
+        parts.append((rest.min(axis=0)[None], rest.max(axis=0)[None], rest.mean(axis=0)[None]))
+    if len(parts) == 1:
+        return parts[0]
+    return tuple([ numpy.vstack([ p[k] for p in parts ]) for k in range(3) ])
+
+class MemoryLevel(object):
+    """Keeps the rows of a level in memory, for the mat output."""
+
+    def __init__(self):
+        self.parts = []
+
+    def append(self, mins, maxs, means):
+        self.parts.append((mins, maxs, means))
+
+    def arrays(self):
+        return dict([ (name, numpy.vstack([ p[k] for p in self.parts ]))
+                for k, name in enumerate(STATISTICS) ])
+
+    @property
+    def nbytes(self):
+        return sum([ sum([ a.nbytes for a in p ]) for p in self.parts ])
+
+class Hdf5Level(object):
+    """Appends the rows of a level to the pyramid/<factor> datasets of a
+    channel's group."""
+
+    def __init__(self, output, group, factor):
+        self.output = output
+        self.group = group.require_group("pyramid/%d" % factor)
+        self.group.attrs["factor"] = factor
+        self.nrows = 0
+
+    def append(self, mins, maxs, means):
+        count, width = mins.shape
+        for name, rows in zip(STATISTICS, (mins, maxs, means)):
+            if name not in self.group:
+                self.output.create_dataset(self.group, name, (0, width), (None, width),
+                        (max(self.output.blockSize // 16, 1), width))
+            ds = self.group[name]
+            ds.resize((self.nrows + count, width))
+            ds[self.nrows:] = rows
+        self.nrows += count
+
+    def arrays(self):
+        return None
+
+    @property
+    def nbytes(self):
+        width = "min" in self.group and self.group["min"].shape[1] or 0
+        return 3 * self.nrows * width * 8
+
+class PyramidBuffer(object):
+    """Buffer of a channel's rows that also builds its levels.
+
+    It has the interface of the buffer it wraps, to which the rows are
+    passed on, and is fed to the levels a block of rows at a time.
+    """
+
+    def __init__(self, channel, buf, factors, newLevel, blockSize=4096):
+        self.channel = channel
+        self.buf = buf
+        self.factors = factors
+        self.blockSize = blockSize
+        self.levels = [ newLevel(f) for f in factors ]
+        # the rows of each level not making a full row of it yet
+        self.carry = [ None ] * len(factors)
+        self.width = None
+        self.variable = False
+        self._rows = []
+
+    def __len__(self):
+        return len(self.buf)
+
+    @property
+    def min_width(self):
+        return self.buf.min_width
+
+    @property
+    def max_width(self):
+        return self.buf.max_width
+
+    @property
+    def nbytes(self):
+        return self.buf.nbytes + sum([ level.nbytes for level in self.levels ])
+
+    def array(self):
+        return self.buf.array()
+
+    def arrays(self):
+        return self.buf.arrays()
+
+    def flush(self):
+        self.buf.flush()
+
+    def _note_width(self, width):
+        if self.width is None:
+            self.width = width
+        elif width != self.width:
+            self.variable = True
+        return not self.variable
+
+    def append(self, row):
+        self.buf.append(row)
+        if self._note_width(len(row)):
+            self._rows.append(row)
+            if len(self._rows) >= self.blockSize:
+                self._feed_rows()
+
+    def extend(self, rows, widths=None):
+        self.buf.extend(rows, widths)
+        rows = numpy.atleast_2d(rows)
+        if not len(rows):
+            return
+        width = rows.shape[1]
+        if widths is not None:
+            widths = numpy.asarray(widths)
+            if widths.min() != widths.max():
+                self.variable = True
+            width = int(widths[0])
+        if self._note_width(width):
+            self._feed_rows()
+            self._feed(numpy.asarray(rows[:, :width], dtype=numpy.float64))
+
+    def _feed_rows(self):
+        if self._rows and not self.variable:
+            self._feed(numpy.array(self._rows, dtype=numpy.float64))
+        self._rows = []
+
+    def _feed(self, rows):
+        for k, factor in enumerate(self.factors):
+            block = rows
+            if self.carry[k] is not None:
+                block = numpy.vstack((self.carry[k], rows))
+            full = len(block) // factor * factor
+            if full:
+                self.levels[k].append(*decimate(block[:full], factor))
+            self.carry[k] = block[full:].copy()
+
+    def finish(self):
+        """Add the rows still pending to the levels, and return them as a
+        dict mapping f<factor> to their {"min", "max", "mean"} for the mat
+        output, or None for hdf5 output or if the messages have variable
+        length."""
+        self._feed_rows()
+        if self.variable:
+            sys.stderr.write("no pyramid for channel %s, its messages have variable length\n" %
+                    self.channel)
+            group = getattr(self.buf, "group", None)
+            if group is not None and "pyramid" in group:
+                del group["pyramid"]
+            self.levels = []
+            return None
+        result = {}
+        for k, factor in enumerate(self.factors):
+            if self.carry[k] is not None and len(self.carry[k]):
+                self.levels[k].append(*decimate(self.carry[k], factor))
+            self.carry[k] = None
+            arrays = self.levels[k].arrays()
+            if arrays is not None:
+                result["f%d" % factor] = arrays
+        return result or None
+
+def pyramid_factory(newBuffer, factors, h5out=None, blockSize=4096):
+    """Wrap newBuffer(channel, columns, typename, layout) so that the buffers
+    it makes also build the levels of their channel, in memory or in h5out."""
+    def newPyramidBuffer(channel, columns, typename, layout=None):
+        buf = newBuffer(channel, columns, typename, layout)
+        if h5out is None:
+            newLevel = lambda factor: MemoryLevel()
+        else:
+            newLevel = lambda factor: Hdf5Level(h5out, buf.group, factor)
+        return PyramidBuffer(channel, buf, factors, newLevel, blockSize)
+    return newPyramidBuffer
+
+def _window(starts, ends, start, end):
+    """Return the slice of the rows spanning start <= t <= end, given the
+    sorted first and last time of every row."""
+    lo = 0
+    hi = len(starts)
+    if start is not None:
+        lo = numpy.searchsorted(ends, start, "left")
+    if end is not None:
+        hi = numpy.searchsorted(starts, end, "right")
+    return lo, max(hi, lo)
+
+def _pick(levels, start, end, width):
+    """levels maps each factor to a function returning the (first, last)
+    times of its rows.  Return (factor, lo, hi) of the coarsest level with
+    at least width rows in the window, or the finest one."""
+    picked = None
+    for factor in sorted(levels, reverse=True):
+        starts, ends = levels[factor]()
+        lo, hi = _window(starts, ends, start, end)
+        picked = (factor, lo, hi)
+        if hi - lo >= width:
+            break
+    return picked
+
+def load_level(fname, channel, start=None, end=None, width=1000):
+    """Read the rows of a channel for a plot width pixels wide of the log
+    times start to end (in seconds, None for the start or end of the log),
+    from a .mat or hdf5 file written with --pyramid.
+
+    The level picked is the coarsest one with at least width rows in the
+    window, or the channel's own rows if even the finest level has fewer.
+    Returns a dict with the factor of the level (1 for the channel's rows)
+    and the "min", "max" and "mean" matrices of its rows in the window, the
+    last column being the log time.
+    """
+    if os.path.splitext(fname)[1] in (".h5", ".hdf5"):
+        return _load_hdf5_level(fname, channel, start, end, width)
+    return _load_mat_level(fname, channel, start, end, width)
+
+def _level_result(factor, mins, maxs, means):
+    return { "factor" : factor, "min" : mins, "max" : maxs, "mean" : means }
+
+def _raw_window(rows, start, end):
+    lo, hi = _window(rows[:, -1], rows[:, -1], start, end)
+    rows = rows[lo:hi]
+    return _level_result(1, rows, rows, rows)
+
+def _load_mat_level(fname, channel, start, end, width):
+    name = channel + "_pyramid"
+    d = scipy.io.loadmat(fname, variable_names=[ name ], squeeze_me=True,
+            struct_as_record=False)
+    levels = {}
+    if name in d:
+        pyramid = d[name]
+        for field in pyramid._fieldnames:
+            level = getattr(pyramid, field)
+            levels[int(field[1:])] = dict([ (s, numpy.atleast_2d(getattr(level, s)))
+                    for s in STATISTICS ])
+    picked = _pick(dict([ (f, lambda l=l: (l["min"][:, -1], l["max"][:, -1]))
+            for f, l in levels.items() ]), start, end, width)
+    if picked is not None and picked[2] - picked[1] >= width:
+        factor, lo, hi = picked
+        level = levels[factor]
+        return _level_result(factor, *[ level[s][lo:hi] for s in STATISTICS ])
+    d = scipy.io.loadmat(fname, variable_names=[ channel ])
+    if channel not in d:
+        raise ValueError("no channel %s in %s" % (channel, fname))
+    return _raw_window(d[channel], start, end)
+
+def _load_hdf5_level(fname, channel, start, end, width):
+    from hdf5_output import h5py, group_name
+    if h5py is None:
+        raise ImportError("reading hdf5 files needs the h5py module")
+    f = h5py.File(fname, "r")
+    try:
+        name = group_name(channel)
+        if name not in f or "data" not in f[name]:
+            raise ValueError("no channel %s in %s" % (channel, fname))
+        group = f[name]
+        levels = {}
+        if "pyramid" in group:
+            for key in group["pyramid"]:
+                level = group["pyramid"][key]
+                levels[int(key)] = lambda l=level: (l["min"][:, -1], l["max"][:, -1])
+        picked = _pick(levels, start, end, width)
+        if picked is not None and picked[2] - picked[1] >= width:
+            factor, lo, hi = picked
+            level = group["pyramid"]["%d" % factor]
+            return _level_result(factor, *[ level[s][lo:hi] for s in STATISTICS ])
+        # only read the rows of the finest level's window
+        lo = 0
+        hi = group["data"].shape[0]
+        if picked is not None:
+            factor, binLo, binHi = picked
+            lo, hi = binLo * factor, min(binHi * factor, hi)
+        rows = group["data"][lo:hi]
+    finally:
+        f.close()
+    return _raw_window(rows, start, end)
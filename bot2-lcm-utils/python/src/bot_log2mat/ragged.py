@@ -0,0 +1,105 @@
+#
+# Loader for the ragged (CSR) output of bot-log2mat --ragged and
+# bot-log2struct --ragged.
+#
+# A ragged variable is a flat array of values together with an array of
+# offsets: the data of message i is values[offsets[i]:offsets[i+1]].  offsets
+# starts at 0 and has one more element than there are messages.
+#
+#   from bot_log2mat.ragged import load_ragged
+#   d = load_ragged("mylog.mat")
+#   scan = d["LIDAR"][10]         # numpy view of the 11th message
+#   for row in d["LIDAR"]: ...
+
+import numpy
+
+class RaggedArray(object):
+    """Sequence of variable length rows backed by a values and an offsets
+    array.  Indexing returns numpy views into values, nothing is copied."""
+
+    def __init__(self, values, offsets):
+        self.values = numpy.asarray(values).ravel()
+        self.offsets = numpy.asarray(offsets).ravel().astype(numpy.int64)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("row index out of range")
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        values = self.values
+        offsets = self.offsets
+        for i in xrange(len(offsets) - 1):
+            yield values[offsets[i]:offsets[i + 1]]
+
+    def lengths(self):
+        return numpy.diff(self.offsets)
+
+    def padded(self, fill=0):
+        """Return a copy of the rows as a matrix padded with [fill]."""
+        lengths = self.lengths()
+        width = 0
+        if len(lengths):
+            width = lengths.max()
+        result = numpy.empty((len(self), width), dtype=self.values.dtype)
+        result.fill(fill)
+        result[numpy.arange(width) < lengths[:, None]] = self.values
+        return result
+
+def ragged_fields(struct, suffix="__offsets"):
+    """Wrap the ragged fields of a bot-log2struct channel.
+
+    struct maps field names to arrays.  For every NAME__offsets field, the
+    field NAME (a variable length numeric array) and the fields NAME__* (the
+    fields of a list of LCM messages) are replaced with RaggedArrays.
+    """
+    result = dict(struct)
+    for key in struct:
+        if not key.endswith(suffix):
+            continue
+        base = key[:-len(suffix)]
+        offsets = struct[key]
+        for name in struct:
+            if name == key:
+                continue
+            if name == base or name.startswith(base + "__"):
+                result[name] = RaggedArray(struct[name], offsets)
+        del result[key]
+    return result
+
+def _struct_to_dict(value):
+    result = {}
+    for name in value.dtype.names:
+        field = value[name]
+        if field.dtype == object and field.shape == ():
+            field = field.item()
+        result[name] = field
+    return result
+
+def load_ragged(fname):
+    """Load a .mat file written with --ragged.
+
+    bot-log2mat channels stored as {values, offsets} become RaggedArrays and
+    bot-log2struct channels become dicts in which the ragged fields are
+    RaggedArrays.  Other variables are returned as loaded.
+    """
+    from scipy.io import loadmat
+    d = loadmat(fname, squeeze_me=True)
+    result = {}
+    for name, value in d.items():
+        if name.startswith("__"):
+            continue
+        if isinstance(value, numpy.ndarray) and value.dtype.names:
+            fields = _struct_to_dict(value)
+            if set(fields.keys()) == set(["values", "offsets"]):
+                result[name] = RaggedArray(fields["values"], fields["offsets"])
+            else:
+                result[name] = ragged_fields(fields)
+        else:
+            result[name] = value
+    return result
@@ -3,108 +3,387 @@ import re
 import os
 import sys
 import pyclbr
+import binascii
+import cPickle
 
-def find_lcmtypes():
+from lcmtype_idl import is_lcm_directory, load_lcm_types
+
+# Version of the on-disk cache format
+CACHE_VERSION = 2
+
+def cache_filename():
+    """Path of the on-disk cache of discovered LCM types."""
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_dir, "bot-log2mat", "lcmtypes.cache")
+
+def is_valid_modname(mod_basename):
     alpha_chars = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ")
     valid_chars = set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_")
-    lcmtypes = []
-    regex = re.compile("_get_packed_fingerprint")
-    
-    dirs_to_check = sys.path
+    if not mod_basename or mod_basename[0] not in alpha_chars:
+        return False
+    for c in mod_basename:
+        if c not in valid_chars:
+            return False
+    return True
 
-    for dir_name in dirs_to_check:
+def find_package_dirs(package):
+    """Return the directories on sys.path that hold the python package
+    [package], which may be a dotted name."""
+    result = []
+    for dir_name in sys.path:
+        pkg_dir = os.path.join(dir_name or os.curdir, *package.split("."))
+        if os.path.exists(os.path.join(pkg_dir, "__init__.py")) and \
+                pkg_dir not in result:
+            result.append(pkg_dir)
+    return result
+
+def search_roots(lcm_packages=None):
+    """Return a list of (directory, python package) to search for LCM types:
+    the given packages, or every directory on sys.path if lcm_packages is
+    None."""
+    if lcm_packages is None:
+        return [ (dir_name, "") for dir_name in sys.path ]
+    roots = []
+    for package in lcm_packages:
+        for pkg_dir in find_package_dirs(package):
+            roots.append((pkg_dir, package))
+    return roots
+
+def list_python_files(lcm_packages=None):
+    """Walk the search roots and return {module name: (file name, mtime)} for
+    the python modules found there."""
+    modules = {}
+    for dir_name, base_package in search_roots(lcm_packages):
         for root, dirs, files in os.walk(dir_name):
             subdirs = root[len(dir_name):].split(os.sep)
             subdirs = [ s for s in subdirs if s ]
+            if base_package:
+                subdirs.insert(0, base_package)
 
             python_package = ".".join(subdirs)
 
             for fname in files:
                 if not fname.endswith(".py"):
                     continue
-                
+
                 mod_basename = fname[:-3]
-                valid_modname = True
-                for c in mod_basename:
-                    if c not in valid_chars:
-                        valid_modname = False
-                        break
-                if mod_basename[0] not in alpha_chars:
-                    valid_modname = False
-                if not valid_modname:
+                if not is_valid_modname(mod_basename):
                     continue
 
-                # quick regex test -- check if the file contains the 
-                # word "_get_packed_fingerprint"
-                full_fname = os.path.join(root, fname)
-		try: 
-               	    contents = open(full_fname, "r").read()
-		except IOError:
-                    continue
-                if not regex.search(contents):
-                    continue
-                
-                # More thorough check to see if the file corresponds to a
-                # LCM type module genereated by lcm-gen.  Parse the 
-                # file using pyclbr, and check if it contains a class
-                # with the right name and methods
                 if python_package:
                     modname = "%s.%s" % (python_package, mod_basename)
                 else:
                     modname = mod_basename
-                try:
-                    klass = pyclbr.readmodule(modname)[mod_basename]
-                    if "decode" in klass.methods and \
-                       "_get_packed_fingerprint" in klass.methods:
-
-                        lcmtypes.append(modname)
-                except ImportError:
+                if modname in modules:
+                    # shadowed by an earlier entry on the path
                     continue
-                except KeyError:
+                full_fname = os.path.join(root, fname)
+                try:
+                    mtime = os.stat(full_fname).st_mtime
+                except OSError:
                     continue
+                modules[modname] = (full_fname, mtime)
 
-            # only recurse into subdirectories that correspond to python 
+            # only recurse into subdirectories that correspond to python
             # packages (i.e., they contain a file named "__init__.py")
             subdirs_to_traverse = [ subdir_name for subdir_name in dirs \
                     if os.path.exists(os.path.join(root, subdir_name, "__init__.py")) ]
             del dirs[:]
             dirs.extend(subdirs_to_traverse)
+    return modules
+
+def is_lcmtype_module(modname, full_fname):
+    """Check whether a python file is a LCM type module generated by
+    lcm-gen."""
+    # quick regex test -- check if the file contains the
+    # word "_get_packed_fingerprint"
+    try:
+        contents = open(full_fname, "r").read()
+    except IOError:
+        return False
+    if not re.search("_get_packed_fingerprint", contents):
+        return False
+
+    # More thorough check to see if the file corresponds to a
+    # LCM type module genereated by lcm-gen.  Parse the
+    # file using pyclbr, and check if it contains a class
+    # with the right name and methods
+    mod_basename = modname.split(".")[-1]
+    try:
+        klass = pyclbr.readmodule(modname)[mod_basename]
+        return "decode" in klass.methods and \
+               "_get_packed_fingerprint" in klass.methods
+    except ImportError:
+        return False
+    except KeyError:
+        return False
+
+def import_lcmtype(lcmtype_name):
+    __import__(lcmtype_name)
+    mod = sys.modules[lcmtype_name]
+    type_basename = lcmtype_name.split(".")[-1]
+    return getattr(mod, type_basename)
+
+def find_lcmtypes(lcm_packages=None, files=None, cached_files=None):
+    """Return the module names of the LCM types in the given packages (or on
+    all of sys.path).
+
+    files is the result of list_python_files(); cached_files maps module
+    names to the (file name, mtime, is a type) found by an earlier search, so
+    that only new or modified files have to be read.
+    """
+    if files is None:
+        files = list_python_files(lcm_packages)
+    if cached_files is None:
+        cached_files = {}
+    lcmtypes = []
+    for modname in sorted(files.keys()):
+        full_fname, mtime = files[modname]
+        cached = cached_files.get(modname, None)
+        if cached is not None and cached[:2] == (full_fname, mtime):
+            is_type = cached[2]
+        else:
+            is_type = is_lcmtype_module(modname, full_fname)
+        if is_type:
+            lcmtypes.append(modname)
     return lcmtypes
 
-def make_lcmtype_dictionary():
+def imported_type_files(exclude=()):
+    """Return {module name: (file name, mtime)} for the LCM type modules
+    imported so far, except the ones in exclude.  Among them are the nested
+    types the searched types import from packages that were not searched."""
+    result = {}
+    for modname, mod in sys.modules.items():
+        if mod is None or modname in exclude:
+            continue
+        klass = getattr(mod, modname.split(".")[-1], None)
+        fname = getattr(mod, "__file__", None)
+        if not hasattr(klass, "_get_packed_fingerprint") or not fname:
+            continue
+        if fname.endswith(".pyc") or fname.endswith(".pyo"):
+            fname = fname[:-1]
+        try:
+            result[modname] = (fname, os.stat(fname).st_mtime)
+        except OSError:
+            continue
+    return result
+
+def files_unchanged(files):
+    """Check that none of {module name: (file name, mtime)} changed."""
+    for fname, mtime in files.values():
+        try:
+            if os.stat(fname).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+def load_cache():
+    try:
+        f = open(cache_filename(), "rb")
+        try:
+            cache = cPickle.load(f)
+        finally:
+            f.close()
+    except Exception:
+        return {}
+    if not isinstance(cache, dict) or cache.get("version", None) != CACHE_VERSION:
+        return {}
+    return cache
+
+def save_cache(cache):
+    fname = cache_filename()
+    tmp_fname = "%s.%d" % (fname, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        f = open(tmp_fname, "wb")
+        try:
+            cPickle.dump(cache, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp_fname, fname)
+    except (IOError, OSError):
+        # the cache only saves time, so a read-only home directory is fine
+        pass
+
+class LcmTypeDictionary(object):
+    """Dictionary of LCM types keyed by packed fingerprint.
+
+    Only the module name of each type is known up front; the module is
+    imported the first time its fingerprint is looked up, so types that never
+    appear in a log are never imported.
+    """
+
+    def __init__(self, modules):
+        # fingerprint -> module name
+        self._modules = modules
+        # fingerprint -> class, for the types imported so far
+        self._types = {}
+
+    def get(self, fingerprint, default=None):
+        klass = self._types.get(fingerprint, None)
+        if klass is not None:
+            return klass
+        lcmtype_name = self._modules.get(fingerprint, None)
+        if lcmtype_name is None:
+            return default
+        try:
+            klass = import_lcmtype(lcmtype_name)
+        except:
+            print "Error importing %s" % lcmtype_name
+            del self._modules[fingerprint]
+            return default
+        self._types[fingerprint] = klass
+        return klass
+
+    def __getitem__(self, fingerprint):
+        klass = self.get(fingerprint, None)
+        if klass is None:
+            raise KeyError(fingerprint)
+        return klass
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._modules
+
+    def __len__(self):
+        return len(self._modules)
+
+    def __iter__(self):
+        return iter(self._modules)
+
+    def keys(self):
+        return self._modules.keys()
+
+    def module_name(self, fingerprint):
+        return self._modules[fingerprint]
+
+    def with_types(self, classes):
+        """Return a copy of the dictionary with classes added, such as the
+        ones of lcmtype_idl, for the fingerprints it doesn't have."""
+        result = LcmTypeDictionary(dict(self._modules))
+        result._types.update(self._types)
+        for klass in classes:
+            fingerprint = klass._get_packed_fingerprint()
+            if fingerprint not in result._modules:
+                result._modules[fingerprint] = klass.__module__
+                result._types[fingerprint] = klass
+        return result
+
+    def items(self):
+        """Return (fingerprint, class) for every type, importing them all."""
+        result = []
+        for fingerprint in self._modules.keys():
+            klass = self.get(fingerprint, None)
+            if klass is not None:
+                result.append((fingerprint, klass))
+        return result
+
+def make_lcmtype_dictionary(lcm_packages=None, use_cache=True):
     """Create a dictionary of LCM types keyed by fingerprint.
 
-    Searches the specified python package directories for modules 
-    corresponding to LCM types, imports all the discovered types into the
-    global namespace, and returns a dictionary mapping packed fingerprints
-    to LCM type classes.
+    Searches the specified python packages (all of sys.path if lcm_packages
+    is None) for modules corresponding to LCM types, and returns a
+    dictionary mapping packed fingerprints to LCM type classes.  The classes
+    are imported lazily, when they are first looked up.
+
+    The fingerprints are kept in an on-disk cache.  As long as none of the
+    searched python files changed, no file is read and no type is imported
+    to build the dictionary.
 
-    The primary use for this dictionary is to automatically identify and 
+    The primary use for this dictionary is to automatically identify and
     decode an LCM message.
 
     """
-    lcmtypes = find_lcmtypes()
+    files = list_python_files(lcm_packages)
+    if lcm_packages is None:
+        scope = ("", tuple(sys.path))
+    else:
+        scope = (",".join(lcm_packages), tuple(sys.path))
 
-    result = {}
+    cache = {}
+    entry = None
+    if use_cache:
+        cache = load_cache()
+        entry = cache.get(scope, None)
+    cached_files = {}
+    if entry is not None:
+        cached_files = entry["files"]
+
+    lcmtypes = find_lcmtypes(lcm_packages, files, cached_files)
+    lcmtype_set = set(lcmtypes)
+    new_files = dict([ (modname, files[modname] + (modname in lcmtype_set,))
+                for modname in files ])
 
+    # A fingerprint includes the hashes of the nested types, so they are all
+    # recomputed if any of the type modules changed, or any of the modules of
+    # nested types outside the searched packages
+    type_files = dict([ (modname, files[modname]) for modname in lcmtypes ])
+    if entry is not None and entry["type_files"] == type_files and \
+            files_unchanged(entry["nested_files"]):
+        if new_files != cached_files:
+            entry["files"] = new_files
+            save_cache(cache)
+        return LcmTypeDictionary(dict(entry["fingerprints"]))
+
+    result = LcmTypeDictionary({})
+    fingerprints = {}
     for lcmtype_name in lcmtypes:
         try:
-            __import__(lcmtype_name)
-            mod = sys.modules[lcmtype_name]
-            type_basename = lcmtype_name.split(".")[-1]
-            klass = getattr(mod, type_basename)
+            klass = import_lcmtype(lcmtype_name)
             fingerprint = klass._get_packed_fingerprint()
-            result[fingerprint] = klass
-            #print "importing %s" % lcmtype_name
         except:
             print "Error importing %s" % lcmtype_name
+            continue
+        fingerprints[fingerprint] = lcmtype_name
+        result._modules[fingerprint] = lcmtype_name
+        result._types[fingerprint] = klass
+
+    if use_cache:
+        cache["version"] = CACHE_VERSION
+        cache[scope] = {
+            "files" : new_files,
+            "type_files" : type_files,
+            "nested_files" : imported_type_files(type_files),
+            "fingerprints" : fingerprints,
+        }
+        save_cache(cache)
     return result
- 
+
+# dictionaries made in this process, keyed by lcm_packages and sys.path
+_dictionaries = {}
+
+def get_lcmtype_dictionary(lcm_packages=None):
+    """Return the dictionary of make_lcmtype_dictionary(lcm_packages), made
+    only once per process.
+
+    Entries of lcm_packages that are directories of .lcm files add the types
+    they define (see lcmtype_idl.py) to the ones of the other packages, or of
+    all of sys.path if there are no others.
+
+    The python path is not searched again, so types installed after the
+    first call are not found.
+    """
+    key = (lcm_packages is not None and tuple(lcm_packages) or None, tuple(sys.path))
+    result = _dictionaries.get(key, None)
+    if result is None:
+        lcm_dirs = [ p for p in lcm_packages or [] if is_lcm_directory(p) ]
+        packages = [ p for p in lcm_packages or [] if p not in lcm_dirs ]
+        if lcm_packages is None or (lcm_dirs and not packages):
+            packages = None
+        result = make_lcmtype_dictionary(packages)
+        if lcm_dirs:
+            result = result.with_types(load_lcm_types(lcm_dirs).values())
+        _dictionaries[key] = result
+    return result
+
 if __name__ == "__main__":
-    import binascii
+    lcm_packages = None
+    if len(sys.argv) > 1:
+        lcm_packages = sys.argv[1].split(",")
     print("Searching for LCM types...")
-    lcmtypes = make_lcmtype_dictionary()
+    lcmtypes = make_lcmtype_dictionary(lcm_packages)
     num_types = len(lcmtypes)
     print("Found %d type%s" % (num_types, num_types==1 and "" or "s"))
-    for fingerprint, klass in lcmtypes.items():
-        print binascii.hexlify(fingerprint), klass.__module__
+    for fingerprint in lcmtypes.keys():
+        print binascii.hexlify(fingerprint), lcmtypes.module_name(fingerprint)
@@ -0,0 +1,277 @@
+#
+# Out-of-core storage of the channels of bot-log2mat --memory-limit, for mat
+# conversions larger than memory.
+#
+# The channels are buffered in memory as usual until their buffers together
+# take more than the limit.  Then the largest of them are spilled to disk:
+# their rows move to segment files in a temporary directory, each a memmap of
+# a fixed number of rows, and their later rows are added to the segments a
+# block at a time.  A segment is stored column by column, so that the matrix
+# of a channel can be put together a column at a time in the order of a .mat
+# file: array() writes it to a single Fortran ordered memmap, which
+# append_mat_matrix() copies to the .mat file a chunk at a time.  Only the
+# pages of the memmaps being read or written are in memory.
+#
+# Channels buffered with --ragged are not spilled.
+
+import os
+import atexit
+import shutil
+import struct
+import tempfile
+import numpy
+
+from channel_buffer import ChannelBuffer
+
+# size of the segment files
+SEGMENT_BYTES = 64 << 20
+# rows of a spilled channel kept in memory before they are added to its segments
+SPILL_ROWS = 4096
+
+def parse_memory_limit(value):
+    """Parse a memory limit in megabytes, e.g. 2048, into bytes."""
+    try:
+        limit = float(value)
+    except ValueError:
+        raise ValueError("invalid memory limit %r, expected megabytes" % value)
+    if limit <= 0:
+        raise ValueError("the memory limit must be positive")
+    return int(limit * (1 << 20))
+
+class MemoryBudget(object):
+    """The memory the buffers of a conversion may take, limit bytes, and the
+    directory of the segments of the ones spilled to disk, a temporary
+    directory made in directory (by default the system's)."""
+
+    def __init__(self, limit, directory=None, segmentBytes=SEGMENT_BYTES):
+        self.limit = limit
+        self.directory = directory
+        self.segmentBytes = segmentBytes
+        self.used = 0
+        self.buffers = []
+        self.spilledBytes = 0
+        self._tmpdir = None
+        self._count = 0
+
+    def buffer(self, channel=None, columns=None, typename=None, layout=None):
+        """newBuffer() of MatrixConverter."""
+        buf = SpillingBuffer(self, channel)
+        self.buffers.append(buf)
+        return buf
+
+    def resized(self, delta):
+        """Note that a buffer in memory grew by delta bytes, and spill the
+        largest buffers while the limit is exceeded."""
+        self.used += delta
+        while self.used > self.limit:
+            inMemory = [ buf for buf in self.buffers if not buf.spilled and buf.memoryBytes ]
+            if not inMemory:
+                break
+            max(inMemory, key=lambda buf: buf.memoryBytes).spill()
+
+    def new_file(self, suffix=""):
+        """Return the name of a new file in the temporary directory."""
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix="bot-log2mat-", dir=self.directory)
+            atexit.register(self.cleanup)
+        self._count += 1
+        return os.path.join(self._tmpdir, "%d%s" % (self._count, suffix))
+
+    def cleanup(self):
+        """Remove the temporary directory.  The memmaps returned by array()
+        stay readable until they are closed."""
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, True)
+            self._tmpdir = None
+
+class Segment(object):
+    """A file of up to capacity rows of ncols columns, stored column by
+    column.  It is mapped only while rows are added to it or read."""
+
+    def __init__(self, fname, ncols, capacity):
+        self.fname = fname
+        self.ncols = ncols
+        self.capacity = capacity
+        self.nrows = 0
+        self.data = numpy.memmap(fname, dtype=numpy.float64, mode="w+", shape=(ncols, capacity))
+
+    def full(self):
+        return self.nrows == self.capacity
+
+    def add(self, rows):
+        """Add as many of a 2-d block of rows as fit, and return how many."""
+        count = min(len(rows), self.capacity - self.nrows)
+        self.data[:rows.shape[1], self.nrows:self.nrows + count] = rows[:count].T
+        self.nrows += count
+        if self.full():
+            self.close()
+        return count
+
+    def close(self):
+        if self.data is not None:
+            self.data.flush()
+            self.data = None
+
+    def columns(self):
+        """Return the (ncols, nrows) memmap of the rows of the segment."""
+        self.close()
+        data = numpy.memmap(self.fname, dtype=numpy.float64, mode="r",
+                shape=(self.ncols, self.capacity))
+        return data[:, :self.nrows]
+
+class SpillingBuffer(object):
+    """Buffer of a channel that is a ChannelBuffer until its MemoryBudget
+    spills it, and then keeps its rows in segment files.
+
+    It has the interface of ChannelBuffer.  Once the buffer is spilled,
+    array() returns a Fortran ordered numpy.memmap of the matrix.
+    """
+
+    def __init__(self, budget, channel=None):
+        self.budget = budget
+        self.channel = channel
+        self._memory = ChannelBuffer()
+        self.memoryBytes = 0
+        # the segments once the buffer is spilled, and the rows and widths in them
+        self.segments = None
+        self._nrows = 0
+        self._minWidth = None
+        self._maxWidth = 0
+        self._array = None
+        self._resized()
+
+    @property
+    def spilled(self):
+        return self.segments is not None
+
+    def __len__(self):
+        return self._nrows + len(self._memory)
+
+    @property
+    def min_width(self):
+        widths = [ w for w in (self._minWidth, self._memory.min_width) if w is not None ]
+        return widths and min(widths) or None
+
+    @property
+    def max_width(self):
+        return max(self._maxWidth, self._memory.max_width)
+
+    @property
+    def nbytes(self):
+        """Size of the output matrix."""
+        return len(self) * self.max_width * 8
+
+    def _resized(self):
+        if self.segments is None:
+            allocated = self._memory.allocated
+            if allocated != self.memoryBytes:
+                delta = allocated - self.memoryBytes
+                self.memoryBytes = allocated
+                self.budget.resized(delta)
+        elif len(self._memory) >= SPILL_ROWS:
+            self._write_rows()
+
+    def append(self, row):
+        self._memory.append(row)
+        self._resized()
+
+    def extend(self, rows, widths=None):
+        self._memory.extend(rows, widths)
+        self._resized()
+
+    def spill(self):
+        """Move the rows in memory to segment files, where the later rows
+        are added too."""
+        if self.segments is not None:
+            return
+        self.segments = []
+        self._write_rows()
+        self.budget.used -= self.memoryBytes
+        self.memoryBytes = 0
+
+    def _write_rows(self):
+        buf = self._memory
+        if len(buf):
+            rows = buf.array()
+            done = 0
+            while done < len(rows):
+                seg = self.segments and self.segments[-1] or None
+                if seg is None or seg.full() or seg.ncols < rows.shape[1]:
+                    if seg is not None:
+                        seg.close()
+                    ncols = max(rows.shape[1], 1)
+                    seg = Segment(self.budget.new_file(".seg"), ncols,
+                            max(self.budget.segmentBytes // (ncols * 8), 1))
+                    self.segments.append(seg)
+                done += seg.add(rows[done:])
+            self.budget.spilledBytes += rows.nbytes
+            self._nrows += len(rows)
+            if self._minWidth is None or buf.min_width < self._minWidth:
+                self._minWidth = buf.min_width
+            self._maxWidth = max(self._maxWidth, buf.max_width)
+        self._memory = ChannelBuffer(capacity=SPILL_ROWS)
+
+    def array(self):
+        """Return the matrix of the rows, zero padded to the widest."""
+        if self.segments is None:
+            return self._memory.array()
+        if self._array is None:
+            self._write_rows()
+            nrows, ncols = self._nrows, self._maxWidth
+            if nrows == 0 or ncols == 0:
+                return numpy.zeros((nrows, ncols))
+            matrix = numpy.memmap(self.budget.new_file(".mat"), dtype=numpy.float64,
+                    mode="w+", shape=(nrows, ncols), order="F")
+            row = 0
+            for seg in self.segments:
+                columns = seg.columns()
+                width = min(seg.ncols, ncols)
+                matrix[row:row + seg.nrows, :width] = columns[:width].T
+                row += seg.nrows
+                del columns
+            matrix.flush()
+            self._array = matrix
+        return self._array
+
+# MAT-file v5 data types and array class of the elements written below
+_miINT8 = 1
+_miINT32 = 5
+_miUINT32 = 6
+_miDOUBLE = 9
+_miMATRIX = 14
+_mxDOUBLE_CLASS = 6
+
+def is_spilled_matrix(value):
+    """Whether value is a matrix of a spilled buffer, which savemat() would
+    copy into memory to write it."""
+    return isinstance(value, numpy.memmap) and value.ndim == 2 and \
+            value.flags.f_contiguous and value.dtype == numpy.float64
+
+def append_mat_matrix(outFname, name, matrix, chunkBytes=16 << 20):
+    """Append a float64 matrix to the .mat file (v5, uncompressed) outFname,
+    as the variable name, copying it a few columns at a time."""
+    f = open(outFname, "r+b")
+    try:
+        f.seek(126)
+        order = f.read(2) == "IM" and "<" or ">"
+        f.seek(0, 2)
+        nrows, ncols = matrix.shape
+        dataBytes = nrows * ncols * 8
+        if len(name) <= 4:
+            nameElement = struct.pack(order + "I", (len(name) << 16) | _miINT8) + \
+                    name.ljust(4, "\0")
+        else:
+            nameElement = struct.pack(order + "II", _miINT8, len(name)) + \
+                    name.ljust((len(name) + 7) // 8 * 8, "\0")
+        body = struct.pack(order + "IIII", _miUINT32, 8, _mxDOUBLE_CLASS, 0) + \
+                struct.pack(order + "IIii", _miINT32, 8, nrows, ncols) + nameElement + \
+                struct.pack(order + "II", _miDOUBLE, dataBytes)
+        if len(body) + dataBytes >= 1 << 32:
+            raise ValueError("channel %s is too large for a .mat file, use hdf5 output" % name)
+        f.write(struct.pack(order + "II", _miMATRIX, len(body) + dataBytes) + body)
+        step = max(chunkBytes // max(nrows * 8, 1), 1)
+        for col in range(0, ncols, step):
+            chunk = numpy.asarray(matrix[:, col:col + step], dtype=order + "f8")
+            f.write(chunk.tostring(order="F"))
+    finally:
+        f.close()